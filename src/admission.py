@@ -0,0 +1,340 @@
+# admission.py
+# 목적: 한 사람이 "LLM 분석 실행" 을 연타해도 다른 사용자가 굶지 않도록 generate 앞단에서 입장 제어
+# - 전역 동시 실행 상한: generate 호출(단일 / 스트리밍 / 배치 버킷 1개) 단위로 MIDM_MAX_CONCURRENT 개까지
+# - 대기열 상한(MIDM_ADMISSION_QUEUE_MAX, 넘치면 바로 거절) + 대기 시간 상한(MIDM_ADMISSION_TIMEOUT_S)
+# - 우선순위 lane: interactive(단일 매물) 가 bulk(멀티 비교 / map / 대량 배치) 보다 먼저.
+#   interactive 가 연속 MIDM_ADMISSION_BULK_EVERY 번 자리를 받으면 bulk 에 1번 양보 (bulk 굶김 방지)
+# - lane 안에서는 세션 round-robin: 가장 오래 전에 자리를 받은 세션부터 (세션 안에서는 도착 순)
+# - 세션별 동시 요청 상한(MIDM_SESSION_MAX_ACTIVE): 같은 세션이 이미 그만큼 분석 중이면 새 요청은 거절
+# - 대기 순번 / 예상 대기(ETA): position(ticket), status(session_id) → 스트리밍 "queued" 이벤트, RPC queue_status
+# - 대기 중인 ticket 은 degraded.load 의 대기 깊이에도 센다 (과부하 판단이 이 대기열까지 본다)
+from __future__ import annotations
+
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Literal, Optional, Sequence, Tuple, TypeVar
+
+import degraded
+import metrics
+
+ADMISSION_ENABLED = os.getenv("MIDM_ADMISSION", "1") not in ("0", "false", "False")
+MAX_CONCURRENT = int(os.getenv("MIDM_MAX_CONCURRENT", "1"))            # GPU 1장 기준: generate 는 한 번에 하나
+QUEUE_MAX = int(os.getenv("MIDM_ADMISSION_QUEUE_MAX", "32"))           # 대기 ticket 수 (0 이면 무제한)
+QUEUE_TIMEOUT_S = float(os.getenv("MIDM_ADMISSION_TIMEOUT_S", "120"))  # 자리를 못 받고 기다리는 최대 시간
+SESSION_MAX_ACTIVE = int(os.getenv("MIDM_SESSION_MAX_ACTIVE", "2"))    # 세션당 동시 요청 (0 이면 무제한)
+BULK_EVERY = int(os.getenv("MIDM_ADMISSION_BULK_EVERY", "4"))          # 0 이면 bulk 는 interactive 가 없을 때만
+POLL_S = float(os.getenv("MIDM_ADMISSION_POLL_S", "0.5"))              # 대기 중 순번 갱신 주기
+SERVED_TRACK = 4096   # round-robin 용으로 기억할 세션 수
+
+Lane = Literal["interactive", "bulk"]
+LANES: Tuple[Lane, ...] = ("interactive", "bulk")   # 앞쪽이 우선
+
+ANONYMOUS = "-"   # session_id 가 없는 호출 (CLI / 대량 배치) 은 한 세션으로 본다
+
+
+class AdmissionError(RuntimeError):
+    """입장 제어로 요청을 받지 못함 (화면에 그대로 보여줄 수 있는 문장)."""
+
+
+class QueueFull(AdmissionError):
+    pass
+
+
+class SessionBusy(AdmissionError):
+    pass
+
+
+class AdmissionTimeout(AdmissionError):
+    pass
+
+
+# ==============================
+# 1. 공정 순서 (스케줄러 job 선택에도 같이 쓴다)
+# ==============================
+
+T = TypeVar("T")
+
+
+def fair_order(
+    items: Sequence[T],
+    lane_of: Callable[[T], str],
+    session_of: Callable[[T], Hashable],
+    last_served: Optional[Dict[Hashable, int]] = None,
+    streak: int = 0,
+    bulk_every: int = BULK_EVERY,
+) -> List[T]:
+    """
+    items(도착 순) → 자리를 받을 순서.
+    - lane 우선순위 (LANES 순), 단 interactive 가 streak 번 연속이면 bulk 1개
+    - lane 안에서는 last_served(세션 → 마지막으로 자리를 받은 순번) 가 작은 세션부터 1개씩 돌아가며
+    """
+    lanes: Dict[str, "OrderedDict[Hashable, deque]"] = {lane: OrderedDict() for lane in LANES}
+    for it in items:
+        lanes[lane_of(it)].setdefault(session_of(it), deque()).append(it)
+    served = dict(last_served or {})
+    for lane, sessions in lanes.items():
+        ordered = sorted(sessions.items(), key=lambda kv: served.get(kv[0], -1))   # 안정 정렬 → 동률은 도착 순
+        lanes[lane] = OrderedDict(ordered)
+
+    out: List[T] = []
+    interactive, bulk = lanes["interactive"], lanes["bulk"]
+    while interactive or bulk:
+        if interactive and not (bulk and bulk_every > 0 and streak >= bulk_every):
+            queue, streak = interactive, streak + 1
+        else:
+            queue, streak = bulk, 0
+        session, pending = queue.popitem(last=False)
+        out.append(pending.popleft())
+        if pending:
+            queue[session] = pending   # 방금 받은 세션은 그 lane 맨 뒤로
+    return out
+
+
+# ==============================
+# 2. 입장 제어
+# ==============================
+
+class Ticket:
+    """generate 1회분 자리 요청. granted 가 set 되면 실행해도 된다."""
+
+    __slots__ = ("session", "lane", "seq", "enqueued_at", "granted_at", "state", "_granted")
+
+    def __init__(self, session: Hashable, lane: Lane, seq: int):
+        self.session = session
+        self.lane = lane
+        self.seq = seq
+        self.enqueued_at = time.perf_counter()
+        self.granted_at: Optional[float] = None
+        self.state = "waiting"   # waiting → running → done (또는 waiting → done: 취소 / 시간 초과)
+        self._granted = threading.Event()
+
+    @property
+    def granted(self) -> bool:
+        return self._granted.is_set()
+
+
+class AdmissionController:
+    """
+    프로세스 전역 입장 제어.
+    - slot(session_id, lane): generate 1회를 감싼다 (자리를 받을 때까지 블로킹, 시간 초과면 AdmissionTimeout)
+    - enter / waiting / release: 스트리밍처럼 기다리는 동안 순번을 내보내야 하는 호출용
+    - request(session_id): 요청 1건 (생성 여러 번일 수 있음) 을 감싸서 세션별 동시 요청 수를 제한
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT,
+        queue_max: int = QUEUE_MAX,
+        timeout_s: float = QUEUE_TIMEOUT_S,
+        session_max_active: int = SESSION_MAX_ACTIVE,
+        bulk_every: int = BULK_EVERY,
+        enabled: bool = ADMISSION_ENABLED,
+    ):
+        self.max_concurrent = max(1, max_concurrent)
+        self.queue_max = queue_max
+        self.timeout_s = timeout_s
+        self.session_max_active = session_max_active
+        self.bulk_every = bulk_every
+        self.enabled = enabled
+        self._seq = itertools.count()
+        self._waiting: List[Ticket] = []          # 도착 순
+        self._running = 0
+        self._streak = 0                          # interactive 연속 입장 수
+        self._tick = 0
+        self._last_served: Dict[Hashable, int] = {}
+        self._active: Dict[Hashable, int] = {}    # 세션 → 진행 중 요청 수
+        self._stats = {"admitted": 0, "rejected": 0, "timeout": 0, "cancelled": 0, "session_busy": 0}
+        self._lock = threading.Lock()
+
+    # ---------- 요청 단위 (세션별 상한) ----------
+    def begin_request(self, session_id: Optional[str]):
+        """세션의 진행 중 요청 +1. 이미 상한이면 SessionBusy. (session_id 가 없으면 세지 않는다)"""
+        if not self.enabled or not session_id or self.session_max_active <= 0:
+            return
+        with self._lock:
+            n = self._active.get(session_id, 0)
+            if n >= self.session_max_active:
+                self._stats["session_busy"] += 1
+                metrics.observe_admission("-", "session_busy")
+                raise SessionBusy(f"이미 진행 중인 분석이 {n}건 있습니다. 끝난 뒤에 다시 실행해 주세요.")
+            self._active[session_id] = n + 1
+
+    def end_request(self, session_id: Optional[str]):
+        if not self.enabled or not session_id or self.session_max_active <= 0:
+            return
+        with self._lock:
+            n = self._active.get(session_id, 0) - 1
+            if n > 0:
+                self._active[session_id] = n
+            else:
+                self._active.pop(session_id, None)
+
+    @contextmanager
+    def request(self, session_id: Optional[str]) -> Iterator[None]:
+        self.begin_request(session_id)
+        try:
+            yield
+        finally:
+            self.end_request(session_id)
+
+    # ---------- generate 단위 (전역 상한 + 공정 대기열) ----------
+    def enter(self, session_id: Optional[str], lane: Lane = "interactive") -> Ticket:
+        """대기열에 ticket 을 넣는다 (자리가 비어 있으면 바로 granted). 대기열이 가득 차면 QueueFull."""
+        if lane not in LANES:
+            raise ValueError(f"unknown lane: {lane}")
+        ticket = Ticket(session_id or ANONYMOUS, lane, next(self._seq))
+        if not self.enabled:
+            ticket.state = "running"
+            ticket._granted.set()
+            return ticket
+        with self._lock:
+            if self.queue_max > 0 and len(self._waiting) >= self.queue_max:
+                self._stats["rejected"] += 1
+                metrics.observe_admission(lane, "rejected")
+                raise QueueFull(f"대기 중인 요청이 너무 많습니다({len(self._waiting)}건). 잠시 후 다시 시도해 주세요.")
+            self._waiting.append(ticket)
+            degraded.load.enqueue()
+            self._dispatch_locked()
+        return ticket
+
+    def wait(self, ticket: Ticket, timeout: Optional[float] = None) -> bool:
+        return ticket._granted.wait(timeout)
+
+    def waiting(self, ticket: Ticket) -> Iterator[Tuple[int, Optional[float]]]:
+        """
+        자리를 받을 때까지 (대기 순번 1-based, 예상 대기 초) 를 바로 한 번, 이후 POLL_S 마다 yield.
+        시간 초과면 ticket 을 빼고 AdmissionTimeout.
+        """
+        deadline = ticket.enqueued_at + self.timeout_s if self.timeout_s > 0 else None
+        while not ticket.granted:
+            pos = self.position(ticket)
+            if pos is not None:
+                yield pos, self.eta_s(pos)
+            if ticket._granted.wait(POLL_S):
+                return
+            if deadline is not None and time.perf_counter() >= deadline:
+                self._expire(ticket)
+                return
+
+    def acquire(self, session_id: Optional[str], lane: Lane = "interactive") -> Ticket:
+        """enter + 자리를 받을 때까지 블로킹."""
+        ticket = self.enter(session_id, lane)
+        for _ in self.waiting(ticket):
+            pass
+        return ticket
+
+    def release(self, ticket: Ticket):
+        """실행이 끝났거나 대기를 그만둘 때 (여러 번 불러도 된다)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if ticket.state == "running":
+                self._running -= 1
+            elif ticket.state == "waiting":
+                self._remove_waiting_locked(ticket)
+                self._stats["cancelled"] += 1
+            ticket.state = "done"
+            self._dispatch_locked()
+
+    @contextmanager
+    def slot(self, session_id: Optional[str], lane: Lane = "interactive") -> Iterator[Ticket]:
+        ticket = self.acquire(session_id, lane)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    # ---------- 순번 / ETA ----------
+    def position(self, ticket: Ticket) -> Optional[int]:
+        """대기 순번 (1 = 다음 차례). 이미 자리를 받았거나 대기열에 없으면 None."""
+        with self._lock:
+            if ticket.state != "waiting":
+                return None
+            order = self._order_locked()
+        for n, t in enumerate(order):
+            if t is ticket:
+                return n + 1
+        return None
+
+    def eta_s(self, position: int) -> Optional[float]:
+        """순번 → 예상 대기 초 (generate 1회 시간 EWMA 기준, 아직 측정값이 없으면 None)."""
+        per_request = degraded.load.per_request_s()
+        if per_request is None:
+            return None
+        rounds = (max(1, position) - 1) // self.max_concurrent + 1
+        return round(rounds * per_request, 1)
+
+    def status(self, session_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """세션의 가장 앞선 대기 ticket 의 {"position", "eta_s", "lane"} (대기 중이 아니면 None)."""
+        session = session_id or ANONYMOUS
+        with self._lock:
+            order = self._order_locked()
+        for n, t in enumerate(order):
+            if t.session == session:
+                return {"position": n + 1, "eta_s": self.eta_s(n + 1), "lane": t.lane}
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["running"] = self._running
+            out["waiting"] = {lane: sum(t.lane == lane for t in self._waiting) for lane in LANES}
+            out["active_sessions"] = len(self._active)
+        out["max_concurrent"] = self.max_concurrent
+        out["enabled"] = self.enabled
+        return out
+
+    # ---------- 내부 ----------
+    def _order_locked(self) -> List[Ticket]:
+        return fair_order(
+            self._waiting,
+            lane_of=lambda t: t.lane,
+            session_of=lambda t: t.session,
+            last_served=self._last_served,
+            streak=self._streak,
+            bulk_every=self.bulk_every,
+        )
+
+    def _remove_waiting_locked(self, ticket: Ticket):
+        self._waiting.remove(ticket)
+        degraded.load.dequeue()
+
+    def _dispatch_locked(self):
+        while self._waiting and self._running < self.max_concurrent:
+            ticket = self._order_locked()[0]
+            self._remove_waiting_locked(ticket)
+            self._running += 1
+            self._streak = self._streak + 1 if ticket.lane == "interactive" else 0
+            self._tick += 1
+            self._last_served[ticket.session] = self._tick
+            ticket.state = "running"
+            ticket.granted_at = time.perf_counter()
+            ticket._granted.set()
+            self._stats["admitted"] += 1
+            metrics.observe_admission(ticket.lane, "admitted", (ticket.granted_at - ticket.enqueued_at) * 1000.0)
+        # 오래전에 받은 세션부터 잊는다 (잊힌 세션은 처음 온 세션처럼 맨 앞 → 오래 쉰 세션이라 괜찮다)
+        if len(self._last_served) > SERVED_TRACK:
+            recent = sorted(self._last_served.items(), key=lambda kv: kv[1])[-SERVED_TRACK // 2:]
+            self._last_served = dict(recent)
+
+    def _expire(self, ticket: Ticket):
+        with self._lock:
+            if ticket.state != "waiting":
+                return   # 마지막 순간에 자리를 받았다
+            self._remove_waiting_locked(ticket)
+            ticket.state = "done"
+            self._stats["timeout"] += 1
+        metrics.observe_admission(ticket.lane, "timeout")
+        raise AdmissionTimeout(f"{self.timeout_s:.0f}초 동안 차례가 오지 않았습니다. 잠시 후 다시 시도해 주세요.")
+
+
+controller = AdmissionController()
+
+
+def stats() -> Dict[str, Any]:
+    """입장 제어 현황 (RPC stats 의 admission)."""
+    return controller.stats()
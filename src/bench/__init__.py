@@ -0,0 +1,5 @@
+# bench
+# 목적: 추론 파이프라인 단계별 성능 벤치마크 (python -m bench)
+# - 단계: build_prompt / build_multi_prompt / chat 템플릿 토큰화 / prefill / 토큰별 decode / _safe_json_extract / 정규화
+# - 같은 구조(LlamaForCausalLM)의 작은 랜덤 모델 + 오프라인 학습 토크나이저로 돌려서 가중치 다운로드 없이 회귀 감지
+# - 결과는 JSON 으로 저장하고, 이전 결과(baseline)와 비교
@@ -0,0 +1,66 @@
+# python -m bench (src 디렉터리에서 실행)
+#   python -m bench                                  # 작은 랜덤 모델로 측정 → bench_result.json
+#   python -m bench --baseline bench_baseline.json   # 이전 결과와 비교 (회귀면 exit 1)
+#   python -m bench --model K-intelligence/Midm-2.0-Mini-Instruct   # 실제 모델로 측정
+import argparse
+import json
+import os
+import sys
+
+from bench.runner import compare, run_corpus
+from bench.tiny_model import DEFAULT_DIR, build_tiny_model
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load_corpus(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="inference 파이프라인 단계별 벤치마크")
+    parser.add_argument("--corpus", type=str, default=os.path.join(HERE, "corpus.jsonl"))
+    parser.add_argument("--out", type=str, default="bench_result.json")
+    parser.add_argument("--baseline", type=str, default=None, help="비교할 이전 결과 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="허용 악화 비율 (0.2 = 20%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="이보다 작은 시간 차이는 회귀로 보지 않음")
+    parser.add_argument("--model", type=str, default=None, help="생략하면 작은 랜덤 모델 사용 (오프라인)")
+    parser.add_argument("--tiny-dir", type=str, default=DEFAULT_DIR)
+    parser.add_argument("--max_new_tokens", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    cases = _load_corpus(args.corpus)
+    model_id = args.model or build_tiny_model(cases, out_dir=args.tiny_dir)
+
+    result = run_corpus(cases, model_id, max_new_tokens=args.max_new_tokens, repeats=args.repeats)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(f"\n=== bench ({result['meta']['cases']} cases x {args.repeats}, model={model_id}) ===")
+    for name, s in result["stages"].items():
+        print(f"{name:>20}  p50={s['p50_ms']:>10.3f} ms  p95={s['p95_ms']:>10.3f} ms  (n={s['n']})")
+    print(f"{'ttft':>20}  p50={result['ttft']['p50_ms']:>10.3f} ms  p95={result['ttft']['p95_ms']:>10.3f} ms")
+    print(f"{'decode':>20}  {result['decode']['tokens_per_sec']} tok/s")
+    print(f"saved: {args.out}")
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    rows = compare(result, baseline, tolerance=args.tolerance, min_delta_ms=args.min_delta_ms)
+    print(f"\n=== vs baseline ({args.baseline}, tolerance={args.tolerance:.0%}) ===")
+    for r in rows:
+        flag = "REGRESSION" if r["regressed"] else ""
+        print(f"{r['metric']:>28}  {r['baseline']:>10} → {r['current']:>10}  x{r['ratio']:<6} {flag}")
+    regressions = [r for r in rows if r["regressed"]]
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
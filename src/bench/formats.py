@@ -0,0 +1,151 @@
+# bench/formats.py
+# 목적: 매물 직렬화 형식(listing_format)별 프롬프트 토큰 수 비교 + 출력 품질 가드
+#   python -m bench.formats                                   # 작은 랜덤 모델 토크나이저로 토큰 수만
+#   python -m bench.formats --model K-intelligence/Midm-2.0-Mini-Instruct            # 실제 토크나이저
+#   python -m bench.formats --model K-intelligence/Midm-2.0-Mini-Instruct --guard    # + 품질 가드 (exit 1 = 회귀)
+# - 토큰 수는 chat 템플릿까지 포함한 prefill 길이. 멀티는 토큰 예산 압축을 끄고 같은 내용 기준으로 잰다
+# - 품질 가드는 json(기존 형식) 출력을 기준으로 파싱 성공률 / risk_level / fit_score(±0.5) / best_index 일치율
+#   (랜덤 모델은 JSON 을 못 만들어서 의미가 없으므로 --guard 는 실제 모델로)
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List
+
+import engine
+import inference
+import listing_format
+import result_cache
+from bench.tiny_model import DEFAULT_DIR, build_tiny_model
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load_corpus(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _use_format(fmt: str):
+    inference.VEHICLE_FORMAT = fmt
+    inference.MULTI_VEHICLE_FORMAT = fmt
+
+
+def _prompt(case: Dict[str, Any], model_id: str) -> str:
+    persona = inference.get_persona(case["persona_id"], case["mode"])
+    note = case.get("user_note")
+    if case["kind"] == "multi":
+        return inference.build_multi_prompt(case["vehicles"], persona, user_note=note, model=model_id)
+    return inference.build_prompt(case["vehicles"][0], persona, user_note=note)
+
+
+def token_counts(cases: List[Dict[str, Any]], model_id: str, formats: List[str]) -> Dict[str, Dict[str, float]]:
+    """형식별 평균 prompt 토큰 수 (single / multi / 전체)."""
+    tokenizer = engine.get_engine(model_id).load_tokenizer()
+    saved_budget = inference.MULTI_PREFILL_TOKENS
+    inference.MULTI_PREFILL_TOKENS = 0   # 예산 압축이 켜져 있으면 형식마다 담기는 내용이 달라진다
+    out: Dict[str, Dict[str, float]] = {}
+    try:
+        for fmt in formats:
+            _use_format(fmt)
+            by_kind: Dict[str, List[int]] = {"single": [], "multi": []}
+            for case in cases:
+                ids = tokenizer.apply_chat_template(
+                    inference._build_messages(_prompt(case, model_id)), tokenize=True, add_generation_prompt=True
+                )
+                by_kind[case["kind"]].append(len(ids))
+            every = by_kind["single"] + by_kind["multi"]
+            out[fmt] = {
+                kind: round(sum(v) / len(v), 1) if v else 0.0
+                for kind, v in (("single", by_kind["single"]), ("multi", by_kind["multi"]), ("all", every))
+            }
+    finally:
+        inference.MULTI_PREFILL_TOKENS = saved_budget
+    return out
+
+
+def _run_outputs(cases: List[Dict[str, Any]], model_id: str, fmt: str) -> List[Dict[str, Any]]:
+    _use_format(fmt)
+    results = []
+    for case in cases:
+        kwargs = dict(persona_id=case["persona_id"], mode=case["mode"], model=model_id, user_note=case.get("user_note"))
+        if case["kind"] == "multi":
+            results.append(inference.generate_multi_view(case["vehicles"], **kwargs))
+        else:
+            results.append(inference.generate_view(case["vehicles"][0], **kwargs))
+    return results
+
+
+def quality(cases: List[Dict[str, Any]], base: List[Dict[str, Any]], other: List[Dict[str, Any]]) -> Dict[str, float]:
+    """기준(json) 출력 대비 일치율."""
+    n = len(cases) or 1
+    parsed = agree = 0
+    for case, a, b in zip(cases, base, other):
+        parsed += "raw_text" not in b
+        if case["kind"] == "multi":
+            agree += a.get("best_index") == b.get("best_index")
+            continue
+        same_risk = a.get("risk_level") == b.get("risk_level")
+        try:
+            close = abs(float(a.get("fit_score")) - float(b.get("fit_score"))) <= 0.5
+        except (TypeError, ValueError):
+            close = a.get("fit_score") == b.get("fit_score")
+        agree += same_risk and close
+    return {"parse_ok": round(parsed / n, 3), "agreement": round(agree / n, 3)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench.formats", description="매물 직렬화 형식별 토큰 수 / 품질 비교")
+    parser.add_argument("--corpus", type=str, default=os.path.join(HERE, "corpus.jsonl"))
+    parser.add_argument("--formats", type=str, default=",".join(listing_format.FORMATS))
+    parser.add_argument("--model", type=str, default=None, help="생략하면 작은 랜덤 모델 토크나이저 (오프라인)")
+    parser.add_argument("--tiny-dir", type=str, default=DEFAULT_DIR)
+    parser.add_argument("--guard", action="store_true", help="실제로 생성해서 json 형식 대비 품질 비교")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="허용하는 파싱 성공률 하락폭")
+    parser.add_argument("--min-agreement", type=float, default=0.8, help="json 출력과의 최소 일치율")
+    parser.add_argument("--out", type=str, default="bench_formats.json")
+    args = parser.parse_args(argv)
+
+    cases = _load_corpus(args.corpus)
+    formats = [listing_format.check_format(f.strip()) for f in args.formats.split(",") if f.strip()]
+    if "json" not in formats:
+        formats.insert(0, "json")
+    model_id = args.model or build_tiny_model(cases, out_dir=args.tiny_dir)
+
+    tokens = token_counts(cases, model_id, formats)
+    base_all = tokens["json"]["all"] or 1.0
+    print(f"\n=== prompt tokens ({len(cases)} cases, tokenizer={model_id}) ===")
+    for fmt, t in tokens.items():
+        saving = 1.0 - t["all"] / base_all
+        print(f"{fmt:>9}  single={t['single']:>8}  multi={t['multi']:>8}  all={t['all']:>8}  ({saving:+.1%} vs json)")
+    report: Dict[str, Any] = {"model": model_id, "tokens": tokens}
+
+    failed = []
+    if args.guard:
+        result_cache.RESULT_CACHE_ENABLED = False   # 형식 비교는 매번 실제 생성
+        outputs = {fmt: _run_outputs(cases, model_id, fmt) for fmt in formats}
+        base_q = quality(cases, outputs["json"], outputs["json"])
+        report["quality"] = {}
+        print(f"\n=== quality vs json (tolerance={args.tolerance}, min_agreement={args.min_agreement}) ===")
+        for fmt in formats:
+            q = quality(cases, outputs["json"], outputs[fmt])
+            bad = fmt != "json" and (
+                q["parse_ok"] < base_q["parse_ok"] - args.tolerance or q["agreement"] < args.min_agreement
+            )
+            report["quality"][fmt] = dict(q, regressed=bad)
+            print(f"{fmt:>9}  parse_ok={q['parse_ok']:.2f}  agreement={q['agreement']:.2f}  {'REGRESSION' if bad else ''}")
+            if bad:
+                failed.append(fmt)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"saved: {args.out}")
+
+    if failed:
+        print(f"\nformat(s) regressed: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# bench/runner.py
+# 목적: 코퍼스의 각 케이스에 대해 파이프라인 단계별 시간 측정
+# - generate() 대신 prefill / decode 를 직접 돌려서 단계를 나눠 잰다 (greedy, KV 캐시 사용)
+# - JSON 파싱 / 정규화는 모델 출력 대신 고정된 '정상 출력' 샘플로 잰다 (랜덤 모델 출력은 JSON 이 아니므로)
+from __future__ import annotations
+
+import json
+import platform
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+from transformers import DynamicCache
+
+import inference
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    xs = sorted(values)
+    k = (len(xs) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(xs) - 1)
+    return xs[lo] + (xs[hi] - xs[lo]) * (k - lo)
+
+
+def summarize(values_ms: List[float]) -> Dict[str, float]:
+    return {
+        "n": len(values_ms),
+        "p50_ms": round(percentile(values_ms, 0.50), 4),
+        "p95_ms": round(percentile(values_ms, 0.95), 4),
+        "mean_ms": round(sum(values_ms) / len(values_ms), 4) if values_ms else 0.0,
+    }
+
+
+def _timed(fn: Callable[[], Any]):
+    t0 = time.perf_counter()
+    out = fn()
+    return out, (time.perf_counter() - t0) * 1000.0
+
+
+# ==============================
+# 고정 '정상 출력' 샘플 (파싱 / 정규화 단계용)
+# ==============================
+
+def _sample_output(case: Dict[str, Any]) -> str:
+    vehicles = case["vehicles"]
+    if case["kind"] == "multi":
+        obj = {
+            "mode": case["mode"],
+            "persona_id": case["persona_id"],
+            "persona_label": "",
+            "summary_overall": "두 매물 모두 무난하지만 주행거리와 옵션을 고려하면 첫 번째 매물이 더 잘 맞습니다.",
+            "best_index": 1,
+            "best": {
+                "index": 1,
+                "title": vehicles[0].get("title", ""),
+                "fit_score": 8.2,
+                "summary": "가격 대비 옵션 구성이 좋고 사고 이력이 경미합니다.",
+                "pros": ["스마트크루즈 등 장거리 편의 옵션", "시세 대비 낮은 가격", "프레임 손상 없음"],
+                "cons": ["렌트 이력 1년", "타이어 교체 시기 임박"],
+                "questions_for_seller": ["렌트 기간 정비 이력이 있나요?", "타이어 교체 계획이 있나요?"],
+                "risk_level": "low",
+            },
+            "ranking": [
+                {"index": i, "title": v.get("title", ""), "fit_score": round(8.2 - i * 0.7, 1)}
+                for i, v in enumerate(vehicles, start=1)
+            ],
+        }
+    else:
+        obj = {
+            "mode": case["mode"],
+            "persona_id": case["persona_id"],
+            "persona_label": "",
+            "summary": "예산과 용도를 고려하면 무난한 선택이지만 사고 이력과 타이어 상태는 확인이 필요합니다.",
+            "fit_score": 7.4,
+            "risk_level": "medium",
+            "highlights": ["시세 대비 합리적인 가격", "안전 옵션 충실", "1인 소유"],
+            "pros": ["연비가 무난한 편", "옵션 구성이 좋음"],
+            "cons": ["단순 교환 이력", "타이어 교체 필요 가능성"],
+            "checklist": ["하부 누유 확인", "타이어 마모 확인", "정비 이력서 확인"],
+            "questions_for_seller": ["소모품 교체 시기는 언제였나요?", "보험 이력 조회가 가능한가요?"],
+            "recommendation": "시승 후 정비 이력이 확인되면 구매를 고려해도 좋습니다.",
+            "listing_title": vehicles[0].get("title", ""),
+            "listing_body": "무사고에 가까운 관리 상태의 차량입니다.\n편하게 구매를 진행하고 싶으신 분께 잘 맞습니다.",
+        }
+    # 실제 모델 출력처럼 들여쓰기 + 앞뒤 잡담 포함
+    return "다음은 분석 결과입니다.\n" + json.dumps(obj, ensure_ascii=False, indent=2) + "\n"
+
+
+# ==============================
+# 측정
+# ==============================
+
+def run_corpus(
+    cases: List[Dict[str, Any]],
+    model_id: str,
+    max_new_tokens: int = 32,
+    repeats: int = 3,
+) -> Dict[str, Any]:
+    eng = inference._load_model(model_id)
+    tokenizer, model = eng.tokenizer, eng.model
+    device = eng.device
+
+    stages: Dict[str, List[float]] = {
+        "build_prompt": [],
+        "build_multi_prompt": [],
+        "tokenize": [],
+        "prefill": [],
+        "decode_token": [],
+        "safe_json_extract": [],
+        "normalize": [],
+    }
+    ttft: List[float] = []
+    decode_tokens = 0
+    decode_ms = 0.0
+    prompt_tokens: List[int] = []
+
+    # 워밍업 (첫 forward 의 커널 초기화 등 제외)
+    with torch.no_grad():
+        model(input_ids=torch.tensor([[tokenizer.bos_token_id or 0]], device=device))
+
+    for _ in range(repeats):
+        for case in cases:
+            persona = inference.get_persona(case["persona_id"], case["mode"])
+            note = case.get("user_note")
+
+            # 1) 프롬프트 빌드
+            if case["kind"] == "multi":
+                prompt, ms = _timed(lambda: inference.build_multi_prompt(case["vehicles"], persona, user_note=note, model=model_id))
+                stages["build_multi_prompt"].append(ms)
+            else:
+                prompt, ms = _timed(lambda: inference.build_prompt(case["vehicles"][0], persona, user_note=note))
+                stages["build_prompt"].append(ms)
+
+            # 2) chat 템플릿 토큰화
+            input_ids, tok_ms = _timed(lambda: tokenizer.apply_chat_template(
+                inference._build_messages(prompt),
+                tokenize=True,
+                add_generation_prompt=True,
+                return_tensors="pt",
+            ).to(device))
+            stages["tokenize"].append(tok_ms)
+            prompt_tokens.append(int(input_ids.shape[1]))
+
+            # 3) prefill
+            with torch.no_grad():
+                out, pre_ms = _timed(lambda: model(input_ids=input_ids, past_key_values=DynamicCache(), use_cache=True))
+            stages["prefill"].append(pre_ms)
+            ttft.append(tok_ms + pre_ms)
+
+            # 4) 토큰별 decode (greedy)
+            past = out.past_key_values
+            next_id = out.logits[:, -1:].argmax(-1)
+            with torch.no_grad():
+                for _step in range(max_new_tokens):
+                    out, ms = _timed(lambda: model(input_ids=next_id, past_key_values=past, use_cache=True))
+                    stages["decode_token"].append(ms)
+                    decode_ms += ms
+                    decode_tokens += 1
+                    past = out.past_key_values
+                    next_id = out.logits[:, -1:].argmax(-1)
+
+            # 5) JSON 추출 / 6) 정규화
+            sample = _sample_output(case)
+            parsed, ms = _timed(lambda: inference._safe_json_extract(sample))
+            stages["safe_json_extract"].append(ms)
+            if case["kind"] == "multi":
+                _, ms = _timed(lambda: inference._normalize_multi_result(
+                    dict(parsed), vehicle_count=len(case["vehicles"]), mode=case["mode"], persona=persona
+                ))
+            else:
+                _, ms = _timed(lambda: inference._normalize_single_result(dict(parsed), case["mode"], persona))
+            stages["normalize"].append(ms)
+
+    return {
+        "meta": {
+            "model": model_id,
+            "cases": len(cases),
+            "repeats": repeats,
+            "max_new_tokens": max_new_tokens,
+            "prompt_tokens_mean": round(sum(prompt_tokens) / len(prompt_tokens), 1) if prompt_tokens else 0,
+            "torch": torch.__version__,
+            "threads": torch.get_num_threads(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "stages": {name: summarize(v) for name, v in stages.items() if v},
+        "ttft": summarize(ttft),
+        "decode": {
+            "tokens": decode_tokens,
+            "tokens_per_sec": round(decode_tokens / (decode_ms / 1000.0), 2) if decode_ms > 0 else 0.0,
+        },
+    }
+
+
+# ==============================
+# baseline 비교
+# ==============================
+
+def compare(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float = 0.2,
+    min_delta_ms: float = 0.05,
+) -> List[Dict[str, Any]]:
+    """
+    지표별 (baseline, current, ratio, regressed) 목록.
+    - 시간 지표(p50/p95): current > baseline * (1 + tolerance) 이고, 차이가 min_delta_ms 이상이면 회귀
+      (0.1ms 미만 단계는 타이머 잡음만으로도 비율이 크게 흔들리므로 절대값 하한을 둔다)
+    - tokens_per_sec: current < baseline / (1 + tolerance) 이면 회귀
+    """
+    rows: List[Dict[str, Any]] = []
+
+    def _row(name: str, base: Optional[float], cur: Optional[float], higher_is_better: bool):
+        if base is None or cur is None or base == 0:
+            return
+        ratio = cur / base
+        if higher_is_better:
+            regressed = ratio < 1 / (1 + tolerance)
+        else:
+            regressed = ratio > 1 + tolerance and (cur - base) >= min_delta_ms
+        rows.append({"metric": name, "baseline": base, "current": cur, "ratio": round(ratio, 3), "regressed": regressed})
+
+    for name, cur in current.get("stages", {}).items():
+        base = baseline.get("stages", {}).get(name)
+        if base:
+            for key in ("p50_ms", "p95_ms"):
+                _row(f"{name}.{key}", base.get(key), cur.get(key), higher_is_better=False)
+    for key in ("p50_ms", "p95_ms"):
+        _row(f"ttft.{key}", baseline.get("ttft", {}).get(key), current.get("ttft", {}).get(key), higher_is_better=False)
+    _row(
+        "decode.tokens_per_sec",
+        baseline.get("decode", {}).get("tokens_per_sec"),
+        current.get("decode", {}).get("tokens_per_sec"),
+        higher_is_better=True,
+    )
+    return rows
@@ -0,0 +1,91 @@
+# bench/tiny_model.py
+# 목적: 오프라인 벤치용 작은 랜덤 모델 만들기
+# - 구조는 Mi:dm 2.0 과 같은 LlamaForCausalLM (층 수 / 폭만 작게)
+# - 토크나이저는 tokenizers 의 byte-level BPE 를 프롬프트 텍스트(instruction + 코퍼스 매물)로 직접 학습
+# - 같은 인자로 다시 만들면 같은 디렉터리를 재사용 (seed 고정)
+from __future__ import annotations
+
+import json
+import os
+from typing import Iterable, List
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "encar_llm", "bench_tiny")
+
+SPECIAL_TOKENS = ["<|end_of_text|>", "<|begin_of_text|>", "<|start_header_id|>", "<|end_header_id|>", "<|eot_id|>"]
+
+# Mi:dm 2.0 (Llama 3 계열) chat 템플릿과 같은 모양
+CHAT_TEMPLATE = (
+    "{{ bos_token }}{% for m in messages %}"
+    "<|start_header_id|>{{ m['role'] }}<|end_header_id|>\n\n{{ m['content'] }}<|eot_id|>"
+    "{% endfor %}"
+    "{% if add_generation_prompt %}<|start_header_id|>assistant<|end_header_id|>\n\n{% endif %}"
+)
+
+
+def _training_texts(corpus_cases: List[dict]) -> Iterable[str]:
+    import inference
+
+    for mode in ("buy", "sell"):
+        for budget in ("none", "guard", "checked"):
+            yield inference._single_instruction(mode, budget)
+            yield inference._multi_instruction(mode, budget)
+    yield inference.SYSTEM_PROMPT
+    for persona in list(inference.BUY_PERSONAS.values()) + list(inference.SELL_PERSONAS.values()):
+        yield persona.description
+    for case in corpus_cases:
+        yield json.dumps(case, ensure_ascii=False, indent=2)
+
+
+def build_tiny_model(
+    corpus_cases: List[dict],
+    out_dir: str = DEFAULT_DIR,
+    vocab_size: int = 4000,
+    hidden_size: int = 128,
+    num_layers: int = 2,
+    seed: int = 0,
+    force: bool = False,
+) -> str:
+    """out_dir 에 토크나이저 + 랜덤 초기화 모델 저장 후 경로 반환 (이미 있으면 그대로 사용)."""
+    if not force and os.path.exists(os.path.join(out_dir, "config.json")):
+        return out_dir
+
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    tok = Tokenizer(models.BPE())
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tok.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size,
+        special_tokens=SPECIAL_TOKENS,
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    )
+    lines = [line for text in _training_texts(corpus_cases) for line in text.splitlines()]
+    tok.train_from_iterator(lines, trainer)
+
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tok,
+        bos_token="<|begin_of_text|>",
+        eos_token="<|eot_id|>",
+        pad_token="<|end_of_text|>",
+    )
+    tokenizer.chat_template = CHAT_TEMPLATE
+    tokenizer.save_pretrained(out_dir)
+
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=8192,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    torch.manual_seed(seed)
+    LlamaForCausalLM(config).save_pretrained(out_dir)
+    print(f"[bench] tiny model saved: {out_dir} (vocab={len(tokenizer)}, hidden={hidden_size}, layers={num_layers})")
+    return out_dir
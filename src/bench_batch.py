@@ -0,0 +1,91 @@
+# bench_batch.py
+# 목적: call_llm_batch 의 batch size 별 처리량(tokens/sec) 측정
+# - 같은 프롬프트 묶음을 batch size 만 바꿔가며 디코딩
+# - 사용법: python bench_batch.py --n 16 --batch-sizes 1,2,4,8
+import argparse
+import json
+import time
+from typing import List
+
+import inference
+from inference import BUY_PERSONAS, build_prompt
+
+
+SAMPLE_VEHICLES = [
+    {
+        "title": "쏘나타 DN8 2.0 가솔린 프리미엄",
+        "year": 2021,
+        "mileage_km": 48000,
+        "price_krw": 18500000,
+        "color": "금색",
+        "accident_history": "앞펜더 단순교환 1회, 프레임 손상 없음",
+        "usage_history": "렌트 이력 1년, 이후 개인 자가용 2년",
+        "options": ["스마트크루즈", "차선이탈보조", "통풍시트", "후측방경보"],
+        "market_price_hint": "동급 평균 시세 대비 약간 낮은 편",
+    },
+    {
+        "title": "K5 DL3 2.0 가솔린 노블레스",
+        "year": 2020,
+        "mileage_km": 62000,
+        "price_krw": 17900000,
+        "color": "핑크색",
+        "accident_history": "무사고, 단순판금 도색 있음",
+        "usage_history": "개인 출퇴근용 4년",
+        "options": ["크루즈컨트롤", "차선이탈경고", "열선시트", "전방주차센서"],
+        "market_price_hint": "동급 평균 시세와 비슷한 편",
+    },
+]
+
+
+def _make_prompts(n: int) -> List[str]:
+    """샘플 매물 x 구매 페르소나 조합을 돌려가며 n 개의 프롬프트 생성."""
+    personas = list(BUY_PERSONAS.values())
+    prompts = []
+    for i in range(n):
+        v = dict(SAMPLE_VEHICLES[i % len(SAMPLE_VEHICLES)])
+        v["mileage_km"] = v["mileage_km"] + 1000 * i  # 프롬프트 길이/내용을 조금씩 다르게
+        prompts.append(build_prompt(v, personas[i % len(personas)]))
+    return prompts
+
+
+def run(n: int, batch_sizes: List[int], max_new_tokens: int, model: str) -> List[dict]:
+    prompts = _make_prompts(n)
+
+    # 워밍업 (모델 로드 + 첫 호출 오버헤드 제외)
+    inference._generate_batch_ids(prompts[:1], model, max_new_tokens=8, batch_size=1)
+
+    rows = []
+    for bs in batch_sizes:
+        t0 = time.perf_counter()
+        gen_ids = inference._generate_batch_ids(prompts, model, max_new_tokens=max_new_tokens, batch_size=bs)
+        elapsed = time.perf_counter() - t0
+
+        total_tokens = sum(len(g) for g in gen_ids)
+        row = {
+            "batch_size": bs,
+            "prompts": n,
+            "generated_tokens": total_tokens,
+            "seconds": round(elapsed, 3),
+            "tokens_per_sec": round(total_tokens / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+        rows.append(row)
+        print(json.dumps(row, ensure_ascii=False))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="call_llm_batch throughput vs batch size")
+    parser.add_argument("--n", type=int, default=16, help="총 프롬프트 수")
+    parser.add_argument("--batch-sizes", type=str, default="1,2,4,8")
+    parser.add_argument("--max_new_tokens", type=int, default=128)
+    parser.add_argument("--model", type=str, default=inference.MODEL_ID_DEFAULT)
+    args = parser.parse_args()
+
+    sizes = [int(x) for x in args.batch_sizes.split(",") if x.strip()]
+    rows = run(args.n, sizes, args.max_new_tokens, args.model)
+
+    base = rows[0]["tokens_per_sec"] if rows and rows[0]["tokens_per_sec"] else None
+    print("\n=== tokens/sec vs batch size ===")
+    for r in rows:
+        speedup = f"x{r['tokens_per_sec'] / base:.2f}" if base else "-"
+        print(f"batch={r['batch_size']:>3}  tok/s={r['tokens_per_sec']:>9}  ({speedup})")
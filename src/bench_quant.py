@@ -0,0 +1,144 @@
+# bench_quant.py
+# 목적: CPU 가중치 형식(MIDM_CPU_DTYPE)별 tokens/sec, peak RSS, 출력 JSON 일치율 비교
+# - 형식마다 별도 자식 프로세스에서 실행 (peak RSS 가 서로 섞이지 않도록)
+# - 일치율은 float32 출력을 기준으로, 원문 + 파싱한 JSON dict 기준으로 계산
+#   (risk_level / fit_score 는 양쪽 다 JSON 으로 파싱된 쌍만 센다 → 둘 다 깨져서 None == None 인 경우는 일치가 아님)
+# - dtype 은 실제로 올라간 형식 (bf16 미지원 CPU 에서 bfloat16 을 요청하면 float32), 요청값은 requested_dtype
+# - 사용법: python bench_quant.py --n 8 --dtypes float32,bfloat16,int8
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+
+def _peak_rss_mb() -> float:
+    # Linux: ru_maxrss 단위는 KB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _worker(n: int, max_new_tokens: int, model: str) -> Dict[str, Any]:
+    """MIDM_CPU_DTYPE 가 설정된 자식 프로세스 안에서 실행."""
+    import engine
+    import inference
+    from bench_batch import _make_prompts
+
+    prompts = _make_prompts(n)
+
+    t0 = time.perf_counter()
+    inference._load_model(model)
+    load_s = time.perf_counter() - t0
+
+    # 워밍업 (첫 호출 오버헤드 제외)
+    inference._generate_batch_ids(prompts[:1], model, max_new_tokens=8, batch_size=1)
+
+    t0 = time.perf_counter()
+    gen_ids = inference._generate_batch_ids(prompts, model, max_new_tokens=max_new_tokens, batch_size=1)
+    elapsed = time.perf_counter() - t0
+
+    tokenizer = inference._load_model(model).tokenizer
+    outputs = [tokenizer.decode(ids, skip_special_tokens=True).strip() for ids in gen_ids]
+    total_tokens = sum(len(g) for g in gen_ids)
+    return {
+        "dtype": engine.get_engine(model).config.resolved_cpu_dtype(),
+        "requested_dtype": os.getenv("MIDM_CPU_DTYPE", "float32"),
+        "load_seconds": round(load_s, 2),
+        "generated_tokens": total_tokens,
+        "seconds": round(elapsed, 3),
+        "tokens_per_sec": round(total_tokens / elapsed, 2) if elapsed > 0 else 0.0,
+        "peak_rss_mb": _peak_rss_mb(),
+        "outputs": outputs,
+    }
+
+
+def _run_child(dtype: str, n: int, max_new_tokens: int, model: str) -> Dict[str, Any]:
+    env = dict(os.environ, MIDM_CPU_DTYPE=dtype, MIDM_FORCE_CPU="1", MIDM_RESULT_CACHE="0")
+    cmd = [
+        sys.executable, os.path.abspath(__file__), "--_worker",
+        "--n", str(n), "--max_new_tokens", str(max_new_tokens), "--model", model,
+    ]
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True)
+    # 자식의 마지막 줄이 결과 JSON (그 앞은 로딩/디버그 로그)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _agreement(base: List[str], other: List[str]) -> Dict[str, Optional[float]]:
+    """
+    float32 대비: 원문 완전 일치율 / 파싱된 JSON 일치율 (전체 대비)
+    + risk_level·fit_score(±0.5) 일치율 (양쪽 다 파싱된 쌍 대비, 그런 쌍이 없으면 None).
+    """
+    from inference import _safe_json_extract
+
+    n = len(base) or 1
+    text_eq = json_eq = risk_eq = score_eq = parsed = 0
+    for a, b in zip(base, other):
+        text_eq += a == b
+        ja, jb = _safe_json_extract(a), _safe_json_extract(b)
+        if "raw_text" in ja or "raw_text" in jb:
+            continue
+        parsed += 1
+        json_eq += ja == jb
+        risk_eq += ja.get("risk_level") == jb.get("risk_level")
+        try:
+            score_eq += abs(float(ja.get("fit_score")) - float(jb.get("fit_score"))) <= 0.5
+        except (TypeError, ValueError):
+            score_eq += ja.get("fit_score") == jb.get("fit_score")
+    return {
+        "text_match": round(text_eq / n, 3),
+        "json_match": round(json_eq / n, 3),
+        "parsed_pairs": parsed,
+        "risk_level_match": round(risk_eq / parsed, 3) if parsed else None,
+        "fit_score_match": round(score_eq / parsed, 3) if parsed else None,
+    }
+
+
+def _rate(value: Optional[float]) -> str:
+    return f"{value:.2f}" if value is not None else "-"
+
+
+def run(n: int, dtypes: List[str], max_new_tokens: int, model: str) -> List[dict]:
+    results = [_run_child(d, n, max_new_tokens, model) for d in dtypes]
+    base = next((r for r in results if r["requested_dtype"] == "float32"), results[0])
+
+    rows = []
+    for r in results:
+        row = {k: v for k, v in r.items() if k != "outputs"}
+        row.update(_agreement(base["outputs"], r["outputs"]))
+        rows.append(row)
+        print(json.dumps(row, ensure_ascii=False))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU dtype (float32 / bfloat16 / int8) benchmark")
+    parser.add_argument("--n", type=int, default=8, help="프롬프트 수")
+    parser.add_argument("--dtypes", type=str, default="float32,bfloat16,int8")
+    parser.add_argument("--max_new_tokens", type=int, default=256)
+    parser.add_argument("--model", type=str, default=None)
+    parser.add_argument("--_worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._worker:
+        out = _worker(args.n, args.max_new_tokens, args.model)
+        print(json.dumps(out, ensure_ascii=False))
+        sys.exit(0)
+
+    import engine
+
+    model = args.model or engine.DEFAULT_MODEL_ID
+    rows = run(args.n, [d for d in args.dtypes.split(",") if d.strip()], args.max_new_tokens, model)
+
+    base = next((r for r in rows if r["requested_dtype"] == "float32"), rows[0])
+    print("\n=== CPU dtype 비교 (기준: float32) ===")
+    for r in rows:
+        speedup = f"x{r['tokens_per_sec'] / base['tokens_per_sec']:.2f}" if base["tokens_per_sec"] else "-"
+        label = r["dtype"] if r["dtype"] == r["requested_dtype"] else f"{r['requested_dtype']}→{r['dtype']}"
+        print(
+            f"{label:>9}  tok/s={r['tokens_per_sec']:>8} ({speedup})  "
+            f"peak_rss={r['peak_rss_mb']:>8} MB  json_match={r['json_match']:.2f}  "
+            f"risk={_rate(r['risk_level_match'])}  fit±0.5={_rate(r['fit_score_match'])} "
+            f"(parsed {r['parsed_pairs']}/{args.n})"
+        )
@@ -0,0 +1,179 @@
+# canonical.py
+# 목적: 같은 차를 조금씩 다른 모양으로 다시 보내도 같은 프롬프트(→ 같은 결과 캐시 키)가 되도록 매물 정규화
+# - 텍스트: NFKC(전각 숫자 / 한글 자모 조합형 통일) + 앞뒤 공백 제거 + 연속 공백 1칸, 빈 문자열은 없는 필드로
+# - 색상: "화이트" / "흰색" / "white" / "White" → "화이트" (동의어 표)
+# - 옵션: 정규화 + 중복 제거 + 정렬
+# - 주행거리 / 가격: 허용 오차 단위로 반올림 (MIDM_CANON_MILEAGE_KM / MIDM_CANON_PRICE_KRW, 0 이면 그대로)
+# - inspection / extra: 키 정렬
+# - content_hash(v): 정규화된 매물의 안정적인 해시 (키 순서 / 공백과 무관)
+# - 정규화 덕분에 생성 1번이 줄어든 경우(내용 해시는 본 적 있는데 원래 모양은 처음)를 세어 둔다
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+import metrics
+from vehicle import Vehicle
+
+CANONICAL_ENABLED = os.getenv("MIDM_CANONICAL", "1") not in ("0", "false", "False")
+MILEAGE_BUCKET_KM = int(os.getenv("MIDM_CANON_MILEAGE_KM", "1000"))
+PRICE_BUCKET_KRW = int(os.getenv("MIDM_CANON_PRICE_KRW", "100000"))
+TRACK_MAX = int(os.getenv("MIDM_CANON_TRACK", "10000"))   # 중복 통계용으로 기억할 내용 해시 수
+
+
+# ==============================
+# 1. 값 정규화
+# ==============================
+
+# 대표 이름 → 같은 뜻으로 들어오는 표기 (비교는 소문자 + 공백 제거 후)
+_COLOR_SYNONYMS = {
+    "화이트": ("white", "흰색", "하얀색", "백색", "화이트색"),
+    "펄화이트": ("pearl", "pearlwhite", "펄", "진주색", "화이트펄"),
+    "블랙": ("black", "검정", "검정색", "검은색", "흑색"),
+    "실버": ("silver", "은색", "실버색"),
+    "그레이": ("gray", "grey", "회색", "쥐색", "그레이색"),
+    "블루": ("blue", "파랑", "파란색", "청색"),
+    "네이비": ("navy", "남색"),
+    "레드": ("red", "빨강", "빨간색", "적색"),
+    "브라운": ("brown", "갈색"),
+    "베이지": ("beige",),
+    "그린": ("green", "초록", "초록색", "녹색"),
+    "옐로우": ("yellow", "노랑", "노란색"),
+}
+_COLORS = {alias: name for name, aliases in _COLOR_SYNONYMS.items() for alias in (name, *aliases)}
+
+
+def _text(value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return None
+    text = " ".join(unicodedata.normalize("NFKC", value).split())
+    return text or None
+
+
+def _color(value: Optional[str]) -> Optional[str]:
+    text = _text(value)
+    if text is None:
+        return None
+    return _COLORS.get(text.lower().replace(" ", ""), text)
+
+
+def _options(value: Optional[List[str]]) -> Optional[List[str]]:
+    if value is None:
+        return None
+    return sorted({t for t in (_text(o) for o in value) if t})
+
+
+def _bucket(value: Optional[int], step: int) -> Optional[int]:
+    if value is None or step <= 0:
+        return value
+    return int(round(value / step)) * step
+
+
+def _nested(value: Any) -> Any:
+    """inspection / extra 값: 문자열은 정규화, dict 는 키 정렬."""
+    if isinstance(value, str):
+        return _text(value)
+    if isinstance(value, dict):
+        return {k: _nested(value[k]) for k in sorted(value, key=str)}
+    if isinstance(value, list):
+        return [_nested(x) for x in value]
+    return value
+
+
+def canonicalize(v: Vehicle) -> Vehicle:
+    """정규화된 새 Vehicle (원래 v 는 그대로 → 화면 / 예산 체크는 원래 값을 쓴다)."""
+    return Vehicle(
+        title=_text(v.title),
+        year=v.year,
+        mileage_km=_bucket(v.mileage_km, MILEAGE_BUCKET_KM),
+        price_krw=_bucket(v.price_krw, PRICE_BUCKET_KRW),
+        color=_color(v.color),
+        accident_history=_text(v.accident_history),
+        usage_history=_text(v.usage_history),
+        options=_options(v.options),
+        inspection=_nested(v.inspection),
+        market_price_hint=_text(v.market_price_hint),
+        extra=_nested(v.extra) if v.extra else None,
+    )
+
+
+def _digest(v: Vehicle, sort_keys: bool) -> str:
+    text = json.dumps(v.to_dict(), ensure_ascii=False, sort_keys=sort_keys, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def content_hash(v: Vehicle) -> str:
+    """정규화된 매물 내용의 해시 (canonicalize 한 결과에 대해 쓴다)."""
+    return _digest(v, sort_keys=True)
+
+
+# ==============================
+# 2. 중복 통계
+# ==============================
+
+class DuplicateTracker:
+    """
+    내용 해시 → 그 내용으로 들어온 원래 모양(정규화 전 해시)들.
+    - new: 처음 보는 내용 / repeat: 원래 모양까지 같은 재요청 (정규화 없이도 캐시 hit)
+    - collapsed: 내용은 본 적 있는데 모양이 다른 재요청 → 정규화가 없었으면 다시 생성했을 요청
+    """
+
+    def __init__(self, max_entries: int = TRACK_MAX):
+        self.max_entries = max(1, max_entries)
+        self._seen: "OrderedDict[str, Set[str]]" = OrderedDict()
+        self._stats = {"listings": 0, "new": 0, "repeat": 0, "collapsed": 0}
+        self._lock = threading.Lock()
+
+    def observe(self, content: str, raw: str) -> str:
+        with self._lock:
+            shapes = self._seen.get(content)
+            if shapes is None:
+                outcome = "new"
+                self._seen[content] = {raw}
+                while len(self._seen) > self.max_entries:
+                    self._seen.popitem(last=False)
+            else:
+                self._seen.move_to_end(content)
+                outcome = "repeat" if raw in shapes else "collapsed"
+                shapes.add(raw)
+            self._stats["listings"] += 1
+            self._stats[outcome] += 1
+        metrics.observe_canonical(outcome)
+        return outcome
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["tracked"] = len(self._seen)
+        again = out["repeat"] + out["collapsed"]
+        out["collapse_rate"] = round(out["collapsed"] / again, 4) if again else 0.0
+        return out
+
+
+_tracker = DuplicateTracker()
+
+
+def canonical_view(v: Vehicle) -> Vehicle:
+    """MIDM_CANONICAL=0 이면 그대로, 아니면 canonicalize (통계는 세지 않음)."""
+    return canonicalize(v) if CANONICAL_ENABLED else v
+
+
+def prepare(v: Vehicle) -> Vehicle:
+    """프롬프트에 넣을 매물 (canonical_view). 중복 통계도 여기서 센다."""
+    if not CANONICAL_ENABLED:
+        return v
+    canon = canonicalize(v)
+    _tracker.observe(content_hash(canon), _digest(v, sort_keys=False))
+    return canon
+
+
+def stats() -> Dict[str, Any]:
+    """정규화 중복 통계 (매물 수 / new / repeat / collapsed / collapse_rate)."""
+    out = _tracker.stats()
+    out["enabled"] = CANONICAL_ENABLED
+    return out
@@ -0,0 +1,481 @@
+# constrained.py
+# 목적: JSON 스키마 강제 디코딩 (LogitsProcessor)
+# - 단일(buy/sell) / 멀티 결과 스키마를 코드로 정의 (_normalize_*_result 가 기대하는 key/타입 그대로)
+# - key 순서까지 고정된 문자 단위 오토마타로, 다음 토큰 후보 중 스키마를 깨는 토큰은 -inf 처리
+# - 오토마타 상태(문자열 내용은 제외)가 같으면 허용 토큰 마스크도 같으므로 상태별로 캐시
+#   → 처음 보는 상태에서만 vocab 을 훑고, 이후 요청부터는 사전 조회만 한다
+from __future__ import annotations
+
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from transformers import LogitsProcessor
+
+
+# ==============================
+# 1. 스키마 정의
+# ==============================
+# 노드 형식
+# - ("str",) / ("num",) / ("int",)
+# - ("enum", (값1, 값2, ...))
+# - ("list", 원소노드)
+# - ("obj", ((key, 노드, 설명), ...))
+# mode / persona_id / persona_label 은 정규화 단계에서 채우므로 모델이 쓰지 않게 뺀다.
+
+STR = ("str",)
+NUM = ("num",)
+INT = ("int",)
+STR_LIST = ("list", STR)
+RISK = ("enum", ("low", "medium", "high"))
+
+SCHEMAS: Dict[str, Tuple] = {
+    "single_buy": ("obj", (
+        ("summary", STR, "persona 관점 한 문단 요약"),
+        ("fit_score", NUM, "persona 적합도 0.0~10.0"),
+        ("risk_level", RISK, "low | medium | high"),
+        ("highlights", STR_LIST, "핵심 포인트 3~5개"),
+        ("pros", STR_LIST, "장점 2~5개"),
+        ("cons", STR_LIST, "단점/주의사항 2~5개"),
+        ("checklist", STR_LIST, "시승/상담 시 확인할 항목 3~6개"),
+        ("questions_for_seller", STR_LIST, "판매자에게 물어볼 질문 3~6개"),
+        ("recommendation", STR, "최종 조언 한두 문장"),
+    )),
+    "single_sell": ("obj", (
+        ("summary", STR, "어떻게 포지셔닝해서 팔지 한 문단 요약"),
+        ("fit_score", NUM, "0.0~10.0"),
+        ("pros", STR_LIST, "판매 시 강조할 점"),
+        ("cons", STR_LIST, "솔직하게 밝혀야 할 단점"),
+        ("risk_level", RISK, "low | medium | high"),
+        ("recommendation", STR, "가격·채널·전략 조언 한두 문장"),
+        ("listing_title", STR, "사이트에 올릴 제목 (40자 이내, 사실 위주)"),
+        ("listing_body", STR, "구매자 시점의 소개 문구 3~6줄"),
+    )),
+    "multi": ("obj", (
+        ("summary_overall", STR, "여러 매물 비교 요약 1~2문장"),
+        ("best_index", INT, "가장 추천하는 매물 번호 ([매물 N] 의 N)"),
+        ("best", ("obj", (
+            ("index", INT, "[매물 N] 의 N"),
+            ("title", STR, "매물 제목"),
+            ("fit_score", NUM, "0.0~10.0"),
+            ("summary", STR, "1~2문장"),
+            ("pros", STR_LIST, "최대 3개"),
+            ("cons", STR_LIST, "최대 3개"),
+            ("questions_for_seller", STR_LIST, "최대 3개"),
+            ("risk_level", RISK, "low | medium | high"),
+        )), "best 매물 상세"),
+        ("ranking", ("list", ("obj", (
+            ("index", INT, "[매물 N] 의 N"),
+            ("title", STR, "매물 제목"),
+            ("fit_score", NUM, "0.0~10.0"),
+        ))), "모든 매물의 index/title/fit_score"),
+    )),
+    # map-reduce 멀티 비교의 map 단계 (매물 1대씩 짧게 평가, index/title 은 코드에서 채움)
+    "multi_map": ("obj", (
+        ("fit_score", NUM, "persona 적합도 0.0~10.0"),
+        ("risk_level", RISK, "low | medium | high"),
+        ("summary", STR, "한 문장 (50자 이내)"),
+        ("pros", STR_LIST, "최대 2개"),
+        ("cons", STR_LIST, "최대 2개"),
+    )),
+}
+
+
+def schema_name(is_multi: bool, mode: str) -> str:
+    if is_multi:
+        return "multi"
+    return "single_buy" if mode == "buy" else "single_sell"
+
+
+def schema_hint(name: str) -> str:
+    """프롬프트용 짧은 key 설명 (구조 자체는 디코딩에서 강제되므로 예시 JSON 대신 사용)."""
+    lines = ["출력 JSON 의 key 는 아래 순서로 고정되어 있습니다. 각 값만 알맞게 채우세요."]
+
+    def _walk(node, prefix: str):
+        for key, child, desc in node[1]:
+            lines.append(f"- {prefix}{key}: {desc}")
+            if child[0] == "obj":
+                _walk(child, f"{prefix}{key}.")
+            elif child[0] == "list" and child[1][0] == "obj":
+                _walk(child[1], f"{prefix}{key}[*].")
+
+    _walk(SCHEMAS[name], "")
+    return "\n".join(lines)
+
+
+# ==============================
+# 2. 문자 단위 오토마타
+# ==============================
+# 상태 = 프레임 튜플 (불변) → dict 키로 바로 쓸 수 있다.
+# - ("prog", prog_id, op_idx, pos)       객체를 '리터럴/공백/값' op 열로 펼친 프로그램 (pos: 리터럴 위치 / 공백 수)
+# - ("list", node_id, phase, n_ws)       0: '[' 대기, 1: '[' 직후, 2: 원소 뒤, 3: ',' 뒤
+# - ("str", phase, enum_id, typed)       0: '"' 대기, 1: 내용, 2: '\' 뒤, 3~6: \uXXXX
+# - ("num", int_only, phase)             0: 시작, 1: '-' 뒤, 2: 선행 0, 3: 정수부, 4: '.' 뒤, 5: 소수부
+
+DONE = ("done",)
+_WS = " \t\n\r"
+# 구조 사이 공백 상한. 없으면 모델이 공백/개행만 끝없이 내도 스키마상으로는 '유효'해서 max_new_tokens 까지 간다.
+_MAX_WS = 16
+
+
+class _Grammar:
+    """스키마 노드 → op 프로그램/노드 테이블로 컴파일."""
+
+    def __init__(self, root):
+        self.nodes: List[Tuple] = []
+        self.progs: List[List[Tuple]] = []
+        self.enums: List[Tuple[str, ...]] = []
+        self.root_id = self._node(root)
+
+    def _node(self, node) -> int:
+        nid = len(self.nodes)
+        self.nodes.append(node)
+        kind = node[0]
+        if kind == "obj":
+            ops: List[Tuple] = [("ws",), ("lit", "{")]
+            for i, (key, child, _desc) in enumerate(node[1]):
+                ops.append(("ws",))
+                if i:
+                    ops.append(("lit", ","))
+                    ops.append(("ws",))
+                ops.append(("lit", '"' + key + '"'))
+                ops.append(("ws",))
+                ops.append(("lit", ":"))
+                ops.append(("ws",))
+                ops.append(("val", self._node(child)))
+            ops.append(("ws",))
+            ops.append(("lit", "}"))
+            self.progs.append(ops)
+            self.nodes[nid] = ("obj", len(self.progs) - 1)
+        elif kind == "list":
+            self.nodes[nid] = ("list", self._node(node[1]))
+        elif kind == "enum":
+            self.enums.append(tuple(node[1]))
+            self.nodes[nid] = ("enum", len(self.enums) - 1)
+        return nid
+
+    def start_frame(self, nid: int) -> Tuple:
+        node = self.nodes[nid]
+        kind = node[0]
+        if kind == "obj":
+            return ("prog", node[1], 0, 0)
+        if kind == "list":
+            return ("list", nid, 0, 0)
+        if kind == "str":
+            return ("str", 0, -1, "")
+        if kind == "enum":
+            return ("str", 0, node[1], "")
+        return ("num", kind == "int", 0)
+
+    def initial(self) -> Tuple:
+        return (self.start_frame(self.root_id),)
+
+    # ---------- 전이 ----------
+    def step(self, state: Tuple, ch: str) -> Optional[Tuple]:
+        """state 에서 문자 ch 하나를 소비한 다음 상태 (불가능하면 None)."""
+        if state == DONE:
+            return None
+        stack = list(state)
+        while True:
+            top = stack[-1]
+            kind = top[0]
+            res = getattr(self, "_step_" + kind)(top, ch)
+            # res: ("stay", frame) | ("push", frame, child) | ("pop",) | ("pop_retry",) | None
+            if res is None:
+                return None
+            if res[0] == "stay":
+                stack[-1] = res[1]
+                return tuple(stack)
+            if res[0] == "push":
+                stack[-1] = res[1]
+                stack.append(res[2])
+                # 새 프레임이 같은 문자를 처리
+                continue
+            # pop / pop_retry: 부모 프레임을 다음 op 로 진행
+            stack.pop()
+            if not stack:
+                return DONE if res[0] == "pop" else None
+            stack[-1] = self._after_child(stack[-1])
+            if res[0] == "pop":
+                return tuple(stack)
+            # pop_retry: 숫자처럼 구분자를 보고서야 끝나는 값 → 부모에서 같은 문자 다시 처리
+
+    def _after_child(self, frame: Tuple) -> Tuple:
+        if frame[0] == "prog":
+            return ("prog", frame[1], frame[2] + 1, 0)
+        return ("list", frame[1], 2, 0)
+
+    def _step_prog(self, frame, ch):
+        _, pid, op_idx, lit_pos = frame
+        ops = self.progs[pid]
+        while op_idx < len(ops):
+            op = ops[op_idx]
+            if op[0] == "ws":
+                if ch in _WS:
+                    return ("stay", ("prog", pid, op_idx, lit_pos + 1)) if lit_pos < _MAX_WS else None
+                op_idx += 1
+                lit_pos = 0
+                continue
+            if op[0] == "lit":
+                text = op[1]
+                if ch != text[lit_pos]:
+                    return None
+                lit_pos += 1
+                if lit_pos == len(text):
+                    if op_idx + 1 == len(ops):
+                        return ("pop",)
+                    return ("stay", ("prog", pid, op_idx + 1, 0))
+                return ("stay", ("prog", pid, op_idx, lit_pos))
+            # val
+            return ("push", ("prog", pid, op_idx, 0), self.start_frame(op[1]))
+        return None
+
+    def _step_list(self, frame, ch):
+        _, nid, phase, n_ws = frame
+        item = self.nodes[nid][1]
+        if phase == 0:
+            return ("stay", ("list", nid, 1, 0)) if ch == "[" else None
+        if ch in _WS:
+            return ("stay", ("list", nid, phase, n_ws + 1)) if n_ws < _MAX_WS else None
+        if phase in (1, 2) and ch == "]":
+            return ("pop",)
+        if phase == 2:
+            return ("stay", ("list", nid, 3, 0)) if ch == "," else None
+        return ("push", frame, self.start_frame(item))
+
+    def _step_str(self, frame, ch):
+        _, phase, enum_id, typed = frame
+        if phase == 0:
+            return ("stay", ("str", 1, enum_id, typed)) if ch == '"' else None
+        if enum_id >= 0:
+            values = self.enums[enum_id]
+            if ch == '"':
+                return ("pop",) if typed in values else None
+            typed2 = typed + ch
+            if any(v.startswith(typed2) for v in values):
+                return ("stay", ("str", 1, enum_id, typed2))
+            return None
+        if phase == 1:
+            if ch == '"':
+                return ("pop",)
+            if ch == "\\":
+                return ("stay", ("str", 2, enum_id, ""))
+            if ord(ch) < 0x20:
+                return None
+            return ("stay", frame)
+        if phase == 2:
+            if ch == "u":
+                return ("stay", ("str", 3, enum_id, ""))
+            if ch in '"\\/bfnrt':
+                return ("stay", ("str", 1, enum_id, ""))
+            return None
+        # \uXXXX
+        if ch not in "0123456789abcdefABCDEF":
+            return None
+        return ("stay", ("str", 1 if phase == 6 else phase + 1, enum_id, ""))
+
+    def _step_num(self, frame, ch):
+        _, int_only, phase = frame
+        digit = "0" <= ch <= "9"
+        if phase == 0:
+            if ch == "-":
+                return ("stay", ("num", int_only, 1))
+            if ch == "0":
+                return ("stay", ("num", int_only, 2))
+            return ("stay", ("num", int_only, 3)) if digit else None
+        if phase == 1:
+            if ch == "0":
+                return ("stay", ("num", int_only, 2))
+            return ("stay", ("num", int_only, 3)) if digit else None
+        if phase in (2, 3):
+            if phase == 3 and digit:
+                return ("stay", frame)
+            if ch == "." and not int_only:
+                return ("stay", ("num", int_only, 4))
+            return ("pop_retry",)
+        if phase == 4:
+            return ("stay", ("num", int_only, 5)) if digit else None
+        if digit:
+            return ("stay", frame)
+        return ("pop_retry",)
+
+    def in_free_string(self, state: Tuple) -> bool:
+        if state == DONE:
+            return False
+        top = state[-1]
+        return top[0] == "str" and top[1] == 1 and top[2] < 0
+
+
+# ==============================
+# 3. 토크나이저 vocab 인덱스 + 상태별 마스크 캐시
+# ==============================
+
+class _VocabIndex:
+    """토큰 id → 텍스트, 첫 글자별 토큰 목록, 문자열 내부에 그대로 들어갈 수 있는 토큰 마스크."""
+
+    def __init__(self, tokenizer, vocab_size: int):
+        self.vocab_size = vocab_size
+        self.eos_id = tokenizer.eos_token_id
+        special = set(tokenizer.all_special_ids or [])
+
+        self.texts: List[str] = [""] * vocab_size
+        self.by_first: Dict[str, List[int]] = {}
+        self.string_special: List[int] = []   # '"', '\', 제어문자를 포함 → 개별 검증 필요
+        plain = torch.zeros(vocab_size, dtype=torch.bool)
+
+        # sentencepiece 계열은 단독 decode 시 앞 공백이 빠지므로, 앞에 고정 토큰을 붙여 decode 한 뒤 잘라낸다
+        anchor = tokenizer.encode("a", add_special_tokens=False)
+        anchor_text = tokenizer.decode(anchor, clean_up_tokenization_spaces=False)
+
+        for tid in range(min(vocab_size, len(tokenizer))):
+            if tid in special:
+                continue
+            text = tokenizer.decode(anchor + [tid], clean_up_tokenization_spaces=False)[len(anchor_text):]
+            if not text:
+                continue
+            self.texts[tid] = text
+            self.by_first.setdefault(text[0], []).append(tid)
+            if any(c == '"' or c == "\\" or ord(c) < 0x20 for c in text):
+                self.string_special.append(tid)
+            else:
+                plain[tid] = True
+        self.plain_mask = plain
+
+
+class SchemaConstraint:
+    """스키마 하나 + 토크나이저 하나에 대한 오토마타/마스크 캐시 (프로세스 전역 공유)."""
+
+    def __init__(self, name: str, vocab: _VocabIndex):
+        self.name = name
+        self.grammar = _Grammar(SCHEMAS[name])
+        self.vocab = vocab
+        self._masks: Dict[Tuple, torch.Tensor] = {}
+        self._lock = threading.Lock()
+
+    def advance(self, state: Tuple, text: str) -> Optional[Tuple]:
+        for ch in text:
+            state = self.grammar.step(state, ch)
+            if state is None:
+                return None
+        return state
+
+    def mask(self, state: Tuple) -> torch.Tensor:
+        hit = self._masks.get(state)
+        if hit is not None:
+            return hit
+        with self._lock:
+            hit = self._masks.get(state)
+            if hit is None:
+                hit = self._build_mask(state)
+                self._masks[state] = hit
+            return hit
+
+    def _build_mask(self, state: Tuple) -> torch.Tensor:
+        vocab = self.vocab
+        if state == DONE:
+            allowed = torch.zeros(vocab.vocab_size, dtype=torch.bool)
+            if vocab.eos_id is not None:
+                allowed[vocab.eos_id] = True
+            return allowed
+
+        if self.grammar.in_free_string(state):
+            # 문자열 내용 중: 따옴표/역슬래시 없는 토큰은 상태를 바꾸지 않으므로 전부 허용
+            allowed = vocab.plain_mask.clone()
+            candidates = vocab.string_special
+        else:
+            allowed = torch.zeros(vocab.vocab_size, dtype=torch.bool)
+            candidates = []
+            for first, ids in vocab.by_first.items():
+                if self.grammar.step(state, first) is not None:
+                    candidates.extend(ids)
+
+        for tid in candidates:
+            if self.advance(state, vocab.texts[tid]) is not None:
+                allowed[tid] = True
+        if not allowed.any():
+            # vocab 으로 표현할 수 없는 상태 → 막지 않고 풀어준다 (전부 -inf 면 generate 가 깨짐)
+            print(f"[constrained] no valid token for state {state} → unconstrained")
+            allowed[:] = True
+        return allowed
+
+
+# vocab 인덱스는 토크나이저마다 하나 (스키마끼리 공유), 마스크 캐시는 (스키마, 토크나이저) 마다 하나
+_vocabs: Dict[Tuple[int, int], _VocabIndex] = {}
+_constraints: Dict[Tuple[str, int], SchemaConstraint] = {}
+_constraints_lock = threading.Lock()
+
+
+def get_constraint(name: str, tokenizer, vocab_size: int) -> SchemaConstraint:
+    key = (name, id(tokenizer))
+    with _constraints_lock:
+        c = _constraints.get(key)
+        if c is None:
+            vocab = _vocabs.get((id(tokenizer), vocab_size))
+            if vocab is None:
+                print(f"[constrained] building vocab index (vocab_size={vocab_size})")
+                vocab = _VocabIndex(tokenizer, vocab_size)
+                _vocabs[(id(tokenizer), vocab_size)] = vocab
+            c = SchemaConstraint(name, vocab)
+            _constraints[key] = c
+        return c
+
+
+# ==============================
+# 4. LogitsProcessor
+# ==============================
+
+class SchemaLogitsProcessor(LogitsProcessor):
+    """
+    generate() 에 끼워서 쓰는 스키마 강제 processor.
+    - 행마다 오토마타 상태를 들고 있다가, 직전에 뽑힌 토큰 텍스트로 상태를 전진
+    - 현재 상태에서 허용되지 않는 토큰은 -inf
+    - 상태가 깨지면(이론상 없음) 해당 행은 제약을 풀어준다
+    - 상태는 생성 위치별로 남겨 둔다: assisted decoding 처럼 같은 위치를 다른 토큰으로 다시 부르면
+      (draft 후보 → 본 모델 검증, 거절된 후보) 갈라진 지점의 상태로 되돌아가서 다시 전진
+    """
+
+    def __init__(self, constraint: SchemaConstraint, prompt_len: int, batch_size: int = 1):
+        self.constraint = constraint
+        self.prompt_len = prompt_len
+        # 행마다 [생성 토큰 0개일 때 상태, 1개일 때, ...] 와 그 상태를 만든 토큰 id
+        self._states: List[List[Optional[Tuple]]] = [[constraint.grammar.initial()] for _ in range(batch_size)]
+        self._tokens: List[List[int]] = [[] for _ in range(batch_size)]
+
+    @property
+    def states(self) -> List[Optional[Tuple]]:
+        return [s[-1] for s in self._states]
+
+    def _state_at(self, row: int, generated: List[int]) -> Optional[Tuple]:
+        states, tokens = self._states[row], self._tokens[row]
+        if len(generated) != len(tokens) + 1 or generated[:-1] != tokens:
+            # 한 토큰씩 이어지는 보통 경우가 아니면, 공통 prefix 까지 되돌린 뒤 나머지를 전진
+            keep = 0
+            for a, b in zip(tokens, generated):
+                if a != b:
+                    break
+                keep += 1
+            del states[keep + 1:], tokens[keep:]
+            generated_rest = generated[keep:]
+        else:
+            generated_rest = generated[-1:]
+        texts = self.constraint.vocab.texts
+        for tid in generated_rest:
+            state = states[-1]
+            if state is not None and state != DONE:
+                text = texts[tid] if tid < len(texts) else ""
+                state = self.constraint.advance(state, text) if text else None
+            states.append(state)
+            tokens.append(tid)
+        return states[-1]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        n_gen = input_ids.shape[1] - self.prompt_len
+        vocab_size = scores.shape[-1]
+        for row in range(scores.shape[0]):
+            generated = input_ids[row, self.prompt_len:].tolist() if n_gen > 0 else []
+            state = self._state_at(row, generated)
+            if state is None:
+                continue
+            allowed = self.constraint.mask(state)[:vocab_size].to(scores.device)
+            scores[row] = scores[row].masked_fill(~allowed, float("-inf"))
+        return scores
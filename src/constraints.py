@@ -0,0 +1,237 @@
+# constraints.py
+# 목적: 사용자 메모(user_note)에서 '딱 떨어지는' 조건만 뽑아서 LLM 호출 전에 매물을 결정적으로 거른다
+# - 예산 상한 (max_price_krw) / 최소 연식 (min_year) / 최대 주행거리 (max_mileage_km) / 무사고 (no_accident)
+# - 정규식은 모듈 로드 때 한 번만 컴파일, 같은 메모는 extract 결과를 캐시 (lru_cache)
+# - 예산 비교(price_krw <= 예산)를 LLM 에게 맡기지 않는다 → 프롬프트의 '예산 하드 가드레일' 설명이 필요 없어진다
+# - 판정은 원래 매물 값으로 (canonical.py 의 반올림된 값이 아니라) / 값이 없는 필드는 위반으로 보지 않는다
+from __future__ import annotations
+
+import math
+import re
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import prerank
+from vehicle import Vehicle
+
+
+# ==============================
+# 1. 조건 타입
+# ==============================
+
+@dataclass(frozen=True, slots=True)
+class Constraints:
+    """메모에서 뽑은 하드 조건. None / False = 조건 없음."""
+    max_price_krw: Optional[int] = None
+    min_year: Optional[int] = None
+    max_mileage_km: Optional[int] = None
+    no_accident: bool = False
+    # 메모의 상한 금액 중 가장 작은 값 ("2천까지, 1500 이하면 더 좋음" 의 1500) → 화면 경고용, 필터에는 쓰지 않는다
+    preferred_price_krw: Optional[int] = None
+
+    def __bool__(self) -> bool:
+        return (
+            self.max_price_krw is not None
+            or self.min_year is not None
+            or self.max_mileage_km is not None
+            or self.no_accident
+        )
+
+    def describe(self) -> str:
+        """프롬프트 / 화면용 한 줄 ('예산 1,500만원 이하, 2019년식 이후')."""
+        parts = []
+        if self.max_price_krw is not None:
+            parts.append(f"예산 {format_krw(self.max_price_krw)} 이하")
+        if self.min_year is not None:
+            parts.append(f"{self.min_year}년식 이후")
+        if self.max_mileage_km is not None:
+            parts.append(f"주행 {self.max_mileage_km:,}km 이하")
+        if self.no_accident:
+            parts.append("무사고")
+        return ", ".join(parts)
+
+
+NONE = Constraints()
+
+
+def format_krw(value: int) -> str:
+    """18500000 → '1,850만원', 120000000 → '1억 2,000만원'."""
+    man = value // 10_000
+    eok, rest = divmod(man, 10_000)
+    if not eok:
+        return f"{man:,}만원"
+    return f"{eok}억 {rest:,}만원" if rest else f"{eok}억원"
+
+
+# ==============================
+# 2. 메모 → 조건 (정규식은 여기서 한 번만 컴파일)
+# ==============================
+
+# 상한을 뜻하는 꼬리말 ("1500만원 이하", "2천까지", "1억 안쪽", "1500만원 안에서", "2천으로")
+_UPPER = r"(?:이하|이내|미만|까지|안쪽|안에서|안으로|아래|내외|정도|선|내|으로)"
+# "2000만원대" / "1억대": 단위 바로 뒤의 '대' 만, 뒤에 다른 글자가 붙으면 아님 ("2000만원 대출", "1500만원대비")
+_BAND = r"원?대(?![가-힣])"
+
+# 금액: "1500만", "2천만", "2천", "1억", "1.5억", "1억 2천만", "1억2000만"
+_AMOUNT = (
+    r"(?:(?P<eok>\d+(?:\.\d+)?)\s*억(?:\s*(?P<eok_man>\d+)\s*(?:(?P<eok_cheon>천)\s*만?|만))?"
+    r"|(?P<man>\d+(?:\.\d+)?)\s*(?:(?P<cheon>천)\s*만?|만))"
+)
+# 주행거리 단위가 붙으면 금액이 아니다 ("최대 5만km")
+_NOT_KM = r"(?!\s*원?\s*(?:km|키로|킬로))"
+_PRICE_UPPER = re.compile(_AMOUNT + r"(?:\s*원?\s*" + _UPPER + "|" + _BAND + ")")
+# 앞에 오는 상한 ("최대 1500만원", "상한은 2천")
+_PRICE_LEADING = re.compile(r"(?:최대|상한|max)\s*(?:은|는|이|:)?\s*(?:가격|금액)?\s*" + _AMOUNT + _NOT_KM)
+# 범위는 윗값을 상한으로 ("1500~2000만원", "1천-2천", "1억에서 1억 5천") / 단위는 뒤쪽에만 있어도 된다
+_PRICE_RANGE = re.compile(
+    r"\d+(?:\.\d+)?\s*(?:억|천\s*만?|만)?\s*원?\s*(?:~|-|에서)\s*" + _AMOUNT + _NOT_KM
+)
+# "예산 1500만원", "예산은 2천", "예산: 1500" (단위가 없으면 만원)
+_PRICE_BUDGET = re.compile(
+    r"예산\s*(?:은|는|이|:)?\s*(?:약|최대|대략)?\s*(?:" + _AMOUNT
+    + r"|(?P<bare>\d{3,5})(?!\s*(?:\d|억|천|만|원|km|키로|킬로|년)))"
+)
+# 월 납입 / 유지비 같은 '가격이 아닌 금액' 바로 앞에 오는 말
+_NOT_PRICE = re.compile(
+    r"(?:월|한\s*달|매달|보험료|유지비|세금|수리비|정비비|연봉|할부금?|납입금?)\s*(?:은|는|이|가)?\s*$"
+)
+
+_YEAR_MIN = re.compile(
+    r"(?:(?P<y4>(?:19|20)\d{2})\s*년\s*식?|(?P<y2>\d{2})\s*년\s*식)\s*(?:형\s*)?"
+    r"(?:이후|이상|부터|넘는|넘은|보다\s*(?:최신|새))"
+    r"|연식\s*(?:은|는|이|:)?\s*(?P<y>(?:19|20)\d{2}|\d{2})\s*(?:년\s*식?)?\s*(?:이후|이상|부터)"
+)
+
+_KM_UNITS = {"만": 10_000, "천": 1_000}
+_KM_UPPER = r"(?:이하|이내|미만|까지|안쪽|아래)"
+_MILEAGE_MAX = re.compile(
+    r"(?P<n>\d+(?:\.\d+)?)\s*(?P<unit>만|천)?\s*(?:km|키로|킬로)(?:미터)?\s*" + _KM_UPPER
+    + r"|주행\s*(?:거리)?\s*(?:은|는|이|가|:)?\s*(?P<n2>\d+(?:\.\d+)?)\s*(?P<unit2>만|천)?\s*(?:km|키로|킬로)?\s*"
+    + _KM_UPPER
+)
+
+_ACCIDENT_OK = re.compile(
+    r"사고\s*(?:이력|경력|차량?|난\s*차)?\s*(?:은|는|이|가|도)?\s*(?:상관\s*없|괜찮|무관)"
+    r"|무사고\s*(?:가|이)?\s*아니(?:어도|라도|여도)"
+)
+_NO_ACCIDENT = re.compile(
+    r"무사고"
+    r"|사고\s*(?:이력|경력|차량?|난\s*차)?\s*(?:은|는|이|가)?\s*(?:없|싫|안\s*돼|안됨|제외|빼|불가|절대)"
+)
+
+# 무사고 위반 기준: prerank 의 사고 심각도 3 이상 (골격 손상 / 침수 / 전손, 단순 교환·판금은 무사고로 본다)
+ACCIDENT_SEVERITY_MAX = 1.0
+
+
+def _krw(m: re.Match) -> Optional[int]:
+    if m.group("eok"):
+        man = float(m.group("eok")) * 10_000
+        if m.group("eok_man"):
+            man += int(m.group("eok_man")) * (1_000 if m.group("eok_cheon") else 1)
+    elif m.group("man"):
+        man = float(m.group("man")) * (1_000 if m.group("cheon") else 1)
+    elif "bare" in m.re.groupindex and m.group("bare"):
+        man = int(m.group("bare"))
+    else:
+        return None
+    return int(round(man * 10_000))
+
+
+def _two_digit_year(text: str) -> int:
+    y = int(text)
+    if y >= 100:
+        return y
+    return y + (2000 if y <= 50 else 1900)
+
+
+def _blank(text: str, spans: List[Tuple[int, int]]) -> str:
+    """이미 다른 조건으로 읽은 구간은 공백으로 (주행 '5만 이하' 가 예산으로 다시 읽히지 않게)."""
+    chars = list(text)
+    for start, end in spans:
+        chars[start:end] = " " * (end - start)
+    return "".join(chars)
+
+
+@lru_cache(maxsize=1024)
+def _extract(note: str) -> Constraints:
+    text = unicodedata.normalize("NFKC", note).replace(",", "").lower()
+
+    mileages, spans = [], []
+    for m in _MILEAGE_MAX.finditer(text):
+        n, unit = (m.group("n"), m.group("unit")) if m.group("n") else (m.group("n2"), m.group("unit2"))
+        mileages.append(int(round(float(n) * _KM_UNITS.get(unit, 1))))
+        spans.append(m.span())
+    text = _blank(text, spans)
+
+    years = []
+    for m in _YEAR_MIN.finditer(text):
+        y = m.group("y4") or m.group("y2") or m.group("y")
+        years.append(_two_digit_year(y))
+
+    # 범위를 먼저 읽고 지운다 (아랫값 "예산 1500~" 이 상한으로 다시 읽히지 않게)
+    prices, spans = [], []
+    for m in _PRICE_RANGE.finditer(text):
+        if not _NOT_PRICE.search(text, 0, m.start()):
+            prices.append(_krw(m))
+        spans.append(m.span())
+    text = _blank(text, spans)
+
+    for pattern in (_PRICE_UPPER, _PRICE_LEADING):
+        for m in pattern.finditer(text):
+            if not _NOT_PRICE.search(text, 0, m.start()):
+                prices.append(_krw(m))
+    prices += [_krw(m) for m in _PRICE_BUDGET.finditer(text)]
+    prices = [p for p in prices if p]
+
+    return Constraints(
+        # 금액이 여러 개면 필터는 가장 큰 상한으로 (사용자가 받아들인 매물을 LLM 전에 지우지 않게)
+        max_price_krw=max(prices) if prices else None,
+        min_year=max(years) if years else None,
+        max_mileage_km=min(mileages) if mileages else None,
+        no_accident=bool(_NO_ACCIDENT.search(text)) and not _ACCIDENT_OK.search(text),
+        preferred_price_krw=min(prices) if prices else None,
+    )
+
+
+def extract(user_note: Optional[str]) -> Constraints:
+    """메모 → Constraints (조건이 없으면 NONE)."""
+    if not user_note or not user_note.strip():
+        return NONE
+    return _extract(user_note.strip())
+
+
+# ==============================
+# 3. 매물 판정
+# ==============================
+
+def violations(v: Vehicle, c: Constraints) -> List[str]:
+    """v 가 어기는 조건 (화면 / 프롬프트용 짧은 사유). 값이 없는 필드는 판정하지 않는다."""
+    out: List[str] = []
+    if c.max_price_krw is not None and v.price_krw is not None and v.price_krw > c.max_price_krw:
+        out.append(f"예산 초과({format_krw(v.price_krw)})")
+    if c.min_year is not None and v.year is not None and v.year < c.min_year:
+        out.append(f"연식 {v.year}년")
+    if c.max_mileage_km is not None and v.mileage_km is not None and v.mileage_km > c.max_mileage_km:
+        out.append(f"주행 {v.mileage_km:,}km")
+    if c.no_accident:
+        severity = prerank._accident_severity(v.accident_history)
+        if not math.isnan(severity) and severity > ACCIDENT_SEVERITY_MAX:
+            out.append("사고 이력")
+    return out
+
+
+def partition(vehicles: Sequence[Vehicle], c: Constraints) -> Tuple[List[int], Dict[int, List[str]]]:
+    """(조건을 모두 만족하는 원래 인덱스 0-based, 위반 매물 인덱스 → 사유)."""
+    if not c:
+        return list(range(len(vehicles))), {}
+    within: List[int] = []
+    violated: Dict[int, List[str]] = {}
+    for i, v in enumerate(vehicles):
+        reasons = violations(v, c)
+        if reasons:
+            violated[i] = reasons
+        else:
+            within.append(i)
+    return within, violated
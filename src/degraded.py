@@ -0,0 +1,348 @@
+# degraded.py
+# 목적: 모델이 밀려 있을 때 LLM 을 기다리게 하지 않고 바로 돌려주는 규칙 기반 결과 (load shedding)
+# - LoadTracker: 진행 중 generate 의 남은 시간 + 스케줄러 대기 job 수, 요청 1건당 generate 시간 EWMA → 예상 대기 시간
+# - 대기 깊이가 MIDM_DEGRADE_MAX_DEPTH 이상이거나 예상 대기가 MIDM_DEGRADE_MAX_WAIT_S 를 넘으면 degraded
+# - 규칙 결과: risk_level = 사고/용도 이력 키워드, fit_score = prerank 의 persona 가중치 (고정 기준 범위로 0~10),
+#   체크리스트 / 질문 = 템플릿, 장단점 = 매물 필드 규칙
+# - LLM 출력과 같은 모양(단일: summary/pros/..., 멀티: best + ranking)으로 만들고 정규화는 inference 가 그대로 한다
+# - 결과에는 "degraded": True / "degraded_reason" → 화면에서 여유가 생기면 LLM 분석으로 다시 받을 수 있게
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import constraints
+import metrics
+import prerank
+from vehicle import Vehicle
+
+DEGRADE_ENABLED = os.getenv("MIDM_DEGRADE", "1") not in ("0", "false", "False")
+MAX_DEPTH = int(os.getenv("MIDM_DEGRADE_MAX_DEPTH", "16"))          # 진행 중 + 대기 요청 수 (0 이면 안 봄)
+MAX_WAIT_S = float(os.getenv("MIDM_DEGRADE_MAX_WAIT_S", "45"))      # 예상 대기 초 (0 이면 안 봄)
+EWMA_ALPHA = float(os.getenv("MIDM_DEGRADE_EWMA_ALPHA", "0.2"))
+
+
+# ==============================
+# 1. 부하 추적
+# ==============================
+
+class LoadTracker:
+    """
+    generate 부하 (프로세스 전역).
+    - track(rows): generate 1회를 감싼다 (배치면 rows = 행 수). 끝나면 '요청 1건당 시간' EWMA 갱신
+    - enqueue / dequeue: 아직 generate 에 들어가지 않은 스케줄러 대기 job
+    - 예상 대기 = (진행 중 generate 의 남은 시간 + 대기 job × 요청 1건당 시간) ÷ 동시 실행 상한
+    """
+
+    def __init__(self, alpha: float = EWMA_ALPHA):
+        self.alpha = alpha
+        self._running = 0
+        self._active: Dict[object, Tuple[float, int]] = {}   # 진행 중 generate → (시작 시각, 행 수)
+        self._queued = 0
+        self._ewma_s: Optional[float] = None
+        self._stats = {"generations": 0, "degraded": 0}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self, rows: int = 1) -> Iterator[None]:
+        rows = max(1, rows)
+        key = object()
+        started = time.perf_counter()
+        with self._lock:
+            self._running += rows
+            self._active[key] = (started, rows)
+        try:
+            yield
+        finally:
+            per_request = (time.perf_counter() - started) / rows
+            with self._lock:
+                self._running -= rows
+                del self._active[key]
+                self._stats["generations"] += 1
+                if self._ewma_s is None:
+                    self._ewma_s = per_request
+                else:
+                    self._ewma_s += self.alpha * (per_request - self._ewma_s)
+
+    def enqueue(self, n: int = 1):
+        with self._lock:
+            self._queued += n
+
+    def dequeue(self, n: int = 1):
+        with self._lock:
+            self._queued = max(0, self._queued - n)
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._running + self._queued
+
+    def per_request_s(self) -> Optional[float]:
+        """요청 1건당 generate 시간 EWMA (아직 generate 전이면 None)."""
+        with self._lock:
+            return self._ewma_s
+
+    def predicted_wait_s(self) -> float:
+        """
+        새 요청이 generate 에 들어가기까지 예상 초. EWMA 가 아직 없으면 (첫 generate 전) 0.
+        - 진행 중 generate 는 (행 수 × EWMA - 이미 지난 시간) 만큼만 남았다고 본다
+        - 입장 제어가 generate 를 MIDM_MAX_CONCURRENT 개씩 돌리므로 남은 일을 그 수로 나눈다
+        """
+        import admission   # admission 이 이 모듈을 import 하므로 여기서
+
+        now = time.perf_counter()
+        with self._lock:
+            ewma = self._ewma_s or 0.0
+            work = self._queued * ewma + sum(
+                max(0.0, rows * ewma - (now - started)) for started, rows in self._active.values()
+            )
+        return work / admission.controller.max_concurrent
+
+    def overloaded(self) -> Optional[str]:
+        """넘친 기준 (화면 / 로그용 짧은 문장), 여유가 있으면 None."""
+        if not DEGRADE_ENABLED:
+            return None
+        depth = self.depth()
+        if MAX_DEPTH > 0 and depth >= MAX_DEPTH:
+            return f"대기 {depth}건"
+        wait = self.predicted_wait_s()
+        if MAX_WAIT_S > 0 and wait > MAX_WAIT_S:
+            return f"예상 대기 {wait:.0f}초"
+        return None
+
+    def count_degraded(self):
+        with self._lock:
+            self._stats["degraded"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["running"] = self._running
+            out["queued"] = self._queued
+            out["ewma_s"] = round(self._ewma_s, 3) if self._ewma_s is not None else None
+        out["predicted_wait_s"] = round(self.predicted_wait_s(), 1)
+        out["enabled"] = DEGRADE_ENABLED
+        return out
+
+
+load = LoadTracker()
+
+
+# ==============================
+# 2. 규칙 기반 점수
+# ==============================
+
+# prerank.FEATURES 순서의 고정 기준 범위 (단일 매물도 점수를 내야 해서 후보 간 min-max 대신 사용)
+def _reference_bounds() -> np.ndarray:
+    year = time.localtime().tm_year
+    bounds = {
+        "price": (3_000_000, 60_000_000),
+        "year": (year - 15, year),
+        "mileage": (0, 200_000),
+        "accident": (0, 5),
+        "commercial": (0, 1),
+        "options": (0, 15),
+        "market": (-1, 1),
+    }
+    return np.array([bounds[f] for f in prerank.FEATURES], dtype=np.float64)
+
+
+def fit_scores(vehicles: Sequence[Vehicle], persona_id: str, mode: str) -> np.ndarray:
+    """persona 가중치 점수를 0.0 ~ 10.0 으로 (없는 값은 중립 0.5)."""
+    bounds = _reference_bounds()
+    X = prerank.extract_features(vehicles)
+    with np.errstate(invalid="ignore"):
+        Z = np.clip((X - bounds[:, 0]) / (bounds[:, 1] - bounds[:, 0]), 0.0, 1.0)
+    Z = np.where(np.isnan(Z), 0.5, Z)
+    w = prerank.weights_for(persona_id, mode)
+    lo, hi = np.minimum(w, 0).sum(), np.maximum(w, 0).sum()
+    return np.round((Z @ w - lo) / (hi - lo) * 10.0, 1)
+
+
+def risk_level(v: Vehicle) -> str:
+    severity = prerank._accident_severity(v.accident_history)
+    commercial = bool(v.usage_history and prerank._COMMERCIAL.search(v.usage_history))
+    if not math.isnan(severity) and severity >= 3:
+        return "high"
+    if math.isnan(severity) or severity >= 1 or commercial:
+        return "medium"
+    return "low"
+
+
+# ==============================
+# 3. 규칙 기반 문장 (템플릿)
+# ==============================
+
+_CHECKLIST = {
+    "buy": [
+        "시동 후 공회전/주행 시 이상 소음·진동이 있는지 확인",
+        "고속·저속 주행 시 핸들 떨림·쏠림 여부 확인",
+        "사고·수리·정비 이력을 서류(성능점검기록부, 보험이력)로 확인",
+    ],
+    "sell": [
+        "정비 기록 / 소모품 교체 내역을 정리해 두기",
+        "실내 세차와 외관 작은 흠집 정리로 첫인상 챙기기",
+        "동급 매물 시세를 2~3곳에서 비교해 가격 정하기",
+    ],
+}
+_QUESTIONS = {
+    "buy": [
+        "성능점검기록부와 보험 이력을 보여주실 수 있나요?",
+        "최근 교체한 소모품(타이어, 브레이크, 배터리 등)이 있나요?",
+        "시세보다 가격 조정 여지가 있나요?",
+    ],
+    "sell": [
+        "구매자가 성능점검기록부를 요청하면 바로 보여줄 수 있나요?",
+        "가격 협상 하한선을 정해 두었나요?",
+        "명의 이전 / 대금 지급 절차를 어떻게 진행할지 정해 두었나요?",
+    ],
+}
+_ACCIDENT_CHECK = "사고 부위 수리 상태(패널 단차, 도색 차이)를 직접 확인"
+_COMMERCIAL_CHECK = "렌트/영업 이력 차량은 주행 습관에 따른 소모품 상태를 더 꼼꼼히 확인"
+_NOTICE = "지금은 요청이 많아 매물 정보만으로 만든 간단 분석입니다. 여유가 생기면 LLM 분석으로 다시 받아 보세요."
+
+
+def _facts(v: Vehicle) -> str:
+    parts = []
+    if v.year is not None:
+        parts.append(f"{v.year}년식")
+    if v.mileage_km is not None:
+        parts.append(f"주행 {v.mileage_km:,}km")
+    if v.price_krw is not None:
+        parts.append(constraints.format_krw(v.price_krw))
+    return ", ".join(parts)
+
+
+def _pros_cons(v: Vehicle, limits: constraints.Constraints) -> Dict[str, List[str]]:
+    pros: List[str] = []
+    cons: List[str] = []
+    year = time.localtime().tm_year
+    if v.year is not None:
+        if v.year >= year - 3:
+            pros.append(f"연식이 비교적 최근({v.year}년식)")
+        elif v.year <= year - 10:
+            cons.append(f"연식이 오래된 편({v.year}년식)")
+    if v.mileage_km is not None and v.year is not None:
+        per_year = v.mileage_km / max(1, year - v.year + 1)
+        if per_year < 12_000:
+            pros.append("연식 대비 주행거리가 짧은 편")
+        elif per_year > 20_000:
+            cons.append("연식 대비 주행거리가 긴 편")
+    severity = prerank._accident_severity(v.accident_history)
+    if not math.isnan(severity):
+        if severity == 0:
+            pros.append("사고 이력 없음")
+        else:
+            cons.append(f"사고 이력: {v.accident_history}")
+    if v.usage_history and prerank._COMMERCIAL.search(v.usage_history):
+        cons.append(f"용도 이력: {v.usage_history}")
+    hint = prerank._market_hint(v.market_price_hint)
+    if hint > 0:
+        pros.append("시세보다 저렴한 편")
+    elif hint < 0:
+        cons.append("시세보다 비싼 편")
+    if v.options is not None and len(v.options) >= 5:
+        pros.append(f"옵션 {len(v.options)}개")
+    cons.extend(constraints.violations(v, limits))
+    return {"pros": pros[:3], "cons": cons[:3]}
+
+
+def _checklist(v: Vehicle, mode: str) -> List[str]:
+    items = list(_CHECKLIST.get(mode, _CHECKLIST["buy"]))
+    severity = prerank._accident_severity(v.accident_history)
+    if not math.isnan(severity) and severity > 0:
+        items.append(_ACCIDENT_CHECK)
+    if v.usage_history and prerank._COMMERCIAL.search(v.usage_history):
+        items.append(_COMMERCIAL_CHECK)
+    return items
+
+
+# ==============================
+# 4. 규칙 기반 결과 (LLM 출력과 같은 모양)
+# ==============================
+
+def single_draft(v: Vehicle, persona_id: str, mode: str, user_note: Optional[str] = None) -> Dict[str, Any]:
+    """단일 매물: inference._normalize_single_result 에 그대로 넣을 수 있는 dict."""
+    limits = constraints.extract(user_note) if mode == "buy" else constraints.NONE
+    pc = _pros_cons(v, limits)
+    title = v.title or "이 매물"
+    out: Dict[str, Any] = {
+        "summary": f"{title} ({_facts(v)}). {_NOTICE}" if _facts(v) else f"{title}. {_NOTICE}",
+        "fit_score": float(fit_scores([v], persona_id, mode)[0]),
+        "risk_level": risk_level(v),
+        "highlights": pc["pros"][:2] + pc["cons"][:1],
+        "pros": pc["pros"],
+        "cons": pc["cons"],
+        "checklist": _checklist(v, mode),
+        "questions_for_seller": list(_QUESTIONS.get(mode, _QUESTIONS["buy"])),
+        "recommendation": _NOTICE,
+    }
+    if mode == "sell":
+        out["listing_title"] = " ".join(x for x in (v.title, _facts(v)) if x)[:40]
+        out["listing_body"] = "\n".join(
+            [f"{title} 판매합니다. {_facts(v)}."] + [f"- {p}" for p in pc["pros"]]
+            + ["편하게 구매를 진행하고 싶으신 분께 잘 맞습니다."]
+        )
+    return out
+
+
+def multi_draft(
+    vehicle_list: Sequence[Vehicle],
+    shortlist: Sequence[int],
+    persona_id: str,
+    mode: str,
+    user_note: Optional[str] = None,
+) -> Dict[str, Any]:
+    """멀티 비교: best + ranking (index 는 원래 번호 1-based). shortlist 는 inference 가 고른 후보 (0-based)."""
+    order = sorted(shortlist)
+    scores = fit_scores([vehicle_list[i] for i in order], persona_id, mode)
+    ranked = sorted(zip(order, scores), key=lambda t: (-t[1], t[0]))
+    best_i, best_score = ranked[0]
+    best = vehicle_list[best_i]
+    limits = constraints.extract(user_note) if mode == "buy" else constraints.NONE
+    pc = _pros_cons(best, limits)
+    return {
+        "summary_overall": f"규칙 점수로 {len(ranked)}대를 비교했습니다. {_NOTICE}",
+        "best_index": best_i + 1,
+        "best": {
+            "index": best_i + 1,
+            "title": best.title or "",
+            "fit_score": float(best_score),
+            "summary": f"{best.title or '매물 ' + str(best_i + 1)} ({_facts(best)})",
+            "pros": pc["pros"],
+            "cons": pc["cons"],
+            "checklist": _checklist(best, mode),
+            "questions_for_seller": list(_QUESTIONS.get(mode, _QUESTIONS["buy"])),
+            "risk_level": risk_level(best),
+        },
+        "ranking": [
+            {
+                "index": i + 1,
+                "title": vehicle_list[i].title or "",
+                "fit_score": float(s),
+                "summary": _facts(vehicle_list[i]),
+                "risk_level": risk_level(vehicle_list[i]),
+            }
+            for i, s in ranked
+        ],
+        "recommendation": _NOTICE,
+    }
+
+
+def mark(result: Dict[str, Any], reason: str, kind: str) -> Dict[str, Any]:
+    """정규화까지 끝난 규칙 결과에 degraded 표시 (결과 캐시에는 넣지 않는다)."""
+    result["degraded"] = True
+    result["degraded_reason"] = reason
+    load.count_degraded()
+    metrics.observe_degraded(kind)
+    metrics.log_debug(f"[degraded] {kind}: {reason} → rule-based result")
+    return result
+
+
+def stats() -> Dict[str, Any]:
+    return load.stats()
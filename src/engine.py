@@ -0,0 +1,321 @@
+# engine.py
+# 목적: Mi:dm 모델/토크나이저를 프로세스당 한 벌만 올리는 공유 엔진
+# - inference.py / midm.py 가 같은 Engine 을 사용 (가중치 중복 로드 없음)
+# - 설정은 EngineConfig 한 곳 (env 로 덮어쓰기)
+# - 동시에 첫 요청이 몰려도 로드는 한 번만 (엔진별 lock + double-checked)
+# - 명시적 수명주기: get_engine() → engine.load() → engine.unload() / shutdown()
+# - 상주 모델 LRU 는 가중치를 올린 엔진만 센다 (토크나이저 / config 만 읽는 조회는 LRU 를 건드리지 않음)
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+from transformers import AutoConfig, AutoTokenizer, AutoModelForCausalLM
+
+try:
+    from transformers import BitsAndBytesConfig
+    _HAS_BNB = True
+except Exception:
+    _HAS_BNB = False
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default) not in ("0", "false", "False")
+
+
+def cpu_supports_bf16() -> bool:
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+# MIDM_MODEL 우선, 예전 midm.py 의 TRANSFORMERS_MODEL 도 계속 인정
+DEFAULT_MODEL_ID = (
+    os.getenv("MIDM_MODEL")
+    or os.getenv("TRANSFORMERS_MODEL")
+    or "K-intelligence/Midm-2.0-Base-Instruct"
+)
+
+# CPU 에서의 가중치 형식
+# - float32 : 기존 동작
+# - bfloat16: CPU 가 bf16 연산(AVX512-BF16/AMX)을 지원할 때만, 아니면 float32 로 폴백
+# - int8    : nn.Linear 동적 int8 양자화 (가중치 int8, activation 은 실행 시 양자화)
+# - auto    : bf16 지원이면 bfloat16, 아니면 float32
+CPU_DTYPES = ("float32", "bfloat16", "int8", "auto")
+
+# 동시에 메모리에 올려 둘 모델 수 (기본 1 → 다른 모델의 가중치를 올리면 이전 모델은 내린다)
+MAX_RESIDENT_MODELS = int(os.getenv("MIDM_MAX_RESIDENT_MODELS", "1"))
+
+# assisted decoding 용 draft 모델 (예: K-intelligence/Midm-2.0-Mini-Instruct). 비우면 끔
+# - draft 는 본 모델 옆에 같이 올라가야 하므로 MAX_RESIDENT_MODELS 에 세지 않는다
+DRAFT_MODEL_ID = os.getenv("MIDM_DRAFT_MODEL", "").strip() or None
+
+
+@dataclass(frozen=True)
+class EngineConfig:
+    """
+    모델 로드 정책 (dtype / 양자화 / 디바이스).
+    - GPU: load_in_4bit 이고 bitsandbytes 가 있으면 4bit(nf4), 아니면 float16 + device_map="auto"
+    - CPU: cpu_dtype (float32 / bfloat16 / int8 / auto)
+    """
+    model_id: str = DEFAULT_MODEL_ID
+    force_cpu: bool = False
+    load_in_4bit: bool = False
+    cpu_dtype: str = "float32"
+    trust_remote_code: bool = False
+    context_tokens: int = 0           # 0 이면 모델 config 의 max_position_embeddings
+    max_memory: Optional[Dict[Any, str]] = field(default=None, hash=False, compare=False)
+
+    @classmethod
+    def from_env(cls, model_id: Optional[str] = None) -> "EngineConfig":
+        return cls(
+            model_id=model_id or DEFAULT_MODEL_ID,
+            force_cpu=os.getenv("MIDM_FORCE_CPU", "0") == "1",
+            load_in_4bit=_env_flag("MIDM_LOAD_IN_4BIT", "0"),
+            cpu_dtype=os.getenv("MIDM_CPU_DTYPE", "float32"),
+            trust_remote_code=_env_flag("MIDM_TRUST_REMOTE_CODE", "0"),
+            context_tokens=int(os.getenv("MIDM_CONTEXT_TOKENS", "0")),
+            max_memory={
+                0: os.getenv("MIDM_MAX_MEMORY_GPU0", "10GiB"),
+                "cpu": os.getenv("MIDM_MAX_MEMORY_CPU", "60GiB"),
+            },
+        )
+
+    @property
+    def use_cuda(self) -> bool:
+        return torch.cuda.is_available() and not self.force_cpu
+
+    def resolved_cpu_dtype(self) -> str:
+        """cpu_dtype 을 실제로 쓸 형식으로 확정 (bf16 미지원 CPU 면 float32)."""
+        if self.cpu_dtype not in CPU_DTYPES:
+            raise ValueError(f"MIDM_CPU_DTYPE 는 {CPU_DTYPES} 중 하나여야 합니다: {self.cpu_dtype}")
+        if self.cpu_dtype in ("bfloat16", "auto"):
+            if cpu_supports_bf16():
+                return "bfloat16"
+            if self.cpu_dtype == "bfloat16":
+                print("[Mi:dm] CPU 가 bf16 을 지원하지 않아 float32 로 로드합니다.")
+            return "float32"
+        return self.cpu_dtype
+
+    def weight_format(self) -> str:
+        """실제로 올라갈 가중치 형식: cuda-nf4 / cuda-float16 / cpu-<resolved_cpu_dtype>."""
+        if self.use_cuda:
+            return "cuda-nf4" if self.load_in_4bit and _HAS_BNB else "cuda-float16"
+        return "cpu-" + self.resolved_cpu_dtype()
+
+
+class Engine:
+    """
+    모델 1개 + 토크나이저 1개. tokenizer / model 에 처음 접근할 때 로드된다.
+    - track_resident=False 면 상주 모델 수(MAX_RESIDENT_MODELS)에 세지 않는다 (draft 모델)
+    """
+
+    def __init__(self, config: EngineConfig, track_resident: bool = True):
+        self.config = config
+        self.track_resident = track_resident
+        self._tokenizer = None
+        self._model = None
+        self._context_length: Optional[int] = None
+        self._weight_format: Optional[str] = None
+        self._lock = threading.Lock()
+
+    # ---------- 상태 ----------
+    @property
+    def model_id(self) -> str:
+        return self.config.model_id
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    @property
+    def weight_format(self) -> str:
+        """config.weight_format() 을 한 번만 계산 (가중치를 올리지 않고도 알 수 있다 → 결과 캐시 키에 사용)."""
+        if self._weight_format is None:
+            self._weight_format = self.config.weight_format()
+        return self._weight_format
+
+    @property
+    def tokenizer(self):
+        self.load()
+        return self._tokenizer
+
+    @property
+    def model(self):
+        self.load()
+        return self._model
+
+    @property
+    def device(self) -> torch.device:
+        return self.model.device
+
+    @property
+    def context_length(self) -> int:
+        """최대 context 토큰 수 (가중치는 올리지 않고 config 만 읽는다)."""
+        if self.config.context_tokens > 0:
+            return self.config.context_tokens
+        if self._context_length is None:
+            cfg = AutoConfig.from_pretrained(self.config.model_id, trust_remote_code=self.config.trust_remote_code)
+            self._context_length = int(getattr(cfg, "max_position_embeddings", 0) or 4096)
+        return self._context_length
+
+    def load_tokenizer(self):
+        """토크나이저만 (프롬프트 토큰 수 계산용). 모델이 이미 올라와 있으면 그 토크나이저."""
+        if self._tokenizer is not None:
+            return self._tokenizer
+        with self._lock:
+            if self._tokenizer is None:
+                self._tokenizer = self._make_tokenizer()
+        return self._tokenizer
+
+    # ---------- 수명주기 ----------
+    def load(self) -> "Engine":
+        """가중치를 올린다 (이미 올라와 있으면 최근 사용으로만 표시). 새로 올렸을 때만 다른 엔진을 내린다."""
+        if self._model is not None:
+            _mark_resident(self, evict=False)
+            return self
+        with self._lock:
+            if self._model is None:
+                self._load_locked()
+        _mark_resident(self, evict=True)
+        return self
+
+    def _make_tokenizer(self):
+        tokenizer = AutoTokenizer.from_pretrained(self.config.model_id, trust_remote_code=self.config.trust_remote_code)
+        # pad 토큰 없으면 EOS로 대체 (배치 generate 안정화)
+        if getattr(tokenizer, "pad_token_id", None) is None and getattr(tokenizer, "eos_token_id", None) is not None:
+            tokenizer.pad_token = tokenizer.eos_token
+        return tokenizer
+
+    def _load_locked(self):
+        cfg = self.config
+        print(f"[Mi:dm] loading model: {cfg.model_id}")
+
+        tokenizer = self._tokenizer or self._make_tokenizer()
+
+        kwargs: Dict[str, Any] = {"trust_remote_code": cfg.trust_remote_code}
+        cpu_dtype = None
+        if cfg.use_cuda and cfg.load_in_4bit and _HAS_BNB:
+            kwargs.update(
+                quantization_config=BitsAndBytesConfig(
+                    load_in_4bit=True,
+                    bnb_4bit_compute_dtype=torch.float16,
+                    bnb_4bit_quant_type="nf4",
+                    bnb_4bit_use_double_quant=True,
+                ),
+                device_map="auto",
+                max_memory=cfg.max_memory,
+            )
+            print("[Mi:dm] using GPU (4bit nf4, device_map=auto)")
+        elif cfg.use_cuda:
+            kwargs.update(torch_dtype=torch.float16, device_map="auto")
+            print("[Mi:dm] using GPU (float16, device_map=auto)")
+        else:
+            cpu_dtype = cfg.resolved_cpu_dtype()
+            kwargs.update(torch_dtype=torch.bfloat16 if cpu_dtype == "bfloat16" else torch.float32)
+            print(f"[Mi:dm] using CPU ({cpu_dtype})")
+
+        model = AutoModelForCausalLM.from_pretrained(cfg.model_id, **kwargs).eval()
+        if cpu_dtype == "int8":
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        print("[Mi:dm] device:", model.device)
+
+        self._tokenizer = tokenizer
+        self._model = model
+
+    def unload(self):
+        """가중치 참조를 놓는다. (generate 중인 스레드는 자기 참조로 끝까지 돈다)"""
+        with self._lock:
+            if self._model is None:
+                return
+            self._model = None
+            self._tokenizer = None
+        _forget_resident(self)
+        for hook in list(_unload_hooks):
+            hook(self.model_id)
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        print(f"[Mi:dm] unloaded model: {self.model_id}")
+
+
+# ==============================
+# 전역 레지스트리
+# ==============================
+
+_engines: Dict[str, Engine] = {}
+_resident: "OrderedDict[str, Engine]" = OrderedDict()   # 가중치가 올라와 있는 엔진 (오래 안 쓴 순)
+_drafts: Dict[str, Engine] = {}
+_registry_lock = threading.Lock()
+_unload_hooks: List[Callable[[str], None]] = []
+
+
+def register_unload_hook(fn: Callable[[str], None]):
+    """엔진이 내려갈 때 model_id 로 호출 (모델별 KV 캐시 등 정리용)."""
+    _unload_hooks.append(fn)
+
+
+def get_engine(model_id: Optional[str] = None, config: Optional[EngineConfig] = None) -> Engine:
+    """
+    model_id 에 해당하는 공유 엔진 (없으면 env 설정으로 생성). 로드는 첫 사용 시점.
+    - 조회만으로는 상주 모델 LRU 가 바뀌지 않는다 (load() 가 가중치를 올릴 때만)
+    """
+    cfg = config or EngineConfig.from_env(model_id)
+    with _registry_lock:
+        engine = _engines.get(cfg.model_id)
+        if engine is None:
+            engine = Engine(cfg)
+            _engines[cfg.model_id] = engine
+    return engine
+
+
+def _mark_resident(engine: Engine, evict: bool):
+    """
+    가중치가 올라온 엔진을 최근 사용으로 표시.
+    - evict: 새로 올린 경우. MAX_RESIDENT_MODELS 를 넘으면 가장 오래 안 쓴 엔진을 내린다
+    """
+    if not engine.track_resident:
+        return
+    evicted: List[Engine] = []
+    with _registry_lock:
+        _resident[engine.model_id] = engine
+        _resident.move_to_end(engine.model_id)
+        while evict and len(_resident) > max(1, MAX_RESIDENT_MODELS):
+            _, old = _resident.popitem(last=False)
+            evicted.append(old)
+    for old in evicted:
+        old.unload()
+
+
+def _forget_resident(engine: Engine):
+    with _registry_lock:
+        if _resident.get(engine.model_id) is engine:
+            del _resident[engine.model_id]
+
+
+def get_draft_engine(model_id: str) -> Engine:
+    """
+    draft 모델 엔진 (assisted decoding). 로드 정책은 본 모델과 같은 env 설정.
+    - LRU 레지스트리 밖에 따로 두어서, draft 를 올려도 본 모델이 내려가지 않는다
+    """
+    with _registry_lock:
+        engine = _drafts.get(model_id)
+        if engine is None:
+            engine = Engine(EngineConfig.from_env(model_id), track_resident=False)
+            _drafts[model_id] = engine
+    return engine
+
+
+def shutdown():
+    """등록된 엔진을 모두 내린다 (draft 포함)."""
+    with _registry_lock:
+        engines = list(_engines.values()) + list(_drafts.values())
+        _engines.clear()
+        _resident.clear()
+        _drafts.clear()
+    for engine in engines:
+        engine.unload()
@@ -6,132 +6,46 @@
 from __future__ import annotations
 
 import os
+import copy
 import json
+import re
 import textwrap
+import threading
+import time
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Dict, Any, List, Literal, Optional
+from functools import lru_cache
+from typing import Callable, Dict, Any, Generator, Iterator, List, Literal, Optional, Tuple
 
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
-
-
-Mode = Literal["buy", "sell"]
+from transformers import (
+    DynamicCache,
+    LogitsProcessorList,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+)
+
+import admission
+import canonical
+import constraints
+import degraded
+import engine
+import listing_format
+import metrics
+import prerank
+import result_cache
+from constrained import SchemaLogitsProcessor, get_constraint, schema_hint, schema_name
+from json_stream import StreamingJSONParser, looks_like_result
+from personas import BUY_PERSONAS, SELL_PERSONAS, Mode, Persona, get_persona  # noqa: F401
+from prompt_template import Part, Prompt, TemplateRegistry, slot, static
+from vehicle import Vehicle, VehicleLike, as_vehicle, parse_listings
 
 
 # ==============================
 # 1. 페르소나 정의
 # ==============================
-
-@dataclass
-class Persona:
-    id: str          # internal id
-    label: str       # 한글 라벨
-    mode: Mode       # "buy" or "sell"
-    description: str # 상황/우선순위 설명
-
-
-BUY_PERSONAS: Dict[str, Persona] = {
-    "first_car_student": Persona(
-        id="first_car_student",
-        label="첫 차 사는 대학생",
-        mode="buy",
-        description=(
-            "운전 경력은 많지 않고, 첫 차를 구매하는 대학생이다. "
-            "예산이 넉넉하지 않고, 유지비와 보험료, 주차 난이도가 중요하다. "
-            "안전성과 기본적인 편의 기능은 중요하지만, 고급 옵션이나 출력은 덜 중요하다."
-        ),
-    ),
-    "beginner_driver": Persona(
-        id="beginner_driver",
-        label="초보 운전자",
-        mode="buy",
-        description=(
-            "운전 경력이 짧아 차 폭/길이, 시야, 주차 편의성이 중요하다. "
-            "큰 사고 이력이나 수리비가 많이 나올 수 있는 차량은 피하고 싶다. "
-            "운전이 편하고 실수해도 크게 위험하지 않은 차를 선호한다."
-        ),
-    ),
-    "family_second_car": Persona(
-        id="family_second_car",
-        label="가족용 세컨카(30대)",
-        mode="buy",
-        description=(
-            "아이를 포함한 가족이 함께 타는 세컨카를 찾는 30대 가장/부부다. "
-            "뒷좌석 공간, 유아용 카시트 장착(ISOFIX), 트렁크 적재 공간, 승차감, 안전장비가 매우 중요하다. "
-            "고속 주행 성능보다 편안함과 안전, 유지비의 합리성을 중시한다."
-        ),
-    ),
-    "sales_commute": Persona(
-        id="sales_commute",
-        label="영업/출퇴근용",
-        mode="buy",
-        description=(
-            "하루 평균 주행거리가 길고, 고속도로/시외도로를 자주 타는 직장인 혹은 영업사원이다. "
-            "연비, 내구성, 고속 주행 안정성, 정비 편의성이 매우 중요하다. "
-            "실내 소음/진동도 장거리 피로도에 영향을 준다."
-        ),
-    ),
-    "enthusiast": Persona(
-        id="enthusiast",
-        label="차 좀 아는 사람(고수 모드)",
-        mode="buy",
-        description=(
-            "차량에 대한 지식이 어느 정도 있고, 옵션/트림/사고 이력/감가 등을 세밀하게 본다. "
-            "단순교환과 구조부 손상, 전손/침수, 수리 이력 차이를 구분할 줄 알고, "
-            "시세 대비 메리트가 있는지, 향후 되팔 때 감가까지 고려한다."
-        ),
-    ),
-}
-
-SELL_PERSONAS: Dict[str, Persona] = {
-    "sell_fast": Persona(
-        id="sell_fast",
-        label="빨리 팔고 싶은 사람",
-        mode="sell",
-        description=(
-            "최대한 빠르게 차량을 처분하는 것이 1순위인 판매자다. "
-            "약간의 금전적 손해는 감수할 수 있지만, "
-            "복잡한 협상/네고/직거래 과정은 피하고 싶어 한다."
-        ),
-    ),
-    "sell_best_price": Persona(
-        id="sell_best_price",
-        label="제값 이상 받고 싶은 사람",
-        mode="sell",
-        description=(
-            "시간이 조금 더 걸리더라도, 차량 상태/옵션을 잘 어필해서 "
-            "가능한 한 높은 가격으로 판매하고 싶은 판매자다. "
-            "사진과 설명을 공들여 쓰는 것은 괜찮지만, 과장/허위는 피하고 싶다."
-        ),
-    ),
-    "sell_easy": Persona(
-        id="sell_easy",
-        label="귀찮은 거 최소화",
-        mode="sell",
-        description=(
-            "서류/탁송/네고 등 복잡한 과정을 최소화하고 싶다. "
-            "가격은 어느 정도만 합리적이면 되고, 내 시간을 많이 쓰고 싶지 않은 판매자다."
-        ),
-    ),
-    "sell_safe": Persona(
-        id="sell_safe",
-        label="안전/분쟁 최소화 우선",
-        mode="sell",
-        description=(
-            "나중에 분쟁이 생기지 않도록 사실 기반으로 솔직하게 판매하고 싶다. "
-            "사고 이력/수리 이력을 숨기고 싶지 않고, "
-            "계약 조건과 책임 범위를 명확히 하고 싶어 한다."
-        ),
-    ),
-}
-
-
-def get_persona(persona_id: str, mode: Mode) -> Persona:
-    """persona_id + mode 에 맞는 Persona 객체를 반환."""
-    table = BUY_PERSONAS if mode == "buy" else SELL_PERSONAS
-    if persona_id not in table:
-        raise ValueError(f"Unknown persona_id for mode='{mode}': {persona_id}")
-    return table[persona_id]
+# personas.py 로 분리 (MIDM_SERVER 모드의 앱이 torch 없이 import). inference.Persona 등 기존 경로는 위 import 로 유지
 
 
 # ==============================
@@ -141,64 +55,348 @@ def get_persona(persona_id: str, mode: Mode) -> Persona:
 # ==============================
 # (추가) 멀티 매물용 차량 데이터 압축
 # ==============================
-def _shrink_vehicle_for_multi(v: Dict[str, Any]) -> Dict[str, Any]:
+# 필드 우선순위 (앞일수록 중요). 압축 단계가 올라가면 뒤쪽 필드부터 뺀다.
+FIELD_PRIORITY = (
+    "title",
+    "price_krw",
+    "year",
+    "mileage_km",
+    "accident_history",
+    "usage_history",
+    "options",
+    "market_price_hint",
+    "color",
+    "inspection",
+)
+
+# 압축 단계: (options 최대 개수, 문자열 최대 길이, FIELD_PRIORITY 뒤에서부터 뺄 필드 수)
+_SHRINK_LEVELS = (
+    (12, 240, 0),
+    (8, 160, 0),
+    (6, 120, 1),    # 예전 고정 규칙과 같은 수준 (inspection 제외, options 6개, 120자)
+    (6, 80, 2),
+    (3, 60, 3),
+    (0, 40, 4),
+    (0, 30, 5),
+)
+DEFAULT_SHRINK_LEVEL = 2
+
+
+def _shrink_vehicle_for_multi(v: Vehicle, level: int = DEFAULT_SHRINK_LEVEL) -> Dict[str, Any]:
     """
     멀티 매물 비교 시, 컨텍스트 길이를 줄이기 위해
     꼭 필요한 필드만 남기고 긴 텍스트는 잘라서 사용.
+    - level: _SHRINK_LEVELS 인덱스 (클수록 많이 줄인다, 토큰 예산은 _fit_listings_to_budget 참고)
     """
-    # 1) 우선 키를 줄이자 (필요한 것만)
-    KEYS_KEEP = [
-        "title",
-        "year",
-        "mileage_km",
-        "price_krw",
-        "color",
-        "accident_history",
-        "usage_history",
-        "market_price_hint",
-        "options",
-    ]
-    out: Dict[str, Any] = {}
-    for k in KEYS_KEEP:
-        if k in v:
-            out[k] = v[k]
+    max_options, max_chars, n_drop = _SHRINK_LEVELS[max(0, min(level, len(_SHRINK_LEVELS) - 1))]
+    keys = FIELD_PRIORITY[:len(FIELD_PRIORITY) - n_drop]
+
+    # 1) 우선 키를 줄이자 (필요한 것만, 전체 dict 는 만들지 않는다)
+    out = v.to_dict(keys)
+
+    # 2) 중첩 dict(inspection)는 한 줄 요약으로
+    insp = out.pop("inspection", None)
+    if isinstance(insp, dict):
+        summary = " / ".join(str(insp[k]) for k in ("encar_inspection", "comments") if insp.get(k))
+        if summary:
+            out["inspection_summary"] = summary
+
+    # 3) options 개수 제한 (Vehicle 이라 항상 list)
+    if "options" in out:
+        if max_options <= 0:
+            out.pop("options")
+        elif len(out["options"]) > max_options:
+            out["options"] = out["options"][:max_options]
+
+    # 4) 문자열은 너무 길면 자르기
+    for k, val in list(out.items()):
+        if isinstance(val, str) and len(val) > max_chars:
+            out[k] = val[:max_chars] + "..."
 
-    # 2) options 개수 제한
-    if isinstance(out.get("options"), list) and len(out["options"]) > 6:
-        out["options"] = out["options"][:6]
+    return out
 
-    # 3) 문자열은 너무 길면 자르기
-    for k, val in list(out.items()):
-        if isinstance(val, str) and len(val) > 120:
-            out[k] = val[:120] + "..."
 
-    # 4) 중첩 dict(inspection 등)는 아예 빼버리거나 아주 요약만 남기고 싶으면 여기서 처리
-    # ex)
-    # insp = v.get("inspection")
-    # if isinstance(insp, dict):
-    #     out["inspection_summary"] = insp.get("encar_inspection", "")
+# 멀티 프롬프트 전체(chat 템플릿 포함) 토큰 상한. 0 이면 토큰 예산 없이 DEFAULT_SHRINK_LEVEL 고정
+# (실제 상한은 min(이 값, context 길이 - max_new_tokens))
+MULTI_PREFILL_TOKENS = int(os.getenv("MIDM_MULTI_PREFILL_TOKENS", "3072"))
 
-    return out
 
+# 프롬프트 안 매물 직렬화 형식 (listing_format.FORMATS, 형식별 토큰 수는 python -m bench.formats)
+# - MIDM_VEHICLE_FORMAT: 단일 프롬프트 (table 이면 kv), MIDM_MULTI_VEHICLE_FORMAT: 멀티/map 프롬프트
+VEHICLE_FORMAT = listing_format.check_format(os.getenv("MIDM_VEHICLE_FORMAT", "json"))
+MULTI_VEHICLE_FORMAT = listing_format.check_format(os.getenv("MIDM_MULTI_VEHICLE_FORMAT", VEHICLE_FORMAT))
 
-import re
 
-def _has_budget(user_note: Optional[str]) -> bool:
-    if not user_note:
-        return False
-    text = user_note.replace(" ", "")
-    # 예시 패턴: "1200만원이하", "1500까지", "예산은 1000 정도"
-    patterns = [
-        r"\d+\s*만원\s*(이하|까지|정도)",
-        r"예산\s*[:은]\s*\d+\s*만",
-    ]
-    return any(re.search(p, text) for p in patterns)
+@lru_cache(maxsize=8192)
+def _count_tokens(model_id: str, text: str) -> int:
+    return len(engine.get_engine(model_id).load_tokenizer()(text, add_special_tokens=False)["input_ids"])
+
+
+def _listing_block(index: int, v: Vehicle, level: int) -> str:
+    """[매물 N] 블록 1개 (table 형식이면 머리글 + 1줄)."""
+    v_short = _shrink_vehicle_for_multi(v, level)
+    if MULTI_VEHICLE_FORMAT == "table":
+        return listing_format.format_table([(index, v_short)])
+    return f"[매물 {index}]\n{listing_format.format_vehicle(v_short, MULTI_VEHICLE_FORMAT)}"
+
+
+def _listing_unit(index: int, v: Vehicle, level: int) -> str:
+    """토큰 예산 계산 단위 (table 형식은 머리글을 뺀 1줄)."""
+    if MULTI_VEHICLE_FORMAT == "table":
+        v_short = _shrink_vehicle_for_multi(v, level)
+        return listing_format.table_row(index, v_short, list(v_short))
+    return _listing_block(index, v, level)
+
+
+def _render_listings(listings: List[Tuple[int, Vehicle]], levels: List[int]) -> str:
+    if MULTI_VEHICLE_FORMAT == "table":
+        return listing_format.format_table(
+            [(i, _shrink_vehicle_for_multi(v, lvl)) for (i, v), lvl in zip(listings, levels)]
+        )
+    return "\n\n".join(_listing_block(i, v, lvl) for (i, v), lvl in zip(listings, levels))
+
+
+def _fit_listings_to_budget(
+    listings: List[Tuple[int, Vehicle]],
+    model_id: str,
+    budget_tokens: int,
+) -> List[int]:
+    """
+    (번호, 매물) 목록 → 합계가 budget_tokens 안에 들어오는 매물별 압축 단계.
+    - 모두 가장 느슨한 단계에서 시작해, 현재 가장 긴 블록을 한 단계씩 더 줄인다
+      (짧은 매물은 덜 깎이고, 매물이 적으면 거의 안 깎인다)
+    - 가장 강한 단계로도 넘치면 그대로 두고 경고만 찍는다
+    """
+    levels = [0] * len(listings)
+    costs = [_count_tokens(model_id, _listing_unit(i, v, 0)) for i, v in listings]
+    sep = _count_tokens(model_id, "\n" if MULTI_VEHICLE_FORMAT == "table" else "\n\n")
+    total = sum(costs) + sep * max(0, len(listings) - 1)
+    last = len(_SHRINK_LEVELS) - 1
+
+    while total > budget_tokens:
+        shrinkable = [j for j in range(len(listings)) if levels[j] < last]
+        if not shrinkable:
+            print(f"[Mi:dm] multi prompt over budget: {total} > {budget_tokens} tokens (max compression)")
+            break
+        j = max(shrinkable, key=lambda k: costs[k])
+        levels[j] += 1
+        i, v = listings[j]
+        new_cost = _count_tokens(model_id, _listing_unit(i, v, levels[j]))
+        total += new_cost - costs[j]
+        costs[j] = new_cost
+    return levels
+
+
+def _listing_budget(model_id: str, prompt_without_listings: Prompt, max_new_tokens: int) -> int:
+    """[매물 목록] 에 쓸 수 있는 토큰 수 = 프롬프트 상한 - (instruction/persona/메모 + chat 템플릿)."""
+    eng = engine.get_engine(model_id)
+    cap = eng.context_length - max_new_tokens
+    if MULTI_PREFILL_TOKENS > 0:
+        cap = min(cap, MULTI_PREFILL_TOKENS)
+    # instruction 부분은 템플릿에 캐시된 토큰 id 를 쓰므로 persona/메모만 새로 토크나이즈
+    overhead = len(_prompt_ids(prompt_without_listings, model_id))
+    return max(0, cap - overhead)
+
+
+# 멀티 비교에서 LLM 이 볼 최대 매물 수 (넘으면 prerank 상위만, 0 이면 사전 랭킹 끔)
+PRERANK_TOP_K = int(os.getenv("MIDM_PRERANK_TOP_K", "30"))
+# 한 프롬프트에 원본 매물을 그대로 넣는 최대 수 (넘으면 map-reduce, 0 이면 map-reduce 끔 → 2-2 참고)
+MULTI_SINGLE_PROMPT_MAX = int(os.getenv("MIDM_MULTI_SINGLE_PROMPT_MAX", "8"))
+
+
+# 메모의 예산 / 연식 / 주행거리 / 무사고 조건으로 buy 멀티 비교 후보를 LLM 호출 전에 거른다 (constraints.py)
+# - 0 이면 끔 → 예전처럼 예산 비교를 LLM 이 프롬프트 규칙('예산 하드 가드레일')으로 한다
+CONSTRAINT_FILTER = os.getenv("MIDM_CONSTRAINT_FILTER", "1") not in ("0", "false", "False")
+
+# 프롬프트에 들어가는 예산 규칙 블록 (템플릿 키의 일부, 2-3 참고)
+# - none   : 메모에 예산이 없다
+# - guard  : 예산 비교를 LLM 이 한다 (MIDM_CONSTRAINT_FILTER=0 또는 sell)
+# - checked: 예산 비교는 이미 끝났고, 남은 정보는 [조건 확인] 줄로만 들어간다
+BudgetRule = Literal["none", "guard", "checked"]
+
+
+def _constraint_filter_on(mode: Mode) -> bool:
+    # 판매자의 차는 거르지 않는다 (sell 메모의 금액은 희망 가격이지 상한이 아니다)
+    return CONSTRAINT_FILTER and mode == "buy"
+
+
+def _budget_rule(user_note: Optional[str], mode: Mode) -> BudgetRule:
+    if constraints.extract(user_note).max_price_krw is None:
+        return "none"
+    return "checked" if _constraint_filter_on(mode) else "guard"
+
+
+def _constraint_pool(
+    vehicle_list: List[Vehicle], user_note: Optional[str], mode: Mode
+) -> Tuple[List[int], Dict[int, List[str]]]:
+    """(LLM 에 보여줄 후보 0-based, 조건 위반 매물 → 사유). 모두 위반이면 거르지 않고 전체를 후보로."""
+    if not _constraint_filter_on(mode):
+        return list(range(len(vehicle_list))), {}
+    within, violated = constraints.partition(vehicle_list, constraints.extract(user_note))
+    if not within:
+        return list(range(len(vehicle_list))), violated
+    return within, violated
+
+
+def _conditions_note(vehicle_list: List[Vehicle], user_note: Optional[str], mode: Mode, shown: List[int]) -> str:
+    """[매물 목록] 앞에 붙는 [조건 확인] 줄 (위반 매물이 없으면 빈 문자열)."""
+    pool, violated = _constraint_pool(vehicle_list, user_note, mode)
+    if not violated:
+        return ""
+    limits = constraints.extract(user_note).describe()
+    if len(pool) < len(vehicle_list):
+        return f"[조건 확인] 사용자 조건({limits})을 넘는 {len(violated)}대는 미리 제외했습니다. 아래 매물은 모두 조건을 만족합니다.\n\n"
+    # 전부 위반 → 거르지 못했으니 매물별 사유를 그대로 알려 준다
+    lines = [f"[조건 확인] 사용자 조건({limits})을 모두 만족하는 매물이 없습니다."]
+    lines += [f"- [매물 {i + 1}] {', '.join(violated[i])}" for i in sorted(shown) if i in violated]
+    return "\n".join(lines) + "\n\n"
+
+
+def _prerank_shortlist(vehicle_list: List[Vehicle], persona: Persona, user_note: Optional[str] = None) -> List[int]:
+    """프롬프트에 넣을 매물의 원래 인덱스 (0-based, 사전 점수 순). 사용자 조건 위반 매물은 먼저 뺀다."""
+    pool, violated = _constraint_pool(vehicle_list, user_note, persona.mode)
+    if len(pool) < len(vehicle_list):
+        metrics.log_debug(f"[constraints] {len(violated)} listings excluded: {[i + 1 for i in sorted(violated)]}")
+        candidates = [vehicle_list[i] for i in pool]
+        shortlist = [pool[j] for j in prerank.top_k(candidates, persona.id, persona.mode, k=PRERANK_TOP_K)]
+    else:
+        shortlist = prerank.top_k(vehicle_list, persona.id, persona.mode, k=PRERANK_TOP_K)
+    if len(shortlist) < len(pool):
+        metrics.log_debug(f"[prerank] {len(pool)} → {len(shortlist)} listings: {[i + 1 for i in shortlist]}")
+    return shortlist
+
+
+def _replace_json_example(instruction: str, hint: str) -> str:
+    """
+    instruction 안의 예시 JSON 블록('{' 줄 ~ '}' 줄)을 스키마 key 설명으로 교체.
+    - 스키마 강제 디코딩 모드에서는 구조를 디코딩이 보장하므로 긴 예시가 필요 없다 (prefill 단축)
+    """
+    lines = instruction.split("\n")
+    try:
+        start = lines.index("{")
+        end = lines.index("}", start)
+    except ValueError:
+        return instruction
+    return "\n".join(lines[:start] + [hint] + lines[end + 1:])
 
 
 
 
+@lru_cache(maxsize=None)
+def _single_instruction(mode: Mode, budget: BudgetRule) -> str:
+    """
+    단일 매물 프롬프트의 고정 instruction 블록.
+    - (mode, budget) 에만 의존하므로 한 번 만들고 재사용
+    - 프롬프트 맨 앞에 오는 정적 prefix → call_llm 의 prefix KV 캐시 키로도 사용
+    """
+    if mode == "buy":
+        # 1) 예산과 무관한 공통 규칙
+        base_instruction = textwrap.dedent("""
+        당신은 중고차를 처음 보거나 익숙하지 않은 일반 사용자를 도와주는
+        "중고차 구매 코치"입니다.
+
+        아래 [persona]는 이 매물을 보는 사람의 상황/목적/성향을 설명합니다.
+        아래 [vehicle]은 이 사람이 보고 있는 한 대의 매물에 대한 구조화된 정보입니다.
+
+        원칙:
+        - 항상 persona의 관점에서 설명하세요.
+        - 자동차/보험/정비 전문 용어는 필요한 만큼만 쓰고, 짧게 풀어서 설명하세요.
+        - vehicle_data에 없는 정보(보험료, 세금, 실제 연비, 정확한 유지비 등)는
+          추측해서 단정하지 말고, "이 정보만으로는 정확히 알 수 없다"고 분명히 말하세요.
+          다만 일반적인 경향은 "보통 ~인 경우가 많다" 수준으로만 언급하세요.
+
+        출력 형식:
+        반드시 아래 JSON 형식의 "하나의 객체"만 출력하세요.
+        JSON 코드 블록이나 ```json 같은 래핑 없이, 순수 JSON만 출력하세요.
+
+        {
+          "mode": "buy",
+          "persona_id": "...",
+          "persona_label": "...",
+
+          "summary": "...",
+          ...
+        }
+
+        추가 규칙:
+        - 불필요하게 장황하게 쓰지 말고, 핵심만 간결하게 정리하세요.
+        - persona에 따라 정말 중요한 포인트 위주로 정리하세요.
+        """).strip()
+
+        # 2) 예산 유무에 따라 별도 블록 추가
+        if budget == "checked":
+            budget_block = textwrap.dedent("""
+            예산 관련 규칙 (중요):
+            - 예산 비교는 이미 끝났습니다. [조건 확인] 에 적힌 결과를 그대로 따르세요.
+            - 예산 초과라면 "예산을 초과한다"는 점과 "예산 상으로는 부담"이라는 표현을 반드시 포함하세요.
+            """).strip()
+        elif budget == "guard":
+            budget_block = textwrap.dedent("""
+            예산 관련 규칙 (중요):
+            - [vehicle]의 price_krw 필드에는 이 매물의 가격(원 단위)이 들어 있습니다.
+            - [사용자 메모]에 적힌 예산 상한을 기준으로,
+              price_krw가 이 예산을 넘는다면
+              "예산보다 비싸다", "예산을 초과한다"라고 분명히 적으세요.
+            - 예산을 넘더라도 다른 장점 때문에 추천할 수는 있지만,
+              그 경우에도 "예산 상으로는 부담"이라는 표현을 반드시 포함하세요.
+            """).strip()
+        else:
+            budget_block = textwrap.dedent("""
+            예산 관련 규칙 (중요):
+            - 이번 질문에서는 [사용자 메모]에 구체적인 예산 정보가 없습니다.
+            - 사용자 예산을 임의로 추정하거나,
+              "예산에 맞지 않는다", "예산을 초과한다" 같은 표현은 사용하지 마세요.
+            - 대신 동급 평균 시세나 market_price_hint 를 활용하여
+              "동급 시세 대비 비싸다/저렴하다" 수준으로만 가격을 평가하세요.
+            """).strip()
+
+        base_instruction = base_instruction + "\n\n" + budget_block
+
+
+    else:
+        base_instruction = textwrap.dedent("""
+        당신은 중고차를 판매하려는 사람에게 조언해주는 "중고차 판매 코치"입니다.
+
+        아래 [persona]는 판매자의 상황/목표/성향을 설명합니다.
+        아래 [vehicle]은 판매하려는 차량 한 대에 대한 구조화된 정보입니다.
+
+        출력 규칙(중요):
+        - 반드시 하나의 JSON 객체만 출력하세요.
+        - "요약", "장점" 같은 제목/설명 문장을 JSON 바깥에 쓰지 마세요.
+        - JSON 코드 블록이나 ```json 같은 래핑 없이, 순수 JSON만 출력하세요.
+
+        JSON 스키마는 아래와 같습니다. key 이름과 구조를 그대로 따르세요.
+
+        {
+          "mode": "sell",
+          "persona_id": "...",
+          "persona_label": "...",
+
+          "summary": "이 차량을 어떻게 포지셔닝해서 팔면 좋을지 한 문단 정도로 요약",
+          "fit_score": 0.0,
+          "pros": ["판매 시 강조하면 좋을 점"],
+          "cons": ["솔직하게 밝혀야 할 단점/주의사항"],
+          "risk_level": "low | medium | high",
+          "recommendation": "가격·채널·전략에 대한 한두 문장 조언",
+
+          "listing_title": "중고차 사이트에 올릴 한 줄 제목 (최대 40자 이내, 과장/허위 없이 사실 위주)",
+          "listing_body": "실제 중고차 사이트에 복붙해서 쓸 수 있는 소개 문구 3~6줄. 구매자가 읽는 글이므로 '빠른 판매', '현금화', '빨리 팔고 싶은 분' 같은 표현은 쓰지 말고, '빠르게 구매하고 싶으신 분께 추천드립니다', '편하게 구매를 진행하고 싶으신 분께 적합한 차량입니다'처럼 **구매자 입장**에서 자연스럽게 작성하세요."
+        }
+
+        추가 규칙:
+        - listing_title, listing_body는 반드시 비워두지 말고 최소 한 문장 이상 채우세요.
+        - listing_body 마지막 문장은 가능하면
+          "빠르게 구매하고 싶으신 분께 추천드립니다." 또는
+          "편하게 구매를 진행하고 싶으신 분께 잘 맞습니다."
+          같은 형태로 **구매자 시점**으로 마무리하세요.
+        """).strip()
+
+    if CONSTRAINED_DECODING:
+        base_instruction = _replace_json_example(base_instruction, schema_hint(schema_name(False, mode)))
+    return base_instruction
+
 def build_prompt(
-    vehicle_data: Dict[str, Any] | List[Dict[str, Any]],
+    vehicle_data: VehicleLike | List[VehicleLike],
     persona: Persona,
     user_note: Optional[str] = None,
     
@@ -208,14 +406,16 @@ def build_prompt(
     - generate_view 에서는 단일 dict 로 사용
     - generate_multi_view 에서는 build_multi_prompt 를 쓰므로,
       여기의 list 분기는 주로 테스트/호환용.
+    - dict 를 넘기면 여기서 Vehicle 로 변환 (이미 Vehicle 이면 그대로)
     """
     has_user_note = bool(user_note and user_note.strip())
-    has_budget = _has_budget(user_note)  # 🔹 예산 유무
     is_multi = isinstance(vehicle_data, list)
 
     # ---------- A. 여러 매물 비교용 (호환용) ----------
     if is_multi:
-        vehicles_json = json.dumps(vehicle_data, ensure_ascii=False, indent=2)
+        vehicles_json = json.dumps(
+            [canonical.prepare(v).to_dict() for v in parse_listings(vehicle_data)], ensure_ascii=False, indent=2
+        )
 
         base_instruction = textwrap.dedent("""
         당신은 중고차를 고르는 사람에게 조언해주는 도우미입니다.
@@ -307,104 +507,16 @@ def build_prompt(
         return "\n\n".join(blocks)
 
         # ---------- B. 단일 매물용 ----------
-    vehicle_json = json.dumps(vehicle_data, ensure_ascii=False, indent=2)
-
-    if persona.mode == "buy":
-        # 1) 예산과 무관한 공통 규칙
-        base_instruction = textwrap.dedent("""
-        당신은 중고차를 처음 보거나 익숙하지 않은 일반 사용자를 도와주는
-        "중고차 구매 코치"입니다.
-
-        아래 [persona]는 이 매물을 보는 사람의 상황/목적/성향을 설명합니다.
-        아래 [vehicle]은 이 사람이 보고 있는 한 대의 매물에 대한 구조화된 정보입니다.
-
-        원칙:
-        - 항상 persona의 관점에서 설명하세요.
-        - 자동차/보험/정비 전문 용어는 필요한 만큼만 쓰고, 짧게 풀어서 설명하세요.
-        - vehicle_data에 없는 정보(보험료, 세금, 실제 연비, 정확한 유지비 등)는
-          추측해서 단정하지 말고, "이 정보만으로는 정확히 알 수 없다"고 분명히 말하세요.
-          다만 일반적인 경향은 "보통 ~인 경우가 많다" 수준으로만 언급하세요.
-
-        출력 형식:
-        반드시 아래 JSON 형식의 "하나의 객체"만 출력하세요.
-        JSON 코드 블록이나 ```json 같은 래핑 없이, 순수 JSON만 출력하세요.
-
-        {
-          "mode": "buy",
-          "persona_id": "...",
-          "persona_label": "...",
+    return _single_prompt(vehicle_data, persona, user_note).text
 
-          "summary": "...",
-          ...
-        }
-
-        추가 규칙:
-        - 불필요하게 장황하게 쓰지 말고, 핵심만 간결하게 정리하세요.
-        - persona에 따라 정말 중요한 포인트 위주로 정리하세요.
-        """).strip()
-
-        # 2) 예산 유무에 따라 별도 블록 추가
-        if has_budget:
-            budget_block = textwrap.dedent("""
-            예산 관련 규칙 (중요):
-            - [vehicle]의 price_krw 필드에는 이 매물의 가격(원 단위)이 들어 있습니다.
-            - [사용자 메모]에 적힌 예산 상한을 기준으로,
-              price_krw가 이 예산을 넘는다면
-              "예산보다 비싸다", "예산을 초과한다"라고 분명히 적으세요.
-            - 예산을 넘더라도 다른 장점 때문에 추천할 수는 있지만,
-              그 경우에도 "예산 상으로는 부담"이라는 표현을 반드시 포함하세요.
-            """).strip()
-        else:
-            budget_block = textwrap.dedent("""
-            예산 관련 규칙 (중요):
-            - 이번 질문에서는 [사용자 메모]에 구체적인 예산 정보가 없습니다.
-            - 사용자 예산을 임의로 추정하거나,
-              "예산에 맞지 않는다", "예산을 초과한다" 같은 표현은 사용하지 마세요.
-            - 대신 동급 평균 시세나 market_price_hint 를 활용하여
-              "동급 시세 대비 비싸다/저렴하다" 수준으로만 가격을 평가하세요.
-            """).strip()
-
-        base_instruction = base_instruction + "\n\n" + budget_block
-
-
-    else:
-        base_instruction = textwrap.dedent("""
-        당신은 중고차를 판매하려는 사람에게 조언해주는 "중고차 판매 코치"입니다.
-
-        아래 [persona]는 판매자의 상황/목표/성향을 설명합니다.
-        아래 [vehicle]은 판매하려는 차량 한 대에 대한 구조화된 정보입니다.
-
-        출력 규칙(중요):
-        - 반드시 하나의 JSON 객체만 출력하세요.
-        - "요약", "장점" 같은 제목/설명 문장을 JSON 바깥에 쓰지 마세요.
-        - JSON 코드 블록이나 ```json 같은 래핑 없이, 순수 JSON만 출력하세요.
-
-        JSON 스키마는 아래와 같습니다. key 이름과 구조를 그대로 따르세요.
-
-        {
-          "mode": "sell",
-          "persona_id": "...",
-          "persona_label": "...",
-
-          "summary": "이 차량을 어떻게 포지셔닝해서 팔면 좋을지 한 문단 정도로 요약",
-          "fit_score": 0.0,
-          "pros": ["판매 시 강조하면 좋을 점"],
-          "cons": ["솔직하게 밝혀야 할 단점/주의사항"],
-          "risk_level": "low | medium | high",
-          "recommendation": "가격·채널·전략에 대한 한두 문장 조언",
-
-          "listing_title": "중고차 사이트에 올릴 한 줄 제목 (최대 40자 이내, 과장/허위 없이 사실 위주)",
-          "listing_body": "실제 중고차 사이트에 복붙해서 쓸 수 있는 소개 문구 3~6줄. 구매자가 읽는 글이므로 '빠른 판매', '현금화', '빨리 팔고 싶은 분' 같은 표현은 쓰지 말고, '빠르게 구매하고 싶으신 분께 추천드립니다', '편하게 구매를 진행하고 싶으신 분께 적합한 차량입니다'처럼 **구매자 입장**에서 자연스럽게 작성하세요."
-        }
-
-        추가 규칙:
-        - listing_title, listing_body는 반드시 비워두지 말고 최소 한 문장 이상 채우세요.
-        - listing_body 마지막 문장은 가능하면
-          "빠르게 구매하고 싶으신 분께 추천드립니다." 또는
-          "편하게 구매를 진행하고 싶으신 분께 잘 맞습니다."
-          같은 형태로 **구매자 시점**으로 마무리하세요.
-        """).strip()
 
+def _single_prompt(vehicle_data: VehicleLike, persona: Persona, user_note: Optional[str] = None) -> Prompt:
+    """단일 매물 프롬프트 = 템플릿(instruction 등 고정 조각) + slot(persona / 메모 / 매물). 2-3 참고."""
+    has_user_note = bool(user_note and user_note.strip())
+    budget = _budget_rule(user_note, persona.mode)
+    single_format = "kv" if VEHICLE_FORMAT == "table" else VEHICLE_FORMAT
+    vehicle = as_vehicle(vehicle_data)
+    vehicle_json = listing_format.format_vehicle(canonical.prepare(vehicle).to_dict(), single_format)
 
     persona_block = f"""
     [persona]
@@ -425,65 +537,35 @@ def build_prompt(
 
     vehicle_block = f"""
     [vehicle]
-    아래는 한 대의 중고차 매물에 대한 구조화된 정보입니다. (JSON 객체 형태)
+    아래는 한 대의 중고차 매물에 대한 구조화된 정보입니다. ({listing_format.describe(single_format)})
 
     {vehicle_json}
     """.strip()
-
-    blocks = [base_instruction, persona_block]
+    if budget == "checked":
+        # 예산 판정은 원래 가격으로 여기서 끝내고 결과만 넣는다 (단일 매물은 거를 대상이 없다)
+        limits = constraints.extract(user_note)
+        reasons = constraints.violations(vehicle, limits)
+        verdict = ", ".join(reasons) if reasons else "모두 만족"
+        vehicle_block += f"\n\n[조건 확인] 사용자 조건({limits.describe()}): {verdict}"
+
+    values = {"persona": persona_block, "vehicle": vehicle_block}
     if has_user_note:
-        blocks.append(user_note_block)
-    blocks.append(vehicle_block)
-
-    return "\n\n".join(blocks)
+        values["note"] = user_note_block
+    return _TEMPLATES.get(("single", persona.mode, budget, has_user_note)).fill(**values)
 
 
 # ==============================
 # 2-1. 여러 매물 비교 프롬프트 (메인 멀티용)
 # ==============================
 
-def build_multi_prompt(
-    vehicle_list: List[Dict[str, Any]],
-    persona: Persona,
-    user_note: Optional[str] = None,
-) -> str:
+@lru_cache(maxsize=None)
+def _multi_instruction(mode: Mode, budget: BudgetRule) -> str:
     """
-    여러 매물을 한 번에 받아서 비교/랭킹하도록 하는 프롬프트.
-    - Top1 매물만 상세(장점/단점/질문)
-    - 나머지 매물은 index + title (+ fit_score 정도만)
+    여러 매물 비교 프롬프트의 고정 instruction 블록.
+    - (mode, budget) 에만 의존하므로 한 번 만들고 재사용
+    - 사용자 메모 관련 [중요] 블록은 여기 넣지 않는다 (prefix 가 메모 유무와 무관하도록)
     """
-    has_user_note = bool(user_note and user_note.strip())
-    has_budget = _has_budget(user_note)
-
-    # 매물들을 [매물 1] ... [매물 N] 블록으로 펼쳐서 넣기 (멀티용 압축 포함)
-    vehicles_block_parts = []
-    for idx, v in enumerate(vehicle_list, start=1):
-        v_short = _shrink_vehicle_for_multi(v)
-        v_json = json.dumps(v_short, ensure_ascii=False, indent=2)
-        vehicles_block_parts.append(f"[매물 {idx}]\n{v_json}")
-
-    vehicles_block = "\n\n".join(vehicles_block_parts)
-
-    # 공통 persona 블록
-    persona_block = textwrap.dedent(f"""
-    [persona]
-    id: {persona.id}
-    label: {persona.label}
-    description: {persona.description}
-    """).strip()
-
-    # 사용자 메모 블록 (있을 때만)
-    user_note_block = ""
-    if has_user_note:
-        user_note_block = textwrap.dedent(f"""
-        [사용자 메모]
-        아래 텍스트는 사용자가 직접 적은 메모입니다.
-        이 사람이 무엇을 걱정하는지/중요하게 보는지를 파악하는 데 사용하세요.
-
-        \"\"\"{user_note.strip()}\"\"\" 
-        """).strip()
-
-    if persona.mode == "buy":
+    if mode == "buy":
         base_instruction = textwrap.dedent("""
         당신은 여러 중고차 매물 중에서,
         특정 사용자(persona)에게 가장 잘 맞는 매물을 골라주는 "중고차 구매 의사결정 코치"입니다.
@@ -546,7 +628,19 @@ def build_multi_prompt(
           내용이 애매하면 빈 문자열("") 또는 짧은 문장으로 처리하세요.
         """).strip()
         
-        if has_budget:
+        if budget == "checked":
+            # 예산 비교는 constraints.py 가 끝냈다 → 위 '예산 관련 규칙' 문단과 가드레일 대신
+            # [조건 확인] 을 따르라는 짧은 규칙만
+            head, _, tail = base_instruction.partition("예산 관련 규칙 (중요):")
+            base_instruction = head + tail.split("\n\n", 1)[1]
+            budget_block = textwrap.dedent("""
+            예산 관련 규칙 (중요):
+            - 사용자 조건(예산 등)은 미리 확인했습니다. price_krw 를 예산과 다시 비교하지 마세요.
+            - [조건 확인] 에 제외했다고 적혀 있거나 [조건 확인] 이 없으면, [매물 목록] 의 매물은 모두 조건을 만족합니다.
+            - [조건 확인] 에 "조건을 모두 만족하는 매물이 없습니다" 라고 적혀 있으면,
+              summary_overall 첫 문장과 best.summary 에 예산(조건)을 초과한다는 점을 분명히 적으세요.
+            """).strip()
+        elif budget == "guard":
             budget_block = textwrap.dedent("""
             예산 하드 가드레일 (매우 중요):
 
@@ -638,78 +732,704 @@ def build_multi_prompt(
         - 전체 한국어 텍스트는 600자 이내로 쓰세요.
         """).strip()
 
-    if has_user_note:
-        extra = textwrap.dedent("""
-        [중요]
+    if CONSTRAINED_DECODING:
+        base_instruction = _replace_json_example(base_instruction, schema_hint(schema_name(True, mode)))
+    return base_instruction
+
+def build_multi_prompt(
+    vehicle_list: List[VehicleLike],
+    persona: Persona,
+    user_note: Optional[str] = None,
+    shortlist: Optional[List[int]] = None,
+    model: Optional[str] = None,
+) -> str:
+    """
+    여러 매물을 한 번에 받아서 비교/랭킹하도록 하는 프롬프트.
+    - Top1 매물만 상세(장점/단점/질문)
+    - 나머지 매물은 index + title (+ fit_score 정도만)
+    - shortlist: 이미 계산한 사전 랭킹 결과 (없으면 여기서 계산)
+    - model: 토큰 예산 계산에 쓸 토크나이저/context 길이의 모델 (MULTI_PREFILL_TOKENS 참고)
+    """
+    return _multi_prompt(vehicle_list, persona, user_note, shortlist, model).text
 
-        아래 [사용자 메모]에 사용자가 직접 적은 걱정/조건이 있다면,
-        summary_overall, best.summary/pros/cons/questions_for_seller,
-        ranking[*].fit_score 에 자연스럽게 반영하세요.
 
-        단, 매물 정보에 없는 속성에 대해서는
-        - '정보가 없어서 정확히 비교는 어렵다'고 언급하거나,
-        - 일반적인 경향 수준으로만 조심스럽게 설명하세요.
+def _multi_prompt(
+    vehicle_list: List[VehicleLike],
+    persona: Persona,
+    user_note: Optional[str] = None,
+    shortlist: Optional[List[int]] = None,
+    model: Optional[str] = None,
+) -> Prompt:
+    """build_multi_prompt 의 템플릿 버전 (2-3 참고)."""
+    vehicle_list = parse_listings(vehicle_list)
+    # 매물들을 [매물 1] ... [매물 N] 블록으로 펼쳐서 넣기 (멀티용 압축 포함)
+    # - 매물이 PRERANK_TOP_K 보다 많으면 사전 랭킹 상위만 넣고, 번호는 원래 목록 번호를 그대로 쓴다
+    #   (→ LLM 이 돌려주는 index 가 원래 vehicle_list 기준이라 _normalize_multi_result 가 그대로 동작)
+    if shortlist is None:
+        shortlist = _prerank_shortlist(vehicle_list, persona, user_note)
+    # 프롬프트에는 정규화한 매물 (canonical.py) → 모양만 다른 재요청도 같은 프롬프트 / 같은 결과 캐시 키
+    listings = [(i + 1, canonical.prepare(vehicle_list[i])) for i in sorted(shortlist)]
+
+    note = _conditions_note(vehicle_list, user_note, persona.mode, shortlist)
+    if len(shortlist) < len(vehicle_list):
+        note += (
+            f"(전체 {len(vehicle_list)}대 중 조건이 잘 맞는 {len(shortlist)}대만 보여줍니다. "
+            f"index 는 아래 [매물 N] 의 번호를 그대로 쓰세요.)\n\n"
+        )
+    if MULTI_VEHICLE_FORMAT == "table":
+        note += "(표 형식: 첫 줄은 항목 이름, 이후 한 줄에 매물 하나. 첫 열 번호가 [매물 N] 의 N 입니다.)\n"
+    elif MULTI_VEHICLE_FORMAT != "json":
+        note += f"(각 매물 정보는 {listing_format.describe(MULTI_VEHICLE_FORMAT)}입니다.)\n\n"
+
+    # 매물 블록 압축 정도는 토큰 예산으로 결정 (매물이 적으면 덜, 많으면 더 줄인다)
+    if MULTI_PREFILL_TOKENS > 0:
+        model_id = model or MODEL_ID_DEFAULT
+        # table 머리글은 매물 수와 무관한 고정 비용이라 overhead 쪽에 넣어서 센다
+        fixed = note + (listing_format.table_header(FIELD_PRIORITY) if MULTI_VEHICLE_FORMAT == "table" else "")
+        budget = _listing_budget(
+            model_id, _assemble_multi_prompt(persona, user_note, fixed), GEN_PARAMS_MULTI["max_new_tokens"]
+        )
+        levels = _fit_listings_to_budget(listings, model_id, budget)
+    else:
+        levels = [DEFAULT_SHRINK_LEVEL] * len(listings)
+
+    vehicles_block = note + _render_listings(listings, levels)
+    return _assemble_multi_prompt(persona, user_note, vehicles_block)
+
+
+# [중요] 메모 반영 규칙 (메모가 있을 때만 persona 뒤에 붙는 고정 블록)
+_MULTI_NOTE_RULES = textwrap.dedent("""
+[중요]
+
+아래 [사용자 메모]에 사용자가 직접 적은 걱정/조건이 있다면,
+summary_overall, best.summary/pros/cons/questions_for_seller,
+ranking[*].fit_score 에 자연스럽게 반영하세요.
+
+단, 매물 정보에 없는 속성에 대해서는
+- '정보가 없어서 정확히 비교는 어렵다'고 언급하거나,
+- 일반적인 경향 수준으로만 조심스럽게 설명하세요.
+""").strip()
+
+
+def _assemble_multi_prompt(persona: Persona, user_note: Optional[str], vehicles_block: str) -> Prompt:
+    """멀티 비교 instruction + persona + 메모 + [매물 목록] (원본 매물 / map 단계 요약 공통)."""
+    has_user_note = bool(user_note and user_note.strip())
+
+    # 공통 persona 블록
+    persona_block = textwrap.dedent(f"""
+    [persona]
+    id: {persona.id}
+    label: {persona.label}
+    description: {persona.description}
+    """).strip()
+
+    # 사용자 메모 블록 (있을 때만)
+    user_note_block = ""
+    if has_user_note:
+        user_note_block = textwrap.dedent(f"""
+        [사용자 메모]
+        아래 텍스트는 사용자가 직접 적은 메모입니다.
+        이 사람이 무엇을 걱정하는지/중요하게 보는지를 파악하는 데 사용하세요.
+
+        \"\"\"{user_note.strip()}\"\"\" 
         """).strip()
-        instruction = base_instruction + "\n\n" + extra
+
+    # [중요] 메모 반영 규칙은 instruction 뒤가 아니라 persona 뒤에 둔다.
+    # → instruction 부분은 메모 유무와 상관없이 항상 같은 텍스트(정적 prefix)로 유지 (템플릿 구성은 2-3)
+    values = {"persona": persona_block, "vehicles": vehicles_block}
+    if has_user_note:
+        values["note"] = user_note_block
+    return _TEMPLATES.get(("multi", persona.mode, _budget_rule(user_note, persona.mode), has_user_note)).fill(**values)
+
+
+# ==============================
+# 2-2. 멀티 비교 map-reduce 프롬프트 (매물이 많을 때)
+# ==============================
+# - map   : 매물 1대씩 persona 적합도를 짧게 평가 (프롬프트가 짧고 서로 독립 → 배치로 같이 디코딩)
+# - reduce: map 결과 요약만 모아서 기존 멀티 형식(best / ranking)으로 최종 비교
+# → 매물 수가 늘어도 한 프롬프트에 들어가는 건 '요약 한 줄씩' 이라 context 를 넘지 않는다
+
+@lru_cache(maxsize=None)
+def _map_instruction(mode: Mode) -> str:
+    if mode == "buy":
+        role = "아래 persona 가 이 중고차 매물 한 대를 샀을 때 얼마나 잘 맞는지"
+    else:
+        role = "아래 persona(판매자)가 이 차량을 팔 때 얼마나 유리한 조건인지"
+    base_instruction = textwrap.dedent(f"""
+    당신은 중고차 매물을 빠르게 1차 평가하는 코치입니다.
+    {role} 짧게 평가하세요.
+    여러 매물을 나중에 한꺼번에 비교하기 위한 요약이므로 짧고 사실 위주로 씁니다.
+
+    출력 형식 (JSON 하나만, 코드블록 금지):
+    """).strip() + "\n\n" + textwrap.dedent("""
+    {
+      "fit_score": 0.0,
+      "risk_level": "low | medium | high",
+      "summary": "한 문장 (50자 이내)",
+      "pros": ["최대 2개"],
+      "cons": ["최대 2개"]
+    }
+    """).strip() + "\n\n" + textwrap.dedent("""
+    규칙:
+    - fit_score 는 0.0~10.0, persona 관점의 적합도입니다.
+    - 매물 정보에 없는 내용은 만들지 마세요.
+    """).strip()
+
+    if CONSTRAINED_DECODING:
+        base_instruction = _replace_json_example(base_instruction, schema_hint("multi_map"))
+    return base_instruction
+
+
+def build_map_prompt(
+    vehicle_data: VehicleLike,
+    index: int,
+    persona: Persona,
+    user_note: Optional[str] = None,
+) -> str:
+    """map 단계: 매물 1대 (index 는 원래 목록 번호, 1-based) 짧은 평가 프롬프트."""
+    return _map_prompt(vehicle_data, index, persona, user_note).text
+
+
+def _map_prompt(vehicle_data: VehicleLike, index: int, persona: Persona, user_note: Optional[str] = None) -> Prompt:
+    has_user_note = bool(user_note and user_note.strip())
+    values = {
+        "persona": f"[persona]\nid: {persona.id}\nlabel: {persona.label}\ndescription: {persona.description}",
+        "vehicle": _listing_block(index, canonical.prepare(as_vehicle(vehicle_data)), 0),
+    }
+    if has_user_note:
+        values["note"] = f"[사용자 메모]\n\"\"\"{user_note.strip()}\"\"\""
+    return _TEMPLATES.get(("map", persona.mode, "none", has_user_note)).fill(**values)
+
+
+# reduce 프롬프트에 넣는 map 평가 필드 (매물 한 줄 요약)
+REDUCE_KEYS = ("title", "price_krw", "year", "mileage_km", "fit_score", "risk_level", "summary", "pros", "cons")
+
+
+def build_reduce_prompt(
+    evaluations: List[Dict[str, Any]],
+    persona: Persona,
+    user_note: Optional[str] = None,
+    total: Optional[int] = None,
+    conditions: str = "",
+) -> str:
+    """
+    reduce 단계: map 평가 요약 (한 줄 JSON 씩) 을 기존 멀티 비교 형식으로 최종 랭킹.
+    - conditions: [조건 확인] 줄 (_conditions_note, 원래 매물 목록 기준)
+    """
+    return _reduce_prompt(evaluations, persona, user_note, total, conditions).text
+
+
+def _reduce_prompt(
+    evaluations: List[Dict[str, Any]],
+    persona: Persona,
+    user_note: Optional[str] = None,
+    total: Optional[int] = None,
+    conditions: str = "",
+) -> Prompt:
+    lines = [
+        f"[매물 {e['index']}] " + json.dumps(
+            {k: e[k] for k in REDUCE_KEYS if e.get(k) not in (None, "", [])},
+            ensure_ascii=False,
+        )
+        for e in evaluations
+    ]
+    note = conditions + f"(각 매물을 따로 1차 평가한 요약입니다. 전체 {total or len(evaluations)}대 중 {len(evaluations)}대. "
+    note += "index 는 [매물 N] 의 번호를 그대로 쓰세요.)"
+    return _assemble_multi_prompt(persona, user_note, note + "\n\n" + "\n".join(lines))
+
+
+# ==============================
+# 2-3. 프롬프트 템플릿 레지스트리 (prompt_template.py)
+# ==============================
+# 키: (kind = single | multi | map, mode, budget = none | guard | checked, has_user_note) → 고정 조각 + slot 구성
+# - instruction, 블록 구분자, [중요] 메모 규칙은 고정 조각 (텍스트와 토큰 id 를 한 번만 만든다)
+# - persona / 메모 / 매물 블록은 slot (요청마다 이 부분만 토크나이즈)
+# - 조각 경계는 항상 줄바꿈 뒤라 토크나이저가 원래도 끊는 자리 (첫 요청에서 전체 토크나이즈와 비교)
+
+def _template_parts(key: Tuple[str, Mode, BudgetRule, bool]) -> List[Part]:
+    kind, mode, budget, has_user_note = key
+    if kind == "single":
+        instruction = _single_instruction(mode, budget)
+    elif kind == "multi":
+        instruction = _multi_instruction(mode, budget)
     else:
-        instruction = base_instruction
+        instruction = _map_instruction(mode)
 
-    blocks = [instruction, persona_block]
+    parts = [static(instruction + "\n\n"), slot("persona")]
     if has_user_note:
-        blocks.append(user_note_block)
-    blocks.append("[매물 목록]\n" + vehicles_block)
+        parts += [static("\n\n" + _MULTI_NOTE_RULES + "\n\n" if kind == "multi" else "\n\n"), slot("note")]
+    if kind == "multi":
+        parts += [static("\n\n[매물 목록]\n"), slot("vehicles")]
+    else:
+        parts += [static("\n\n"), slot("vehicle")]
+    return parts
+
+
+_TEMPLATES = TemplateRegistry(
+    _template_parts,
+    tokenizer_for=lambda model_id: engine.get_engine(model_id).load_tokenizer(),
+    build_messages=lambda text: _build_messages(text),
+)
 
-    return "\n\n".join(blocks)
 
+def _prompt_ids(prompt: Prompt, model: Optional[str]) -> List[int]:
+    """chat 템플릿까지 적용한 input_ids (고정 조각은 캐시된 id, slot 만 토크나이즈)."""
+    return _TEMPLATES.encode(prompt, model or MODEL_ID_DEFAULT)
 
 
+def template_stats() -> Dict[str, int]:
+    """템플릿 수 / 토큰 캐시 수 / 조각 이어 붙이기 가능·불가 조합 수."""
+    return _TEMPLATES.stats()
+
 
 # ==============================
 # 3. LLM 로딩 & 호출 (Mi:dm 2.0)
 # ==============================
 
-MODEL_ID_DEFAULT = os.getenv("MIDM_MODEL", "K-intelligence/Midm-2.0-Base-Instruct")
+MODEL_ID_DEFAULT = engine.DEFAULT_MODEL_ID
+
+
+def _load_model(model_id: str = MODEL_ID_DEFAULT) -> engine.Engine:
+    """
+    Mi:dm 2.0 모델 lazy-load → 공유 엔진 반환.
+    - 로드 정책(GPU float16 / CPU float32 / MIDM_FORCE_CPU 등)은 engine.EngineConfig 참고
+    - midm.py 와 같은 엔진을 쓰므로 가중치는 프로세스당 한 벌
+    """
+    return engine.get_engine(model_id).load()
+
+
+SYSTEM_PROMPT = (
+    "너는 중고차 매물 정보를 분석해서 JSON 형식으로만 응답하는 엔카 코파일럿이다. "
+    "반드시 하나의 JSON 객체만 출력해야 하며, '요약', '장점' 같은 제목이나 다른 설명 문장은 "
+    "JSON 바깥에 절대 출력하지 마라. JSON 코드 블록이나 ```json 같은 래핑도 사용하지 마라."
+)
+
+# 배치 생성 시 한 번에 디코딩할 최대 프롬프트 수
+BATCH_SIZE_DEFAULT = int(os.getenv("MIDM_BATCH_SIZE", "8"))
+
+
+def _build_messages(prompt: str) -> List[Dict[str, str]]:
+    """system 역할에 "JSON만 출력" 규칙을 넣은 chat 메시지 구성."""
+    return [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT,
+        },
+        {
+            "role": "user",
+            "content": prompt,
+        },
+    ]
+
+
+# ------------------------------
+# 3-1. 정적 prefix KV 캐시
+# ------------------------------
+# system_prompt + instruction 블록은 (mode, 단일/멀티, 예산 규칙) 조합마다 항상 같은 텍스트다.
+# 이 부분의 past_key_values 를 한 번만 계산해 두고, 요청마다 가변 suffix
+# (persona / 사용자 메모 / 매물 JSON) 만 prefill 한다.
+
+PREFIX_CACHE_ENABLED = os.getenv("MIDM_PREFIX_CACHE", "1") not in ("0", "false", "False")
+
+# (model_id, static_prefix) -> (prefix 토큰 id 리스트, DynamicCache)
+_prefix_cache: Dict[Tuple[str, str], Tuple[List[int], Any]] = {}
+_prefix_lock = threading.Lock()
+
+
+def _drop_prefix_cache(model_id: str):
+    """모델이 내려가면 그 모델의 KV 는 재사용할 수 없으므로 같이 버린다."""
+    with _prefix_lock:
+        for key in [k for k in _prefix_cache if k[0] == model_id]:
+            del _prefix_cache[key]
+
+
+engine.register_unload_hook(_drop_prefix_cache)
+
+
+def _get_prefix_cache(eng: engine.Engine, static_prefix: str) -> Tuple[List[int], Any]:
+    """static_prefix 까지의 chat 템플릿 토큰과 그 KV 캐시를 (없으면 만들어서) 반환."""
+    key = (eng.model_id, static_prefix)
+    with _prefix_lock:
+        hit = _prefix_cache.get(key)
+        if hit is not None:
+            return hit
+
+        tokenizer, model = eng.tokenizer, eng.model
+        # 실제 요청과 같은 chat 템플릿 문자열에서 instruction 끝 + 블록 구분자("\n\n")까지를 prefix 로 사용
+        rendered = tokenizer.apply_chat_template(
+            _build_messages(static_prefix + "\n\n"),
+            tokenize=False,
+            add_generation_prompt=False,
+        )
+        cut = rendered.index(static_prefix) + len(static_prefix) + 2
+        prefix_ids = tokenizer(rendered[:cut], add_special_tokens=False)["input_ids"]
+        # 경계 토큰은 뒤에 오는 텍스트에 따라 merge 가 달라질 수 있어서 하나 빼 둔다
+        prefix_ids = prefix_ids[:-1]
+
+        cache = DynamicCache()
+        with torch.no_grad():
+            cache = model(
+                input_ids=torch.tensor([prefix_ids], dtype=torch.long, device=model.device),
+                past_key_values=cache,
+                use_cache=True,
+            ).past_key_values
+
+        print(f"[Mi:dm] prefix cache built: {len(prefix_ids)} tokens (entries={len(_prefix_cache) + 1})")
+        _prefix_cache[key] = (prefix_ids, cache)
+        return prefix_ids, cache
+
+
+# ------------------------------
+# 3-2. JSON 객체가 닫히면 바로 생성 중단
+# ------------------------------
+# 모델이 닫는 '}' 뒤에 잡담을 붙이면, 그 토큰들은 생성 비용만 들고 파싱에서 버려진다.
+# 디코딩된 스트림을 점진 파서로 따라가다가 '결과 JSON' 객체가 완성되는 순간 멈춘다.
+
+STOP_ON_JSON = os.getenv("MIDM_STOP_ON_JSON", "1") not in ("0", "false", "False")
+
+_early_stop_stats = {"requests": 0, "early_stops": 0, "tokens_saved": 0}
+_early_stop_lock = threading.Lock()
+
+
+class JSONCompleteCriteria(StoppingCriteria):
+    """
+    배치의 각 행마다 생성된 토큰을 이어서 디코딩 → StreamingJSONParser 에 feed.
+    첫 '결과 JSON' 객체가 닫힌 행은 True (해당 행만 종료).
+    """
+
+    def __init__(self, tokenizer, prompt_len: int, batch_size: int = 1, speculative: bool = False):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.parsers = [StreamingJSONParser() for _ in range(batch_size)]
+        self.stopped_at: List[Optional[int]] = [None] * batch_size  # 멈춘 시점의 생성 토큰 수
+        self._pending: List[List[int]] = [[] for _ in range(batch_size)]
+        self._printed = [0] * batch_size
+        # assisted decoding(3-4): 아직 검증 안 된 draft 후보로도 불리므로 확정된 토큰만 파서에 넣는다
+        self.speculative = speculative
+        self._fed = [0] * batch_size
+        self._last: List[List[int]] = [[] for _ in range(batch_size)]
+
+    def _feed_row(self, row: int, token_id: int) -> bool:
+        # TextStreamer 와 같은 방식: 아직 완성 안 된 멀티바이트 문자는 다음 토큰까지 보류
+        pending = self._pending[row]
+        pending.append(token_id)
+        text = self.tokenizer.decode(pending, skip_special_tokens=True)
+        if text.endswith("\ufffd"):
+            return False
+        new_text = text[self._printed[row]:]
+        if text.endswith("\n"):
+            self._pending[row] = []
+            self._printed[row] = 0
+        else:
+            self._printed[row] = len(text)
+
+        parser = self.parsers[row]
+        for ev in parser.feed(new_text):
+            if ev.kind == "object" and looks_like_result(ev.value):
+                return True
+        return False
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        n_gen = input_ids.shape[1] - self.prompt_len
+        done = []
+        for row in range(input_ids.shape[0]):
+            if self.stopped_at[row] is None and n_gen > 0:
+                if self.speculative:
+                    closed = self._feed_confirmed(row, input_ids[row, self.prompt_len:].tolist())
+                else:
+                    closed = self._feed_row(row, int(input_ids[row, -1]))
+                if closed:
+                    self.stopped_at[row] = n_gen
+            done.append(self.stopped_at[row] is not None)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    def _feed_confirmed(self, row: int, generated: List[int]) -> bool:
+        """
+        직전 호출과 겹치는 prefix 까지만 feed.
+        - HF assisted 는 (draft 후보 붙인 시퀀스) → (검증 후 확정 시퀀스) 순서로 부르므로
+          연속한 두 호출의 공통 prefix 는 항상 본 모델이 확정한 토큰이다 (감지는 최대 1 step 늦다)
+        """
+        prev, self._last[row] = self._last[row], generated
+        confirmed = 0
+        for a, b in zip(prev, generated):
+            if a != b:
+                break
+            confirmed += 1
+        while self._fed[row] < confirmed:
+            token_id = generated[self._fed[row]]
+            self._fed[row] += 1
+            if self._feed_row(row, token_id):
+                return True
+        return False
+
+    def report(self, max_new_tokens: int) -> List[int]:
+        """
+        행별 절약 토큰 수를 전역 통계에 반영하고 반환.
+        - 절약 토큰 = max_new_tokens - 멈춘 시점 토큰 수 (EOS 가 더 일찍 나왔을 수도 있으므로 상한값)
+        """
+        saved = [max_new_tokens - n if n is not None else 0 for n in self.stopped_at]
+        with _early_stop_lock:
+            _early_stop_stats["requests"] += len(saved)
+            _early_stop_stats["early_stops"] += sum(1 for n in self.stopped_at if n is not None)
+            _early_stop_stats["tokens_saved"] += sum(saved)
+        return saved
+
+
+class CancelCriteria(StoppingCriteria):
+    """
+    스트림 소비자가 먼저 끊으면(stream_llm 의 finally) set 되는 Event 를 매 step 확인 → 전 행 종료.
+    - 남은 토큰을 끝까지 생성하느라 입장 제어 자리를 붙잡고 있지 않도록
+    """
+
+    def __init__(self, cancel: threading.Event):
+        self.cancel = cancel
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.cancel.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+def early_stop_stats() -> Dict[str, int]:
+    """JSON 완료 시 조기 종료 누적 통계 (요청 수 / 조기 종료 수 / 절약 토큰 수)."""
+    with _early_stop_lock:
+        return dict(_early_stop_stats)
+
+
+# ------------------------------
+# 3-3. 스키마 강제 디코딩 (MIDM_CONSTRAINED=1)
+# ------------------------------
+# _normalize_*_result 가 기대하는 key 순서/타입을 LogitsProcessor 로 강제한다 (constrained.py).
+# - JSON 이 깨져서 raw_text fallback 으로 떨어지는 경우가 사라짐
+# - instruction 의 예시 JSON 블록은 짧은 key 설명으로 대체 → prefill 토큰 감소
+# - 상태별 허용 토큰 마스크는 처음 한 번만 vocab 을 훑어서 만들고 이후에는 재사용
+
+CONSTRAINED_DECODING = os.getenv("MIDM_CONSTRAINED", "0") in ("1", "true", "True")
+
+
+def _schema_for(is_multi: bool, mode: Mode) -> Optional[str]:
+    """스키마 강제 모드면 (단일/멀티, mode) 에 맞는 스키마 이름, 아니면 None."""
+    if not CONSTRAINED_DECODING:
+        return None
+    return schema_name(is_multi, mode)
+
+
+def _schema_processor(
+    eng: engine.Engine,
+    schema: Optional[str],
+    prompt_len: int,
+    batch_size: int = 1,
+) -> Optional[LogitsProcessorList]:
+    if not schema:
+        return None
+    vocab_size = max(len(eng.tokenizer), eng.model.config.vocab_size)
+    constraint = get_constraint(schema, eng.tokenizer, vocab_size)
+    return LogitsProcessorList([SchemaLogitsProcessor(constraint, prompt_len=prompt_len, batch_size=batch_size)])
+
+
+def _logits_processors(
+    eng: engine.Engine,
+    schema: Optional[str],
+    prompt_len: int,
+    batch_size: int = 1,
+) -> Tuple[LogitsProcessorList, metrics.GenerationTimer]:
+    """스키마 강제 processor (있으면) + prefill/decode 시간 측정용 타이머."""
+    processors = _schema_processor(eng, schema, prompt_len, batch_size) or LogitsProcessorList()
+    timer = metrics.GenerationTimer()
+    processors.append(timer)
+    return processors, timer
+
+
+def _generation_timer(gen_kwargs: Dict[str, Any]) -> metrics.GenerationTimer:
+    return next(p for p in gen_kwargs["logits_processor"] if isinstance(p, metrics.GenerationTimer))
+
+
+# ------------------------------
+# 3-4. assisted decoding (MIDM_DRAFT_MODEL)
+# ------------------------------
+# 작은 draft 모델(예: Mi:dm Mini)이 토큰 몇 개를 먼저 제안하고, 본 모델(예: Mi:dm Base)이 한 번의 forward 로 검증한다.
+# greedy 라 결과는 본 모델 단독 greedy 와 같고 (수락되는 토큰 = 본 모델이 골랐을 토큰), 본 모델 forward 횟수만 준다.
+# 출력 JSON 은 key / 따옴표 / 구두점처럼 뻔한 토큰이 대부분이라 수락률이 높다.
+# - call_llm / stream_llm 에서만 (HF assisted generate 는 batch_size=1 만 지원 → call_llm_batch 는 기존 배치 디코딩)
+# - 이 경로는 prefix KV 캐시(3-1)를 쓰지 않는다 (draft 쪽에는 그 캐시가 없어서 prompt 전체를 어차피 prefill)
+# - draft 와 본 모델의 vocab 이 다르면 그 모델 조합에서는 끈다
+
+DRAFT_MODEL_ID = engine.DRAFT_MODEL_ID
+DRAFT_TOKENS = int(os.getenv("MIDM_DRAFT_TOKENS", "8"))              # 한 번에 제안할 토큰 수 (시작값)
+DRAFT_SCHEDULE = os.getenv("MIDM_DRAFT_SCHEDULE", "heuristic")       # heuristic: 다 맞으면 +2, 틀리면 -1 / constant
+
+# (본 모델, draft) → vocab 호환 여부
+_draft_compat: Dict[Tuple[str, str], bool] = {}
+_assist_stats = {"requests": 0, "drafted": 0, "accepted": 0, "steps": 0}
+_assist_lock = threading.Lock()
+# generate 를 돌리는 스레드별 forward 카운터 (수락률 계산용, 다른 요청과 섞이지 않게)
+_assist_local = threading.local()
+
 
-_tokenizer = None
-_model = None
-_loaded_model_id = None
+def _hook_forward_counter(model, role: str):
+    """model forward 마다 현재 스레드의 카운터[role] += 1 (모델 객체당 한 번만 등록)."""
+    if getattr(model, "_midm_assist_role", None) is not None:
+        return
+
+    def _pre_hook(module, args):
+        counts = getattr(_assist_local, "counts", None)
+        if counts is not None:
+            counts[role] += 1
+
+    model.register_forward_pre_hook(_pre_hook)
+    model._midm_assist_role = role
+
+
+def _draft_for(model_id: str) -> Optional[engine.Engine]:
+    """model_id 에 붙일 draft 엔진. 설정이 없거나 / 같은 모델이거나 / vocab 이 다르면 None."""
+    if not DRAFT_MODEL_ID or DRAFT_MODEL_ID == model_id:
+        return None
+    key = (model_id, DRAFT_MODEL_ID)
+    if _draft_compat.get(key) is False:
+        return None
+
+    target = _load_model(model_id)
+    draft = engine.get_draft_engine(DRAFT_MODEL_ID).load()
+    with _assist_lock:
+        ok = _draft_compat.get(key)
+        if ok is None:
+            ok = (
+                target.tokenizer.get_vocab() == draft.tokenizer.get_vocab()
+                and target.model.config.vocab_size == draft.model.config.vocab_size
+            )
+            if ok:
+                draft.model.generation_config.num_assistant_tokens = DRAFT_TOKENS
+                draft.model.generation_config.num_assistant_tokens_schedule = DRAFT_SCHEDULE
+                print(f"[Mi:dm] assisted decoding: {model_id} ← draft {DRAFT_MODEL_ID} (tokens={DRAFT_TOKENS}, {DRAFT_SCHEDULE})")
+            else:
+                print(f"[Mi:dm] draft {DRAFT_MODEL_ID} 의 vocab 이 {model_id} 와 달라 assisted decoding 을 끕니다.")
+            _draft_compat[key] = ok
+        if not ok:
+            return None
+        _hook_forward_counter(target.model, "target")
+        _hook_forward_counter(draft.model, "draft")
+    return draft
+
+
+@contextmanager
+def _assist_counts(gen_kwargs: Dict[str, Any]) -> Iterator[Optional[Dict[str, int]]]:
+    """assisted generate 동안 현재 스레드의 본 모델 / draft forward 횟수를 센다 (아니면 None)."""
+    if "assistant_model" not in gen_kwargs:
+        yield None
+        return
+    counts = {"target": 0, "draft": 0}
+    _assist_local.counts = counts
+    try:
+        yield counts
+    finally:
+        _assist_local.counts = None
 
 
-def _load_model(model_id: str = MODEL_ID_DEFAULT):
+def _report_assist(path: str, counts: Optional[Dict[str, int]], generated: int):
     """
-    Mi:dm 2.0 모델 lazy-load.
-    - GPU 가 있으면 float16 + device_map="auto"
-    - 없으면 CPU float32 로 로드 (MIDM_FORCE_CPU=1 도 강제 CPU)
+    수락률 집계.
+    - draft forward 1번 = 제안 토큰 1개, 본 모델 forward 1번 = 검증 1 step
+    - step 마다 (수락된 draft 토큰 + 본 모델 토큰 1개) 가 확정되므로 수락 토큰 = 생성 토큰 - step 수
     """
-    global _tokenizer, _model, _loaded_model_id
-
-    if _model is not None and _loaded_model_id == model_id:
+    if counts is None:
         return
+    steps, drafted = counts["target"], counts["draft"]
+    accepted = max(0, min(drafted, generated - steps))
+    metrics.observe_assist(path, drafted, accepted, steps)
+    with _assist_lock:
+        _assist_stats["requests"] += 1
+        _assist_stats["drafted"] += drafted
+        _assist_stats["accepted"] += accepted
+        _assist_stats["steps"] += steps
+    rate = accepted / drafted if drafted else 0.0
+    metrics.log_debug(f"[DEBUG] assisted: accepted {accepted}/{drafted} draft tokens ({rate:.0%}), {steps} target forwards for {generated} tokens")
+
+
+def assist_stats() -> Dict[str, Any]:
+    """assisted decoding 누적 통계 (요청 수 / 제안 / 수락 / 본 모델 forward 수 / 수락률)."""
+    with _assist_lock:
+        out: Dict[str, Any] = dict(_assist_stats)
+    out["draft_model"] = DRAFT_MODEL_ID
+    out["acceptance_rate"] = round(out["accepted"] / out["drafted"], 4) if out["drafted"] else None
+    return out
 
-    print(f"[Mi:dm] loading model: {model_id}")
 
-    force_cpu = os.getenv("MIDM_FORCE_CPU", "0") == "1"
-    has_cuda = torch.cuda.is_available() and not force_cpu
+def _prepare_generation(
+    prompt: str,
+    model_id: str,
+    max_new_tokens: int,
+    static_prefix: Optional[str] = None,
+    schema: Optional[str] = None,
+    prompt_ids: Optional[List[int]] = None,
+) -> Dict[str, Any]:
+    """
+    단일 프롬프트용 generate() 인자 구성 (call_llm / stream_llm 공통).
+    - static_prefix: prompt 가 이 텍스트로 시작하면 해당 prefix 의 KV 캐시를 재사용
+    - schema: constrained.SCHEMAS 의 이름이면 해당 스키마로 출력 강제
+    - prompt_ids: 이미 chat 템플릿까지 토크나이즈한 id (템플릿 레지스트리, 2-3). 없으면 여기서 토크나이즈
+    - MIDM_DRAFT_MODEL 이 있으면 assisted decoding (3-4, 이때 prefix 캐시는 쓰지 않음)
+    """
+    eng = _load_model(model_id)
+    tokenizer = eng.tokenizer
 
-    if has_cuda:
-        torch_dtype = torch.float16
-        device_map = "auto"
-        print("[Mi:dm] using GPU (float16, device_map=auto)")
+    if prompt_ids is not None:
+        input_ids = torch.tensor([prompt_ids], dtype=torch.long, device=eng.device)
     else:
-        torch_dtype = torch.float32
-        device_map = None
-        print("[Mi:dm] using CPU (float32)")
+        input_ids = tokenizer.apply_chat_template(
+            _build_messages(prompt),
+            tokenize=True,
+            add_generation_prompt=True,
+            return_tensors="pt",
+        ).to(eng.device)
+
+    draft = _draft_for(model_id)
+    past_key_values = None
+    if draft is None and static_prefix and PREFIX_CACHE_ENABLED and prompt.startswith(static_prefix):
+        prefix_ids, cache = _get_prefix_cache(eng, static_prefix)
+        n = len(prefix_ids)
+        if input_ids.shape[1] > n and input_ids[0, :n].tolist() == prefix_ids:
+            # generate 가 cache 를 in-place 로 늘리므로 요청마다 복사본 사용
+            past_key_values = copy.deepcopy(cache)
+        else:
+            print("[Mi:dm] prefix cache mismatch → full prefill")
+
+    stopping_criteria = None
+    if STOP_ON_JSON:
+        stopping_criteria = StoppingCriteriaList(
+            [JSONCompleteCriteria(tokenizer, prompt_len=input_ids.shape[1], speculative=draft is not None)]
+        )
+
+    assist: Dict[str, Any] = {}
+    if draft is not None:
+        draft_cfg = draft.model.generation_config
+        # draft 의 generate 에 넘어가는 설정과 draft 모델 기본값을 맞춰 둔다 (안 맞으면 HF 가 매번 경고)
+        assist = dict(
+            assistant_model=draft.model,
+            num_assistant_tokens=draft_cfg.num_assistant_tokens,
+            num_assistant_tokens_schedule=draft_cfg.num_assistant_tokens_schedule,
+        )
 
-    _tokenizer = AutoTokenizer.from_pretrained(model_id)
+    return dict(
+        **assist,
+        input_ids=input_ids,
+        attention_mask=torch.ones_like(input_ids),
+        past_key_values=past_key_values,
+        stopping_criteria=stopping_criteria,
+        logits_processor=_logits_processors(eng, schema, prompt_len=input_ids.shape[1])[0],
+        max_new_tokens=max_new_tokens,
+        do_sample=False,              # JSON 뽑을 거라 sampling 끔
+        temperature=0.0,      # 혹시라도 사용할 경우 대비
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.eos_token_id,
+        top_p = 1.0
+    )
 
-    _model = AutoModelForCausalLM.from_pretrained(
-        model_id,
-        device_map=device_map,
-        torch_dtype=torch_dtype,
-    ).eval()
 
-    print("[Mi:dm] device:", _model.device)
-    _loaded_model_id = model_id
+def _report_early_stop(gen_kwargs: Dict[str, Any], max_new_tokens: int):
+    criteria = [c for c in gen_kwargs.get("stopping_criteria") or [] if isinstance(c, JSONCompleteCriteria)]
+    if not criteria:
+        return
+    saved = criteria[0].report(max_new_tokens)
+    if saved[0]:
+        metrics.log_debug(f"[DEBUG] stopped at JSON close: saved up to {saved[0]} tokens")
 
 
 def call_llm(
@@ -717,165 +1437,297 @@ def call_llm(
     model: Optional[str] = None,
     max_new_tokens: int = 1024,
     temperature: float = 0.0,
+    static_prefix: Optional[str] = None,
+    schema: Optional[str] = None,
+    input_ids: Optional[List[int]] = None,
+    session_id: Optional[str] = None,
+    lane: admission.Lane = "interactive",
 ) -> str:
     """
     Mi:dm 2.0 호출 래퍼.
     - system 역할에 "JSON만 출력" 규칙을 강하게 명시
     - chat_template + add_generation_prompt=True 사용
+    - static_prefix: prompt 가 이 텍스트로 시작하면 해당 prefix 의 KV 캐시를 재사용
+    - schema: 지정하면 스키마 강제 디코딩 (3-3 참고)
+    - input_ids: prompt 를 chat 템플릿까지 토크나이즈한 id (_prompt_ids). 주면 다시 토크나이즈하지 않는다
+    - session_id / lane: 입장 제어 (admission.py). 자리를 받을 때까지 기다린 뒤 generate
+      (prefix KV 복사 / prefix forward 도 자리 안에서: 대기 중인 요청마다 KV 사본을 들고 있지 않게)
     """
-    global _tokenizer, _model
-
     model_id = model or MODEL_ID_DEFAULT
-    _load_model(model_id)
 
-    system_prompt = (
-        "너는 중고차 매물 정보를 분석해서 JSON 형식으로만 응답하는 엔카 코파일럿이다. "
-        "반드시 하나의 JSON 객체만 출력해야 하며, '요약', '장점' 같은 제목이나 다른 설명 문장은 "
-        "JSON 바깥에 절대 출력하지 마라. JSON 코드 블록이나 ```json 같은 래핑도 사용하지 마라."
+    with admission.controller.slot(session_id, lane):
+        gen_kwargs = _prepare_generation(prompt, model_id, max_new_tokens, static_prefix, schema, input_ids)
+        input_ids = gen_kwargs["input_ids"]
+        eng = _load_model(model_id)
+        timer = _generation_timer(gen_kwargs)
+        timer.start()
+        with torch.no_grad(), _assist_counts(gen_kwargs) as assist, degraded.load.track():
+            outputs = eng.model.generate(**gen_kwargs)
+
+    gen_ids = outputs[0][input_ids.shape[1]:]
+    metrics.observe_generation("single", timer, [input_ids.shape[1]], [gen_ids.shape[0]])
+    metrics.log_debug(f"[DEBUG] generated tokens: {gen_ids.shape[0]} (max_new_tokens={max_new_tokens})")
+    _report_assist("single", assist, gen_ids.shape[0])
+    _report_early_stop(gen_kwargs, max_new_tokens)
+
+    text = eng.tokenizer.decode(gen_ids, skip_special_tokens=True)
+    return text.strip()
+
+
+def stream_llm(
+    prompt: str,
+    model: Optional[str] = None,
+    max_new_tokens: int = 1024,
+    static_prefix: Optional[str] = None,
+    schema: Optional[str] = None,
+    input_ids: Optional[List[int]] = None,
+    session_id: Optional[str] = None,
+    lane: admission.Lane = "interactive",
+    ticket: Optional[admission.Ticket] = None,
+) -> Iterator[str]:
+    """
+    call_llm 의 스트리밍 버전.
+    - generate 는 별도 스레드에서 돌리고, TextIteratorStreamer 로 디코딩된 텍스트 조각을 yield
+    - ticket: 이미 자리를 받은 입장 ticket (_stream_events 가 대기 순번을 내보내며 기다린 경우).
+      없으면 여기서 session_id / lane 으로 자리를 기다린다. 어느 쪽이든 생성이 끝나면 반납
+    - 자리를 받은 뒤에 gen_kwargs 를 만든다 (call_llm 과 같은 이유)
+    """
+    model_id = model or MODEL_ID_DEFAULT
+    if ticket is None:
+        ticket = admission.controller.acquire(session_id, lane)
+    try:
+        gen_kwargs = _prepare_generation(prompt, model_id, max_new_tokens, static_prefix, schema, input_ids)
+        eng = _load_model(model_id)
+    except BaseException:
+        admission.controller.release(ticket)
+        raise
+
+    streamer = TextIteratorStreamer(eng.tokenizer, skip_prompt=True, skip_special_tokens=True)
+    gen_kwargs["streamer"] = streamer
+    cancel = threading.Event()
+    gen_kwargs["stopping_criteria"] = StoppingCriteriaList(
+        list(gen_kwargs.get("stopping_criteria") or []) + [CancelCriteria(cancel)]
     )
 
-    messages = [
-        {
-            "role": "system",
-            "content": system_prompt,
-        },
-        {
-            "role": "user",
-            "content": prompt,
-        },
+    errors: List[BaseException] = []
+    timer = _generation_timer(gen_kwargs)
+    prompt_len = gen_kwargs["input_ids"].shape[1]
+
+    def _run():
+        try:
+            timer.start()
+            with torch.no_grad(), _assist_counts(gen_kwargs) as assist, degraded.load.track():
+                outputs = eng.model.generate(**gen_kwargs)
+            metrics.observe_generation("stream", timer, [prompt_len], [outputs.shape[1] - prompt_len])
+            _report_assist("stream", assist, outputs.shape[1] - prompt_len)
+        except BaseException as e:  # 스트리머가 멈추지 않도록 종료 신호는 항상 보낸다
+            errors.append(e)
+            streamer.end()
+
+    thread = threading.Thread(target=_run, name="midm-stream", daemon=True)
+    thread.start()
+    try:
+        for chunk in streamer:
+            if chunk:
+                yield chunk
+    finally:
+        cancel.set()   # 소비자가 중간에 멈췄으면 다음 step 에서 generate 종료 (정상 종료면 이미 끝나 있음)
+        thread.join()
+        admission.controller.release(ticket)
+        _report_early_stop(gen_kwargs, max_new_tokens)
+
+    if errors:
+        raise errors[0]
+
+
+def _bucket_by_length(lengths: List[int], batch_size: int) -> List[List[int]]:
+    """
+    프롬프트 길이 기준으로 정렬 후 batch_size 씩 묶는다.
+    비슷한 길이끼리 묶어야 left-padding 낭비가 줄어든다.
+    반환값은 원래 인덱스들의 리스트(버킷) 목록.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def _generate_batch_ids(
+    prompts: List[str],
+    model_id: str,
+    max_new_tokens: int,
+    batch_size: int,
+    schema: Optional[str] = None,
+    input_ids: Optional[List[Optional[List[int]]]] = None,
+    session_id: Optional[str] = None,
+    lane: admission.Lane = "bulk",
+) -> List[List[int]]:
+    """
+    여러 프롬프트를 left-padding 해서 한 번의 generate 로 같이 디코딩.
+    반환: 프롬프트 순서대로 생성된 토큰 id 리스트 (프롬프트 부분 제외, pad/eos 제거)
+    - input_ids: 프롬프트별로 이미 토크나이즈한 id (None 인 프롬프트만 여기서 토크나이즈)
+    - 입장 제어 자리는 버킷(generate 1회)마다 받는다 → 버킷 사이에 다른 세션 요청이 끼어들 수 있다
+    """
+    eng = _load_model(model_id)
+    tokenizer, model = eng.tokenizer, eng.model
+
+    given = input_ids or [None] * len(prompts)
+    encoded: List[List[int]] = [
+        ids if ids is not None else tokenizer.apply_chat_template(
+            _build_messages(p),
+            tokenize=True,
+            add_generation_prompt=True,
+        )
+        for p, ids in zip(prompts, given)
     ]
 
-    input_ids = _tokenizer.apply_chat_template(
-        messages,
-        tokenize=True,
-        add_generation_prompt=True,
-        return_tensors="pt",
-    ).to(_model.device)
-
-    with torch.no_grad():
-        outputs = _model.generate(
-            input_ids,
-            max_new_tokens=max_new_tokens,
-            do_sample=False,              # JSON 뽑을 거라 sampling 끔
-            temperature=0.0,      # 혹시라도 사용할 경우 대비
-            eos_token_id=_tokenizer.eos_token_id,
-            pad_token_id=_tokenizer.eos_token_id,
-            top_p = 1.0
+    pad_id = tokenizer.pad_token_id
+    if pad_id is None:
+        pad_id = tokenizer.eos_token_id
+    eos_id = tokenizer.eos_token_id
+
+    results: List[List[int]] = [[] for _ in prompts]
+
+    for bucket in _bucket_by_length([len(e) for e in encoded], batch_size):
+        max_len = max(len(encoded[i]) for i in bucket)
+
+        # decoder-only 모델이므로 왼쪽에 pad 를 채워서 마지막 토큰 위치를 맞춘다
+        input_rows = []
+        mask_rows = []
+        for i in bucket:
+            ids = encoded[i]
+            n_pad = max_len - len(ids)
+            input_rows.append([pad_id] * n_pad + list(ids))
+            mask_rows.append([0] * n_pad + [1] * len(ids))
+
+        batch_ids = torch.tensor(input_rows, dtype=torch.long, device=model.device)
+        attention_mask = torch.tensor(mask_rows, dtype=torch.long, device=model.device)
+
+        crit = None
+        if STOP_ON_JSON:
+            crit = JSONCompleteCriteria(tokenizer, prompt_len=max_len, batch_size=len(bucket))
+
+        processors, timer = _logits_processors(eng, schema, prompt_len=max_len, batch_size=len(bucket))
+        with admission.controller.slot(session_id, lane):
+            timer.start()
+            with torch.no_grad(), degraded.load.track(rows=len(bucket)):
+                outputs = model.generate(
+                    batch_ids,
+                    attention_mask=attention_mask,
+                    max_new_tokens=max_new_tokens,
+                    do_sample=False,
+                    temperature=0.0,
+                    eos_token_id=eos_id,
+                    pad_token_id=pad_id,
+                    top_p=1.0,
+                    stopping_criteria=StoppingCriteriaList([crit]) if crit else None,
+                    logits_processor=processors,
+                )
+
+        for row, i in enumerate(bucket):
+            gen = outputs[row, max_len:].tolist()
+            # JSON 이 닫혀서 먼저 멈춘 행은 그 뒤가 pad 로 채워진다
+            if crit is not None and crit.stopped_at[row] is not None:
+                gen = gen[:crit.stopped_at[row]]
+            # 먼저 끝난 시퀀스는 뒤쪽이 pad/eos 로 채워지므로 첫 eos 에서 자른다
+            if eos_id is not None and eos_id in gen:
+                gen = gen[:gen.index(eos_id)]
+            results[i] = gen
+
+        metrics.observe_generation(
+            "batch", timer, [len(encoded[i]) for i in bucket], [len(results[i]) for i in bucket]
         )
+        if crit is not None:
+            crit.report(max_new_tokens)
 
-    gen_ids = outputs[0][input_ids.shape[1]:]
-    print(f"[DEBUG] generated tokens: {gen_ids.shape[0]} (max_new_tokens={max_new_tokens})")
+        metrics.log_debug(
+            f"[DEBUG] batch generate: size={len(bucket)}, prompt_len={max_len}, "
+            f"generated={[len(results[i]) for i in bucket]} (max_new_tokens={max_new_tokens})"
+        )
 
-    text = _tokenizer.decode(gen_ids, skip_special_tokens=True)
-    return text.strip()
+    return results
+
+
+def call_llm_batch(
+    prompts: List[str],
+    model: Optional[str] = None,
+    max_new_tokens: int = 1024,
+    batch_size: Optional[int] = None,
+    schema: Optional[str] = None,
+    input_ids: Optional[List[Optional[List[int]]]] = None,
+    session_id: Optional[str] = None,
+    lane: admission.Lane = "bulk",
+) -> List[str]:
+    """
+    call_llm 의 배치 버전.
+    - 프롬프트 길이로 버킷팅 → 버킷마다 left-padding 후 한 번에 generate
+    - 결과는 입력 prompts 순서 그대로 반환
+    - schema: 배치 안의 모든 프롬프트에 같은 스키마를 강제
+    - input_ids: 프롬프트별 토크나이즈 결과 (_prompt_ids, 없는 프롬프트는 None)
+    - session_id / lane: 입장 제어 (배치는 기본 bulk lane)
+    """
+    if not prompts:
+        return []
+
+    model_id = model or MODEL_ID_DEFAULT
+    gen_ids = _generate_batch_ids(
+        prompts,
+        model_id=model_id,
+        max_new_tokens=max_new_tokens,
+        batch_size=max(1, batch_size or BATCH_SIZE_DEFAULT),
+        schema=schema,
+        input_ids=input_ids,
+        session_id=session_id,
+        lane=lane,
+    )
+    tokenizer = _load_model(model_id).tokenizer
+    return [
+        tokenizer.decode(ids, skip_special_tokens=True).strip()
+        for ids in gen_ids
+    ]
 
 
 # ==============================
 # 4. LLM 결과 JSON 파싱 유틸
 # ==============================
 
-def _strip_code_fence(txt: str) -> str:
-    """ ```json ... ``` 같은 래핑 제거 """
-    txt = txt.strip()
-    if txt.startswith("```"):
-        parts = txt.split("```")
-        if len(parts) >= 2:
-            inner = parts[1]
-            inner = inner.lstrip()
-            if inner.lower().startswith("json"):
-                inner = inner[4:]
-            return inner.strip()
-    return txt
-
-
 def _strip_reasoning_wrappers(txt: str) -> str:
     """
     DeepSeek / Mi:dm 류 모델이 <think>...</think> 이나
-    ```json ...``` 으로 감싸서 줄 때 제거.
+    ```json ...``` 으로 감싸서 줄 때 제거. (JSON 파싱 실패 시 raw_text 표시용)
     """
-    import re
     txt = re.sub(r"<think>.*?</think>", "", txt, flags=re.S)
     txt = re.sub(r"(?s)```(?:json)?(.*?)```", r"\1", txt)
     return txt.strip()
 
 
-def _safe_json_extract(txt: str) -> Dict[str, Any]:
+def _parsed_or_raw(parser: StreamingJSONParser, txt: str) -> Dict[str, Any]:
     """
-    LLM이 출력한 텍스트에서 JSON dict를 최대한 안전하게 뽑아낸다.
-    - 우리가 기대하는 '결과 JSON'처럼 생긴 dict만 채택한다.
+    점진 파서가 찾은 '결과 JSON' 을 반환.
     - 그런 게 하나도 없으면 {"raw_text": ...} 로 fallback 한다.
     """
-    import re
-    import json as _json
-
-    txt = _strip_reasoning_wrappers(txt or "")
-    txt = _strip_code_fence(txt)
-
-    # "이런 키들 중 하나라도 포함되면 '결과 JSON'이라고 본다"
-    EXPECTED_KEYS = (
-        "summary",
-        "summary_overall",
-        "ranked_candidates",
-        "fit_score",
-        "pros",
-        "cons",
-        "best_index",
-    )
+    obj = parser.result()
+    if obj is not None:
+        return obj
+    return {"raw_text": _strip_reasoning_wrappers(txt or "")}
 
-    def looks_like_result(obj: Any) -> bool:
-        if not isinstance(obj, dict):
-            return False
-        return any(k in obj for k in EXPECTED_KEYS)
 
-    # 1차: 전체 문자열 그대로 시도
-    try:
-        obj = _json.loads(txt)
-        if looks_like_result(obj):
-            return obj
-    except Exception:
-        pass
-
-    # 2차: { ... } 블록만 추출
-    candidates: List[str] = []
-    depth = 0
-    start = None
-
-    for i, ch in enumerate(txt):
-        if ch == "{":
-            if depth == 0:
-                start = i
-            depth += 1
-        elif ch == "}" and depth > 0:
-            depth -= 1
-            if depth == 0 and start is not None:
-                candidates.append(txt[start: i + 1])
-
-    # 아예 { } 가 하나도 없는 경우: 완전 비JSON → fallback
-    if not candidates:
-        return {"raw_text": txt.strip()}
-
-    # 3차: 뒤에서부터(마지막 JSON부터) 파싱
-    for cand in reversed(candidates):
-        body_clean = cand.strip()
-
-        # 3-1) trailing comma 제거: ... ,] / ,} 형태
-        body_clean = re.sub(r",(\s*[\]\}])", r"\1", body_clean)
-
-        # 3-2) 전형적인 파이썬 dict 스타일 '{...}' 인 경우, ' 를 " 로 치환
-        if '"' not in body_clean and "'" in body_clean:
-            body_clean = body_clean.replace("'", '"')
+def _safe_json_extract(txt: str) -> Dict[str, Any]:
+    """
+    LLM이 출력한 텍스트에서 JSON dict를 최대한 안전하게 뽑아낸다.
+    - 스트리밍과 같은 점진 파서(json_stream)에 전체 텍스트를 한 번 통과시킨다.
+    - 우리가 기대하는 '결과 JSON'처럼 생긴 dict 중 마지막 것을 채택한다.
+    - 그런 게 하나도 없으면 {"raw_text": ...} 로 fallback 한다.
+    """
+    parser = StreamingJSONParser()
+    parser.feed(txt or "")
+    return _parsed_or_raw(parser, txt)
 
-        try:
-            obj = _json.loads(body_clean)
-            if looks_like_result(obj):
-                return obj
-        except Exception:
-            continue
 
-    # 여기까지 왔다는 건, JSON은 있긴 했는데
-    # 우리가 원하는 형태(summary, ranked_candidates 등)는 아니었다는 뜻.
-    # → 그냥 raw 텍스트 통째로 넘기자.
-    return {"raw_text": txt.strip()}
+def _parse_output(raw: str, kind: str) -> Dict[str, Any]:
+    """_safe_json_extract + 파싱 시간 / raw_text fallback 여부 계측."""
+    t0 = time.perf_counter()
+    parsed = _safe_json_extract(raw)
+    metrics.observe_parse(kind, (time.perf_counter() - t0) * 1000.0, "raw_text" in parsed)
+    return parsed
 
 
 
@@ -1084,81 +1936,802 @@ def _normalize_multi_result(
 # 6. 외부에서 호출할 메인 함수
 # ==============================
 
+# 결과 캐시 키에 들어가는 생성 파라미터 (값이 바뀌면 캐시 키도 자동으로 달라진다)
+GEN_PARAMS_SINGLE: Dict[str, Any] = {
+    "kind": "single", "max_new_tokens": 512, "do_sample": False, "constrained": CONSTRAINED_DECODING,
+}
+GEN_PARAMS_MULTI: Dict[str, Any] = {
+    "kind": "multi", "max_new_tokens": 512, "do_sample": False, "constrained": CONSTRAINED_DECODING,
+}
+GEN_PARAMS_MAP: Dict[str, Any] = {
+    "kind": "multi_map", "max_new_tokens": 160, "do_sample": False, "constrained": CONSTRAINED_DECODING,
+}
+
+
+def _result_cache_key(model: Optional[str], prompt: str, params: Dict[str, Any]) -> Optional[str]:
+    """
+    결과 캐시가 켜져 있으면 캐시 키, 꺼져 있으면 None.
+    - 가중치 형식(CPU dtype / 4bit)도 키에 넣는다: 형식마다 출력이 달라서, MIDM_CPU_DTYPE 를 바꾼 뒤 다른 형식의 결과를 돌려주지 않게
+    """
+    if result_cache.get_result_cache() is None:
+        return None
+    model_id = model or MODEL_ID_DEFAULT
+    params = {**params, "weights": engine.get_engine(model_id).weight_format}
+    return result_cache.make_key(model_id, prompt, params)
+
+
+def _cache_get(key: Optional[str], kind: str) -> Optional[Dict[str, Any]]:
+    """결과 캐시 조회 (요청 수를 cache=hit|miss 로 같이 센다)."""
+    cache = result_cache.get_result_cache()
+    hit = None if key is None or cache is None else cache.get(key)
+    metrics.observe_request(kind, hit is not None)
+    return hit
+
+
+def _cache_put(key: Optional[str], result: Dict[str, Any]):
+    """JSON 파싱에 실패한(raw_text fallback) 결과는 캐시하지 않는다."""
+    cache = result_cache.get_result_cache()
+    if key is None or cache is None or result.get("raw_text"):
+        return
+    cache.put(key, result)
+
+
+# 과부하면 LLM 대신 규칙 기반 결과 (degraded.py). 결과 캐시에는 넣지 않는다 (여유가 생기면 LLM 결과로 채워지도록)
+def _shed(allow_degraded: bool) -> Optional[str]:
+    """규칙 결과로 바로 답할 이유 (여유가 있거나 allow_degraded=False 면 None)."""
+    return degraded.load.overloaded() if allow_degraded else None
+
+
+def _degraded_single(
+    vehicle_data: VehicleLike, persona: Persona, mode: Mode, user_note: Optional[str], reason: str
+) -> Dict[str, Any]:
+    parsed = degraded.single_draft(as_vehicle(vehicle_data), persona.id, persona.mode, user_note)
+    return degraded.mark(_normalize_single_result(parsed, mode, persona), reason, "single")
+
+
+def _degraded_multi(
+    vehicle_list: List[Vehicle],
+    shortlist: List[int],
+    persona: Persona,
+    mode: Mode,
+    user_note: Optional[str],
+    reason: str,
+) -> Dict[str, Any]:
+    parsed = degraded.multi_draft(vehicle_list, shortlist, persona.id, persona.mode, user_note)
+    parsed = _normalize_multi_result(parsed, vehicle_count=len(vehicle_list), mode=mode, persona=persona)
+    return degraded.mark(parsed, reason, "multi")
+
+
+# ------------------------------
+# 요청 준비 / 마무리 (generate_* / stream_* / scheduler.submit_* 가 같이 쓴다)
+# ------------------------------
+# - prepare_view / prepare_multi_view: 결과 캐시 hit 이나 규칙 기반 결과면 결과 dict, 아니면 LLM 을 부를 ViewRequest
+#   (매물이 많은 멀티 비교는 MapReduceRequest: 매물별 map 요청 → reduce(evaluations) 가 다시 결과 dict 또는 ViewRequest)
+# - 디코딩 방식 (call_llm / 배치 / 스트리밍 / micro-batch) 은 호출하는 쪽이 고르고, 출력은 finish 로 넘긴다
+
+@dataclass
+class ViewRequest:
+    """LLM 호출 1번 분량. finish(raw) 가 파싱 → 정규화 → 결과 캐시 저장까지 한다."""
+    kind: str                     # _parse_output 의 kind ("single" | "multi" | "multi_map")
+    prompt: Prompt
+    model: Optional[str]
+    max_new_tokens: int
+    schema: Optional[str]
+    lane: admission.Lane
+    normalize: Callable[[Dict[str, Any]], Dict[str, Any]]   # 파싱된 dict → 최종 결과 (스트리밍은 이것만 쓴다)
+    static_prefix: Optional[str] = None
+
+    def input_ids(self) -> List[int]:
+        return _prompt_ids(self.prompt, self.model)
+
+    def finish(self, raw: str) -> Dict[str, Any]:
+        return self.normalize(_parse_output(raw, self.kind))
+
+
+def _caching(key: Optional[str], normalize: Callable[[Dict[str, Any]], Dict[str, Any]]):
+    """정규화한 결과를 결과 캐시에도 넣는 normalize."""
+    def _normalize(parsed: Dict[str, Any]) -> Dict[str, Any]:
+        result = normalize(parsed)
+        _cache_put(key, result)
+        return result
+    return _normalize
+
+
+class MapReduceRequest:
+    """
+    매물이 많은 멀티 비교 (6-1 map-reduce).
+    - maps: 번호 순 매물별 map 단계. 결과 캐시에 있으면 평가 dict, 없으면 ViewRequest (모두 같은 길이/스키마라 한 배치로 묶인다)
+    - reduce(evaluations): map 평가가 다 모이면 결과 dict (캐시 hit) 또는 reduce ViewRequest
+    """
+
+    def __init__(
+        self,
+        vehicle_list: List[Vehicle],
+        shortlist: List[int],
+        persona: Persona,
+        mode: Mode,
+        model: Optional[str],
+        user_note: Optional[str],
+    ):
+        self.vehicle_list = vehicle_list
+        self.shortlist = shortlist
+        self.persona = persona
+        self.mode = mode
+        self.model = model
+        self.user_note = user_note
+        self.maps: List[Any] = [self._map(i) for i in sorted(shortlist)]
+
+    def _map(self, i: int):
+        vehicle = self.vehicle_list[i]
+        prompt = _map_prompt(vehicle, i + 1, self.persona, self.user_note)
+        key = _result_cache_key(self.model, prompt.text, GEN_PARAMS_MAP)
+        cached = _cache_get(key, "multi_map")
+        if cached is not None:
+            return cached
+
+        def _normalize(parsed: Dict[str, Any]) -> Dict[str, Any]:
+            evaluation = _normalize_map_eval(parsed, i + 1, vehicle)
+            if evaluation["fit_score"] is not None:   # 파싱 실패한 평가는 캐시하지 않는다
+                _cache_put(key, evaluation)
+            return evaluation
+
+        return ViewRequest("multi_map", prompt, self.model, GEN_PARAMS_MAP["max_new_tokens"], _map_schema(), "bulk", _normalize)
+
+    def reduce(self, evaluations: List[Dict[str, Any]]):
+        persona = self.persona
+        prompt = _reduce_prompt(
+            evaluations, persona, self.user_note, total=len(self.vehicle_list),
+            conditions=_conditions_note(self.vehicle_list, self.user_note, persona.mode, self.shortlist),
+        )
+        key = _result_cache_key(self.model, prompt.text, GEN_PARAMS_MULTI)
+        cached = _cache_get(key, "multi")
+        if cached is not None:
+            return cached
+        return ViewRequest(
+            "multi",
+            prompt,
+            self.model,
+            GEN_PARAMS_MULTI["max_new_tokens"],
+            _schema_for(True, persona.mode),
+            "bulk",
+            _caching(key, lambda parsed: _finish_reduce(parsed, self.vehicle_list, evaluations, self.mode, persona)),
+            static_prefix=_multi_instruction(persona.mode, _budget_rule(self.user_note, persona.mode)),
+        )
+
+
+def prepare_view(
+    vehicle_data: VehicleLike,
+    persona_id: str,
+    mode: Mode = "buy",
+    model: Optional[str] = None,
+    persona_obj: Optional[Persona] = None,
+    user_note: Optional[str] = None,
+    allow_degraded: bool = True,
+):
+    """generate_view 의 준비 단계 → 결과 dict (캐시 hit / 규칙 기반 결과) 또는 ViewRequest."""
+    if persona_obj is not None:
+        persona = persona_obj
+    else:
+        persona = get_persona(persona_id, mode)
+
+    p = _single_prompt(vehicle_data, persona, user_note)
+
+    key = _result_cache_key(model, p.text, GEN_PARAMS_SINGLE)
+    cached = _cache_get(key, "single")
+    if cached is not None:
+        return cached
+    reason = _shed(allow_degraded)
+    if reason:
+        return _degraded_single(vehicle_data, persona, mode, user_note, reason)
+
+    return ViewRequest(
+        "single",
+        p,
+        model,
+        GEN_PARAMS_SINGLE["max_new_tokens"],
+        _schema_for(False, persona.mode),
+        "interactive",
+        _caching(key, lambda parsed: _normalize_single_result(parsed, mode, persona)),
+        static_prefix=_single_instruction(persona.mode, _budget_rule(user_note, persona.mode)),
+    )
+
+
+def prepare_multi_view(
+    vehicle_list: List[VehicleLike],
+    persona_id: str,
+    mode: Mode = "buy",
+    model: Optional[str] = None,
+    persona_obj: Optional[Persona] = None,
+    user_note: Optional[str] = None,
+    allow_degraded: bool = True,
+):
+    """generate_multi_view 의 준비 단계 → 결과 dict, ViewRequest, 또는 MapReduceRequest (매물이 많을 때)."""
+    if not vehicle_list:
+        raise ValueError("vehicle_list 가 비어 있습니다.")
+    vehicle_list = parse_listings(vehicle_list)   # 이후 단계는 Vehicle 속성만 읽는다
+
+    if persona_obj is not None:
+        persona = persona_obj
+    else:
+        persona = get_persona(persona_id, mode)
+
+    shortlist = _prerank_shortlist(vehicle_list, persona, user_note)
+    if _use_map_reduce(shortlist):
+        reason = _shed(allow_degraded)
+        if reason:
+            return _degraded_multi(vehicle_list, shortlist, persona, mode, user_note, reason)
+        return MapReduceRequest(vehicle_list, shortlist, persona, mode, model, user_note)
+
+    p = _multi_prompt(vehicle_list, persona, user_note, shortlist, model)
+
+    key = _result_cache_key(model, p.text, GEN_PARAMS_MULTI)
+    cached = _cache_get(key, "multi")
+    if cached is not None:
+        return cached
+    reason = _shed(allow_degraded)
+    if reason:
+        return _degraded_multi(vehicle_list, shortlist, persona, mode, user_note, reason)
+
+    return ViewRequest(
+        "multi",
+        p,
+        model,
+        GEN_PARAMS_MULTI["max_new_tokens"],   # ✅ 512면 충분하도록 프롬프트를 줄여놨음
+        _schema_for(True, persona.mode),
+        "bulk",
+        _caching(key, lambda parsed: _normalize_multi_result(
+            parsed,
+            vehicle_count=len(vehicle_list),
+            mode=mode,
+            persona=persona,
+        )),
+        static_prefix=_multi_instruction(persona.mode, _budget_rule(user_note, persona.mode)),
+    )
+
+
+def _call_request(req: ViewRequest, session_id: Optional[str] = None) -> str:
+    return call_llm(
+        req.prompt.text,
+        model=req.model,
+        max_new_tokens=req.max_new_tokens,
+        static_prefix=req.static_prefix,
+        schema=req.schema,
+        input_ids=req.input_ids(),
+        session_id=session_id,
+        lane=req.lane,
+    )
+
+
+def _finish_batch(
+    reqs: List[ViewRequest],
+    max_new_tokens: int,
+    schema: Optional[str],
+    model: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    session_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """같은 길이/스키마의 ViewRequest 들을 call_llm_batch 한 번으로 디코딩하고 각각 finish."""
+    raws = call_llm_batch(
+        [r.prompt.text for r in reqs],
+        model=model,
+        max_new_tokens=max_new_tokens,
+        batch_size=batch_size,
+        schema=schema,
+        input_ids=[r.input_ids() for r in reqs],
+        session_id=session_id,
+    )
+    return [r.finish(raw) for r, raw in zip(reqs, raws)]
+
+
 def generate_view(
-    vehicle_data: Dict[str, Any],
+    vehicle_data: VehicleLike,
     persona_id: str,
     mode: Mode = "buy",
     model: Optional[str] = None,
     persona_obj: Optional[Persona] = None,
     user_note: Optional[str] = None,
+    allow_degraded: bool = True,
+    session_id: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     단일 매물용 진입점.
-    - vehicle_data: 단일 매물 dict
+    - vehicle_data: 단일 매물 (Vehicle 또는 dict)
     - persona_id + mode 로 Persona 선택 (또는 persona_obj 직접 전달)
+    - allow_degraded: 모델이 밀려 있으면 규칙 기반 결과("degraded": True)를 바로 돌려준다 (False 면 기다린다)
+    - session_id: 입장 제어 세션 (세션별 동시 요청 상한 + 세션 간 공정 대기, admission.py). 단일 매물은 interactive lane
     """
-    if persona_obj is not None:
-        persona = persona_obj
-    else:
-        persona = get_persona(persona_id, mode)
+    req = prepare_view(vehicle_data, persona_id, mode, model, persona_obj, user_note, allow_degraded)
+    if not isinstance(req, ViewRequest):
+        return req
 
-    prompt = build_prompt(vehicle_data, persona, user_note=user_note)
-    raw = call_llm(prompt, model=model, max_new_tokens = 512)
+    with admission.controller.request(session_id):
+        raw = _call_request(req, session_id)
 
-    print("[generate_view] RAW LLM OUTPUT:")
-    print(raw)
-
-    parsed = _safe_json_extract(raw)
-    parsed = _normalize_single_result(parsed, mode, persona)
-    return parsed
+    metrics.log_raw("generate_view", raw)
+    return req.finish(raw)
 
 
 def generate_multi_view(
-    vehicle_list: List[Dict[str, Any]],
+    vehicle_list: List[VehicleLike],
     persona_id: str,
     mode: Mode = "buy",
     model: Optional[str] = None,
     persona_obj: Optional[Persona] = None,
     user_note: Optional[str] = None,
+    allow_degraded: bool = True,
+    session_id: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     여러 매물에 대해 비교/랭킹을 수행하는 진입점 함수.
+    - allow_degraded: generate_view 와 같음 (규칙 결과도 사용자 조건 필터 / 사전 랭킹 후보 안에서 고른다)
+    - session_id: generate_view 와 같음. 멀티 비교는 bulk lane (단일 매물 요청이 먼저 자리를 받는다)
     """
-    if not vehicle_list:
-        raise ValueError("vehicle_list 가 비어 있습니다.")
+    req = prepare_multi_view(vehicle_list, persona_id, mode, model, persona_obj, user_note, allow_degraded)
+    if isinstance(req, MapReduceRequest):
+        with admission.controller.request(session_id):
+            return _generate_multi_view_map_reduce(req, session_id)
+    if not isinstance(req, ViewRequest):
+        return req
 
-    if persona_obj is not None:
-        persona = persona_obj
-    else:
-        persona = get_persona(persona_id, mode)
+    with admission.controller.request(session_id):
+        raw = _call_request(req, session_id)
+
+    metrics.log_raw("generate_multi_view", raw)
+    return req.finish(raw)
+
+
+# ==============================
+# 6-1. 배치 진입점 (여러 요청을 한 번에 디코딩)
+# ==============================
+
+def generate_view_batch(
+    vehicles: List[VehicleLike],
+    persona_id: str,
+    mode: Mode = "buy",
+    model: Optional[str] = None,
+    persona_obj: Optional[Persona] = None,
+    user_note: Optional[str] = None,
+    batch_size: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    generate_view 의 배치 버전.
+    - vehicles 의 각 매물을 같은 persona/user_note 로 분석
+    - 결과는 vehicles 순서대로, 각각 따로 파싱/정규화해서 반환
+    - 결과 캐시에 있는 매물은 디코딩하지 않는다
+    """
+    if persona_obj is None:
+        persona_obj = get_persona(persona_id, mode)
 
-    prompt = build_multi_prompt(vehicle_list, persona, user_note=user_note)
-    raw = call_llm(
-        prompt,
+    results = [
+        prepare_view(v, persona_id, mode, model, persona_obj, user_note, allow_degraded=False) for v in vehicles
+    ]
+    todo = [i for i, r in enumerate(results) if isinstance(r, ViewRequest)]
+    finished = _finish_batch(
+        [results[i] for i in todo],
+        GEN_PARAMS_SINGLE["max_new_tokens"],
+        _schema_for(False, persona_obj.mode),
         model=model,
-        max_new_tokens=512,   # ✅ 512면 충분하도록 프롬프트를 줄여놨음
-        temperature=0.0,
+        batch_size=batch_size,
     )
+    for i, result in zip(todo, finished):
+        results[i] = result
+    return results
 
-    print("[generate_multi_view] RAW LLM OUTPUT:")
-    print(raw)
 
-    parsed = _safe_json_extract(raw)
-    parsed = _normalize_multi_result(
-        parsed,
-        vehicle_count=len(vehicle_list),
-        mode=mode,
-        persona=persona,
+def generate_multi_view_batch(
+    vehicle_lists: List[List[VehicleLike]],
+    persona_id: str,
+    mode: Mode = "buy",
+    model: Optional[str] = None,
+    persona_obj: Optional[Persona] = None,
+    user_note: Optional[str] = None,
+    batch_size: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    generate_multi_view 의 배치 버전.
+    - vehicle_lists 의 각 원소(매물 리스트)가 하나의 비교 요청
+    """
+    if any(not vl for vl in vehicle_lists):
+        raise ValueError("vehicle_lists 안에 비어 있는 vehicle_list 가 있습니다.")
+    if persona_obj is None:
+        persona_obj = get_persona(persona_id, mode)
+
+    results = [
+        prepare_multi_view(vl, persona_id, mode, model, persona_obj, user_note, allow_degraded=False)
+        for vl in vehicle_lists
+    ]
+    for i, r in enumerate(results):
+        if isinstance(r, MapReduceRequest):
+            # 매물이 많은 요청은 map 단계 자체가 배치라 요청별로 처리
+            results[i] = _generate_multi_view_map_reduce(r)
+
+    todo = [i for i, r in enumerate(results) if isinstance(r, ViewRequest)]
+    finished = _finish_batch(
+        [results[i] for i in todo],
+        GEN_PARAMS_MULTI["max_new_tokens"],
+        _schema_for(True, persona_obj.mode),
+        model=model,
+        batch_size=batch_size,
+    )
+    for i, result in zip(todo, finished):
+        results[i] = result
+    return results
+
+
+
+# ==============================
+# 6-1. 멀티 비교 map-reduce (매물이 MULTI_SINGLE_PROMPT_MAX 보다 많을 때, 2-2 참고)
+# ==============================
+
+def _use_map_reduce(shortlist: List[int]) -> bool:
+    return MULTI_SINGLE_PROMPT_MAX > 0 and len(shortlist) > MULTI_SINGLE_PROMPT_MAX
+
+
+def _map_schema() -> Optional[str]:
+    return "multi_map" if CONSTRAINED_DECODING else None
+
+
+def _normalize_map_eval(parsed: Dict[str, Any], index: int, vehicle: Vehicle) -> Dict[str, Any]:
+    """map 단계 결과 → reduce 에 넣을 매물 요약 1건. 파싱 실패면 fit_score=None (reduce 에서 생략)."""
+    failed = "raw_text" in parsed
+    vehicle = canonical.canonical_view(vehicle)   # reduce 프롬프트도 정규화된 값으로 (map 결과 캐시와 맞춘다)
+    pros = parsed.get("pros") if isinstance(parsed.get("pros"), list) else []
+    cons = parsed.get("cons") if isinstance(parsed.get("cons"), list) else []
+    return {
+        "index": index,
+        "title": vehicle.title or "",
+        "price_krw": vehicle.price_krw,
+        "year": vehicle.year,
+        "mileage_km": vehicle.mileage_km,
+        "fit_score": None if failed else _clamp_float(parsed.get("fit_score", 0.0), 0.0, 10.0, 0.0),
+        "risk_level": None if failed else _normalize_risk_level(parsed.get("risk_level", "medium")),
+        "summary": "" if failed else str(parsed.get("summary", "")),
+        "pros": [str(x) for x in pros[:2]],
+        "cons": [str(x) for x in cons[:2]],
+    }
+
+
+def _map_evaluate(mr: MapReduceRequest, session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """map 단계: 캐시에 없는 매물만 한 번에 배치 디코딩 (bulk lane)."""
+    evaluations = list(mr.maps)
+    todo = [j for j, m in enumerate(evaluations) if isinstance(m, ViewRequest)]
+    finished = _finish_batch(
+        [evaluations[j] for j in todo],
+        GEN_PARAMS_MAP["max_new_tokens"],
+        _map_schema(),
+        model=mr.model,
+        session_id=session_id,
     )
+    for j, evaluation in zip(todo, finished):
+        evaluations[j] = evaluation
+    return evaluations
+
+
+def _finish_reduce(
+    parsed: Dict[str, Any],
+    vehicle_list: List[Vehicle],
+    evaluations: List[Dict[str, Any]],
+    mode: Mode,
+    persona: Persona,
+) -> Dict[str, Any]:
+    """
+    reduce 결과 정규화 + map 평가로 보강.
+    - reduce 가 ranking 에서 빠뜨린 매물은 map 의 fit_score/summary 로 채운다
+    - reduce 파싱에 실패해도 map 평가만으로 best/ranking 이 나온다 (화면은 ranking 을 그리므로 합친 후보로 다시 채우고,
+      map 평가로 순위가 나왔으면 raw_text 는 뺀다 → 'JSON 형식을 지키지 않았습니다' 안내 대신 순위가 보이게)
+    """
+    reduced_ok = bool(parsed.get("ranked_candidates") or parsed.get("ranking") or parsed.get("best"))
+    parsed = _normalize_multi_result(parsed, vehicle_count=len(vehicle_list), mode=mode, persona=persona)
+
+    seen = {c["index"] for c in parsed["ranked_candidates"]}
+    for e in evaluations:
+        if e["index"] in seen:
+            continue
+        parsed["ranked_candidates"].append({
+            "index": e["index"],
+            "title": e["title"],
+            "summary": e["summary"],
+            "pros": list(e["pros"]),
+            "cons": list(e["cons"]),
+            "checklist": [],
+            "questions_for_seller": [],
+            "fit_score": e["fit_score"] or 0.0,
+            "risk_level": e["risk_level"] or "medium",
+            "why_suitable": "",
+        })
+    parsed["ranked_candidates"].sort(key=lambda x: x.get("fit_score", 0.0), reverse=True)
+    parsed["ranking"] = [
+        {"index": c["index"], "title": c["title"], "fit_score": c["fit_score"]}
+        for c in parsed["ranked_candidates"]
+    ]
+    if not reduced_ok and parsed["ranked_candidates"]:
+        parsed["best_index"] = parsed["ranked_candidates"][0]["index"]
+        parsed.pop("raw_text", None)
+    parsed["evaluations"] = evaluations
     return parsed
 
 
+def _generate_multi_view_map_reduce(mr: MapReduceRequest, session_id: Optional[str] = None) -> Dict[str, Any]:
+    req = mr.reduce(_map_evaluate(mr, session_id))
+    if not isinstance(req, ViewRequest):
+        return req
+
+    raw = _call_request(req, session_id)
+    metrics.log_raw("generate_multi_view", raw)
+    return req.finish(raw)
+
+
+# ==============================
+# 6-2. 스트리밍 진입점 (토큰이 나오는 대로 yield)
+# ==============================
+# 이벤트 형식 (dict):
+# - {"type": "queued", "position": 3, "eta_s": 12.5}                 생성 자리를 기다리는 중 (순번 1 = 다음 차례,
+#   eta_s 는 측정값이 없으면 None). 자리를 받을 때까지 admission.POLL_S 마다 다시 나온다
+# - {"type": "token",  "text": "..."}                              디코딩된 텍스트 조각
+# - {"type": "field",  "key": "summary", "value": ...}              최상위 필드 값이 완성됨
+# - {"type": "item",   "key": "ranking", "index": 0, "value": ...}  최상위 배열 원소가 완성됨
+#   (map-reduce 멀티 비교는 reduce 전에 key="evaluations" 로 매물별 map 평가가 먼저 나온다)
+# - {"type": "result", "result": {...}}                             최종 정규화 결과 (항상 마지막 1번)
+
+def _wait_for_slot(
+    session_id: Optional[str], lane: admission.Lane
+) -> Generator[Dict[str, Any], None, admission.Ticket]:
+    """자리를 받을 때까지 queued 이벤트를 yield 하고, 받은 ticket 을 돌려준다 (yield from 의 값)."""
+    ticket = admission.controller.enter(session_id, lane)
+    try:
+        for position, eta_s in admission.controller.waiting(ticket):
+            yield {"type": "queued", "position": position, "eta_s": eta_s}
+    except BaseException:   # 시간 초과 / 소비자가 스트림을 닫음 → 대기열에서 뺀다
+        admission.controller.release(ticket)
+        raise
+    return ticket
+
+
+def _stream_events(req: ViewRequest, session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    parser = StreamingJSONParser()
+    chunks: List[str] = []
+    parse_ms = 0.0
+    input_ids = req.input_ids()
+    ticket = yield from _wait_for_slot(session_id, req.lane)
+    try:
+        stream = stream_llm(
+            req.prompt.text,
+            model=req.model,
+            max_new_tokens=req.max_new_tokens,
+            static_prefix=req.static_prefix,
+            schema=req.schema,
+            input_ids=input_ids,
+            ticket=ticket,
+        )
+        for chunk in stream:
+            chunks.append(chunk)
+            yield {"type": "token", "text": chunk}
+            t0 = time.perf_counter()
+            events = parser.feed(chunk)
+            parse_ms += (time.perf_counter() - t0) * 1000.0
+            for ev in events:
+                if ev.kind == "field":
+                    yield {"type": "field", "key": ev.key, "value": ev.value}
+                elif ev.kind == "item":
+                    yield {"type": "item", "key": ev.key, "index": ev.index, "value": ev.value}
+    finally:
+        admission.controller.release(ticket)   # stream_llm 이 시작도 못 하고 끝난 경우 (이미 반납했으면 무시)
+
+    # 파싱은 스트리밍 중에 이미 끝났으므로 전체 텍스트를 다시 파싱하지 않는다
+    parsed = _parsed_or_raw(parser, "".join(chunks))
+    metrics.observe_parse(req.kind, parse_ms, "raw_text" in parsed)
+    yield {"type": "result", "result": req.normalize(parsed)}
+
+
+def stream_view(
+    vehicle_data: VehicleLike,
+    persona_id: str,
+    mode: Mode = "buy",
+    model: Optional[str] = None,
+    persona_obj: Optional[Persona] = None,
+    user_note: Optional[str] = None,
+    allow_degraded: bool = True,
+    session_id: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    generate_view 의 스트리밍 버전. 결과 캐시 hit 이나 규칙 기반 결과면 result 이벤트만 바로 나온다.
+    생성 자리를 기다리는 동안에는 queued 이벤트 (대기 순번 / 예상 대기) 가 먼저 나온다.
+    """
+    req = prepare_view(vehicle_data, persona_id, mode, model, persona_obj, user_note, allow_degraded)
+    if not isinstance(req, ViewRequest):
+        yield {"type": "result", "result": req}
+        return
+
+    with admission.controller.request(session_id):
+        yield from _stream_events(req, session_id)
+
+
+def stream_multi_view(
+    vehicle_list: List[VehicleLike],
+    persona_id: str,
+    mode: Mode = "buy",
+    model: Optional[str] = None,
+    persona_obj: Optional[Persona] = None,
+    user_note: Optional[str] = None,
+    allow_degraded: bool = True,
+    session_id: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """generate_multi_view 의 스트리밍 버전 (bulk lane)."""
+    req = prepare_multi_view(vehicle_list, persona_id, mode, model, persona_obj, user_note, allow_degraded)
+    if isinstance(req, MapReduceRequest):
+        # map 단계는 배치로 한 번에 → 매물별 평가를 item 이벤트로 먼저 내보내고, reduce 만 스트리밍
+        # (map 까지 돌았으면 reduce 는 규칙 결과로 바꾸지 않고 마저 한다)
+        with admission.controller.request(session_id):
+            evaluations = _map_evaluate(req, session_id)
+        for n, e in enumerate(evaluations):
+            yield {"type": "item", "key": "evaluations", "index": n, "value": e}
+        req = req.reduce(evaluations)
+    if not isinstance(req, ViewRequest):
+        yield {"type": "result", "result": req}
+        return
+
+    with admission.controller.request(session_id):
+        yield from _stream_events(req, session_id)
+
+
+# ==============================
+# 6-3. 대량 JSONL 배치 (오프라인 재평가, python inference.py batch ...)
+# ==============================
+# - 입력: 한 줄에 매물 1개 (JSON 객체). 파일 전체를 읽지 않고 chunk 단위로만 메모리에 올린다
+# - 출력: 입력 줄마다 {"line": 입력 줄 번호(0-based), "result": {...}} 또는 {"line": ..., "error": "..."}
+#   (입력 순서 그대로, chunk 마다 flush + fsync)
+# - 이어하기: 출력 파일 자체가 체크포인트. 마지막으로 완전히 기록된 줄의 line 다음부터 다시 시작
+#   (중간에 끊겨서 반쯤 써진 마지막 줄은 잘라낸다)
+# - 빈 줄은 건너뛴다 (출력 없음)
+
+BATCH_CHUNK_DEFAULT = int(os.getenv("MIDM_BATCH_CHUNK", "64"))
+
+
+def _resume_point(out_path: str) -> int:
+    """이미 끝난 입력 줄 수 (= 다음에 처리할 입력 줄 번호). 깨진 꼬리 줄은 파일에서 잘라낸다."""
+    if not os.path.exists(out_path):
+        return 0
+    done = 0
+    good_end = 0
+    with open(out_path, "rb+") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done = int(json.loads(line)["line"]) + 1
+            except (ValueError, KeyError, TypeError):
+                break
+            good_end += len(line)
+        f.truncate(good_end)
+    return done
+
+
+def _iter_jsonl_chunks(in_path: str, start: int, chunk_size: int) -> Iterator[List[Tuple[int, str]]]:
+    """(줄 번호, 원문) 을 chunk_size 개씩. start 이전 줄과 빈 줄은 건너뛴다."""
+    chunk: List[Tuple[int, str]] = []
+    with open(in_path, encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            if n < start or not line.strip():
+                continue
+            chunk.append((n, line))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def _parse_batch_line(line: str) -> Vehicle:
+    data = json.loads(line)
+    if not isinstance(data, dict):
+        raise ValueError("한 줄에는 매물 JSON 객체 1개가 있어야 합니다.")
+    return as_vehicle(data)
+
+
+def run_batch_file(
+    in_path: str,
+    out_path: str,
+    persona_id: str,
+    mode: Mode = "buy",
+    model: Optional[str] = None,
+    persona_obj: Optional[Persona] = None,
+    user_note: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    chunk_size: int = BATCH_CHUNK_DEFAULT,
+    overwrite: bool = False,
+) -> Dict[str, int]:
+    """
+    JSONL 매물 파일 → JSONL 결과 파일 (generate_view_batch 로 chunk 단위 배치 디코딩).
+    - overwrite=False 면 out_path 가 있을 때 이어서 처리
+    - 반환: {"resumed_from": ..., "ok": ..., "errors": ...}
+    """
+    if persona_obj is None:
+        persona_obj = get_persona(persona_id, mode)   # 잘못된 persona 는 파일을 읽기 전에 실패
+    if overwrite and os.path.exists(out_path):
+        os.remove(out_path)
+    start = _resume_point(out_path)
+    if start:
+        print(f"[batch] resume: {out_path} 에 입력 line {start - 1} 까지 기록됨 → line {start} 부터 이어서")
+
+    stats = {"resumed_from": start, "ok": 0, "errors": 0}
+    t0 = time.perf_counter()
+    with open(out_path, "a", encoding="utf-8") as out:
+        for chunk in _iter_jsonl_chunks(in_path, start, max(1, chunk_size)):
+            records: List[Dict[str, Any]] = []
+            todo: List[Tuple[int, Vehicle]] = []
+            for n, line in chunk:
+                try:
+                    todo.append((len(records), _parse_batch_line(line)))
+                    records.append({"line": n})
+                except ValueError as e:   # json.JSONDecodeError 포함
+                    records.append({"line": n, "error": str(e)})
+
+            results = generate_view_batch(
+                [v for _, v in todo],
+                persona_id,
+                mode=mode,
+                model=model,
+                persona_obj=persona_obj,
+                user_note=user_note,
+                batch_size=batch_size,
+            ) if todo else []
+            for (j, _), result in zip(todo, results):
+                records[j]["result"] = result
+
+            for rec in records:
+                out.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+
+            stats["ok"] += len(todo)
+            stats["errors"] += len(records) - len(todo)
+            done = stats["ok"] + stats["errors"]
+            rate = done / max(time.perf_counter() - t0, 1e-9)
+            print(f"[batch] line {chunk[-1][0] + 1}: ok={stats['ok']} errors={stats['errors']} ({rate:.2f} listings/s)")
+    return stats
+
+
 
 # ==============================
 # 7. 간단 CLI 테스트용
 # ==============================
 
+def _batch_main(argv: List[str]) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python inference.py batch", description="JSONL 매물 파일 일괄 분석 (이어하기 지원)")
+    parser.add_argument("--in", dest="in_path", required=True, help="입력 JSONL (한 줄에 매물 1개)")
+    parser.add_argument("--out", dest="out_path", required=True, help="출력 JSONL (있으면 이어서 처리)")
+    parser.add_argument("--persona", required=True, help="persona id (BUY_PERSONAS / SELL_PERSONAS)")
+    parser.add_argument("--mode", choices=["buy", "sell"], default="buy")
+    parser.add_argument("--user-note", type=str, default=None)
+    parser.add_argument("--model", type=str, default=None)
+    parser.add_argument("--batch-size", type=int, default=None, help="한 번에 디코딩할 매물 수 (기본 MIDM_BATCH_SIZE)")
+    parser.add_argument("--chunk", type=int, default=BATCH_CHUNK_DEFAULT, help="한 번에 읽고 기록할 줄 수 (기본 MIDM_BATCH_CHUNK)")
+    parser.add_argument("--overwrite", action="store_true", help="기존 출력 파일을 지우고 처음부터")
+    args = parser.parse_args(argv)
+
+    stats = run_batch_file(
+        args.in_path,
+        args.out_path,
+        args.persona,
+        mode=args.mode,
+        model=args.model,
+        user_note=args.user_note,
+        batch_size=args.batch_size,
+        chunk_size=args.chunk,
+        overwrite=args.overwrite,
+    )
+    print(f"[batch] done: {stats}")
+    return 0
+
+
 if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(_batch_main(sys.argv[2:]))
+
     sample_vehicle1 = {
         "title": "쏘나타 DN8 2.0 가솔린 프리미엄",
         "year": 2021,
@@ -0,0 +1,278 @@
+# json_stream.py
+# 목적: LLM 출력 스트림을 토큰 단위로 받아서 점진적으로 JSON 파싱
+# - object / array / string 상태를 문자 단위로 추적 (전체 텍스트 재파싱 없음)
+# - 최상위 필드 값이 완성되면 바로 이벤트로 내보냄 (예: summary, ranking[0])
+# - <think>...</think> 블록, ```json 코드 펜스, JSON 앞뒤 잡담은 객체 바깥에서 무시
+# - LLM 이 자주 내는 형태 허용: trailing comma, '작은따옴표' 문자열, True/False/None
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+
+# 이런 키들 중 하나라도 포함되면 '결과 JSON'이라고 본다
+RESULT_KEYS = (
+    "summary",
+    "summary_overall",
+    "ranked_candidates",
+    "fit_score",
+    "pros",
+    "cons",
+    "best_index",
+)
+
+
+def looks_like_result(obj: Any) -> bool:
+    if not isinstance(obj, dict):
+        return False
+    return any(k in obj for k in RESULT_KEYS)
+
+
+@dataclass
+class JSONEvent:
+    kind: str   # "field": 최상위 key 값 완성 / "item": 최상위 배열의 원소 완성 / "object": 최상위 객체 완성
+    key: str    # field/item 의 최상위 key ("object" 이면 "")
+    value: Any
+    index: Optional[int] = None  # item 일 때 배열 인덱스
+
+
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+_LITERAL_CHARS = set("0123456789+-.eEaAbBcCdDfFiIlLnNoOrRsStTuU")
+_WS = " \t\r\n"
+
+
+class _Abort(Exception):
+    """현재 객체가 JSON 으로 성립하지 않음 → 버리고 다음 '{' 부터 다시."""
+
+
+class _Frame:
+    __slots__ = ("is_obj", "value", "key", "state")
+
+    def __init__(self, is_obj: bool):
+        self.is_obj = is_obj
+        self.value: Any = {} if is_obj else []
+        self.key: Optional[str] = None
+        # obj: "key_or_end" → "colon" → "value" → "comma_or_end" → "key" ...
+        # arr: "value_or_end" → "comma_or_end" → "value" ...
+        self.state = "key_or_end" if is_obj else "value_or_end"
+
+
+class StreamingJSONParser:
+    """
+    push 방식 JSON 파서.
+    - feed(chunk) 로 텍스트 조각을 넣을 때마다 완성된 이벤트 리스트를 돌려준다.
+    - 완성된 최상위 객체는 objects 에 순서대로 쌓인다.
+    """
+
+    def __init__(self):
+        self.objects: List[Dict[str, Any]] = []
+        self._stack: List[_Frame] = []
+        self._tail = ""          # <think> 태그 감지용 최근 문자
+        self._in_think = False
+        self._str: Optional[List[str]] = None   # 문자열 읽는 중이면 버퍼
+        self._quote = '"'
+        self._escape = False
+        self._unicode: Optional[str] = None     # \uXXXX 읽는 중이면 hex 버퍼
+        self._lit: Optional[List[str]] = None   # 숫자/true/false/null 읽는 중이면 버퍼
+
+    # ---------- 상태 조회 ----------
+    @property
+    def depth(self) -> int:
+        return len(self._stack)
+
+    @property
+    def in_string(self) -> bool:
+        return self._str is not None
+
+    def result(self) -> Optional[Dict[str, Any]]:
+        """지금까지 완성된 객체 중 '결과 JSON'처럼 생긴 마지막 것."""
+        for obj in reversed(self.objects):
+            if looks_like_result(obj):
+                return obj
+        return None
+
+    # ---------- 입력 ----------
+    def feed(self, chunk: str) -> List[JSONEvent]:
+        events: List[JSONEvent] = []
+        for ch in chunk:
+            if self._stack:
+                try:
+                    self._step(ch, events)
+                except _Abort:
+                    self._reset_object()
+            else:
+                self._outside(ch, events)
+        return events
+
+    # ---------- 내부: 객체 바깥 ----------
+    def _outside(self, ch: str, events: List[JSONEvent]):
+        self._tail = (self._tail + ch)[-8:]
+        if self._in_think:
+            if self._tail.endswith("</think>"):
+                self._in_think = False
+            return
+        if self._tail.endswith("<think>"):
+            self._in_think = True
+            return
+        if ch == "{":
+            self._stack.append(_Frame(is_obj=True))
+
+    def _reset_object(self):
+        self._stack.clear()
+        self._str = None
+        self._escape = False
+        self._unicode = None
+        self._lit = None
+
+    # ---------- 내부: 객체 안 ----------
+    def _step(self, ch: str, events: List[JSONEvent]):
+        if self._str is not None:
+            self._string_char(ch, events)
+            return
+
+        if self._lit is not None:
+            if ch in _LITERAL_CHARS:
+                self._lit.append(ch)
+                return
+            text = "".join(self._lit)
+            self._lit = None
+            self._put_value(self._parse_literal(text), events)
+            if not self._stack:
+                return
+            # 구분자 문자는 아래에서 이어서 처리
+
+        if ch in _WS:
+            return
+
+        frame = self._stack[-1]
+        state = frame.state
+
+        if frame.is_obj:
+            if state in ("key_or_end", "key"):
+                if ch in "\"'":
+                    self._begin_string(ch)
+                elif ch == "}":
+                    self._close(events)   # 빈 객체 또는 trailing comma
+                else:
+                    raise _Abort()
+            elif state == "colon":
+                if ch != ":":
+                    raise _Abort()
+                frame.state = "value"
+            elif state == "value":
+                self._begin_value(ch)
+            elif state == "comma_or_end":
+                if ch == ",":
+                    frame.state = "key"
+                elif ch == "}":
+                    self._close(events)
+                else:
+                    raise _Abort()
+        else:
+            if state in ("value_or_end", "value"):
+                if ch == "]":
+                    self._close(events)   # 빈 배열 또는 trailing comma
+                else:
+                    self._begin_value(ch)
+            elif state == "comma_or_end":
+                if ch == ",":
+                    frame.state = "value"
+                elif ch == "]":
+                    self._close(events)
+                else:
+                    raise _Abort()
+
+    def _begin_value(self, ch: str):
+        if ch == "{":
+            self._stack.append(_Frame(is_obj=True))
+        elif ch == "[":
+            self._stack.append(_Frame(is_obj=False))
+        elif ch in "\"'":
+            self._begin_string(ch)
+        elif ch in _LITERAL_CHARS:
+            self._lit = [ch]
+        else:
+            raise _Abort()
+
+    def _begin_string(self, quote: str):
+        self._str = []
+        self._quote = quote
+
+    def _string_char(self, ch: str, events: List[JSONEvent]):
+        buf = self._str
+        if self._unicode is not None:
+            self._unicode += ch
+            if len(self._unicode) == 4:
+                try:
+                    buf.append(chr(int(self._unicode, 16)))
+                except ValueError:
+                    raise _Abort()
+                self._unicode = None
+            return
+        if self._escape:
+            self._escape = False
+            if ch == "u":
+                self._unicode = ""
+            else:
+                buf.append({"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}.get(ch, ch))
+            return
+        if ch == "\\":
+            self._escape = True
+        elif ch == self._quote:
+            text = "".join(buf)
+            self._str = None
+            frame = self._stack[-1]
+            if frame.is_obj and frame.state in ("key_or_end", "key"):
+                frame.key = text
+                frame.state = "colon"
+            else:
+                self._put_value(text, events)
+        else:
+            buf.append(ch)
+
+    @staticmethod
+    def _parse_literal(text: str) -> Any:
+        if text in _LITERALS:
+            return _LITERALS[text]
+        try:
+            return json.loads(text)
+        except ValueError:
+            raise _Abort()
+
+    def _close(self, events: List[JSONEvent]):
+        frame = self._stack.pop()
+        if not self._stack:
+            self.objects.append(frame.value)
+            events.append(JSONEvent(kind="object", key="", value=frame.value))
+            return
+        self._put_value(frame.value, events)
+
+    def _put_value(self, value: Any, events: List[JSONEvent]):
+        frame = self._stack[-1]
+        if frame.is_obj:
+            if frame.state != "value":
+                raise _Abort()
+            frame.value[frame.key] = value
+            frame.state = "comma_or_end"
+            if len(self._stack) == 1:
+                events.append(JSONEvent(kind="field", key=frame.key, value=value))
+        else:
+            frame.value.append(value)
+            frame.state = "comma_or_end"
+            if len(self._stack) == 2 and self._stack[0].is_obj:
+                events.append(
+                    JSONEvent(
+                        kind="item",
+                        key=self._stack[0].key,
+                        value=value,
+                        index=len(frame.value) - 1,
+                    )
+                )
+
+
+def extract_result(txt: str) -> Optional[Dict[str, Any]]:
+    """완성된 텍스트 전체에서 '결과 JSON'처럼 생긴 마지막 객체 (없으면 None)."""
+    parser = StreamingJSONParser()
+    parser.feed(txt or "")
+    return parser.result()
@@ -0,0 +1,80 @@
+# listing_format.py
+# 목적: 프롬프트에 넣는 매물 정보 직렬화 형식 (토큰 수 절약용)
+# - json     : json.dumps(indent=2) (기존 형식)
+# - json_min : 공백 없는 한 줄 JSON (내용은 json 과 같고 들여쓰기/공백만 뺀다)
+# - kv       : "key: value" 줄 나열 (따옴표/중괄호 없음, 리스트는 ", " 로 연결)
+# - table    : 멀티 전용. 열 이름(key)은 머리글에 한 번만, 매물은 한 줄씩 " | " 구분
+#   (단일 프롬프트에서 table 을 고르면 kv 로 처리)
+# - 형식별 토큰 수 비교 / 출력 품질 가드는 python -m bench.formats
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Sequence, Tuple
+
+FORMATS = ("json", "json_min", "kv", "table")
+
+
+def check_format(fmt: str) -> str:
+    if fmt not in FORMATS:
+        raise ValueError(f"매물 직렬화 형식은 {FORMATS} 중 하나여야 합니다: {fmt}")
+    return fmt
+
+
+def _scalar(value: Any) -> str:
+    """kv / table 셀 값 (리스트는 ', ' 연결, 줄바꿈/구분자는 공백으로)."""
+    if isinstance(value, list):
+        text = ", ".join(_scalar(x) for x in value)
+    elif isinstance(value, dict):
+        text = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    elif value is None:
+        text = ""
+    else:
+        text = str(value)
+    return text.replace("\n", " ").replace("|", "/")
+
+
+def describe(fmt: str) -> str:
+    """블록 머리에 붙는 형식 설명 (instruction 쪽 문구는 그대로 두고 데이터 형태만 알려준다)."""
+    return {
+        "json": "JSON 객체 형태",
+        "json_min": "한 줄 JSON 객체 형태",
+        "kv": "한 줄에 '항목: 값' 형태",
+        "table": "표 형태",
+    }[fmt]
+
+
+def format_vehicle(v: Dict[str, Any], fmt: str) -> str:
+    """매물 1대 → 텍스트 (단일 프롬프트 / 멀티 프롬프트의 [매물 N] 블록 본문)."""
+    if fmt == "json":
+        return json.dumps(v, ensure_ascii=False, indent=2)
+    if fmt == "json_min":
+        return json.dumps(v, ensure_ascii=False, separators=(",", ":"))
+    return "\n".join(f"{k}: {_scalar(val)}" for k, val in v.items())
+
+
+def table_columns(rows: Sequence[Dict[str, Any]]) -> List[str]:
+    """등장 순서대로 모은 열 이름 (어떤 매물에도 없는 열은 뺀다)."""
+    cols: List[str] = []
+    seen = set()
+    for row in rows:
+        for k in row:
+            if k not in seen:
+                seen.add(k)
+                cols.append(k)
+    return cols
+
+
+def table_header(columns: Sequence[str]) -> str:
+    return "번호 | " + " | ".join(columns)
+
+
+def table_row(index: int, v: Dict[str, Any], columns: Sequence[str]) -> str:
+    return f"{index} | " + " | ".join(_scalar(v.get(c)) for c in columns)
+
+
+def format_table(listings: Sequence[Tuple[int, Dict[str, Any]]]) -> str:
+    """(번호, 매물) 목록 → 머리글 1줄 + 매물당 1줄. 번호는 [매물 N] 의 N 과 같다."""
+    columns = table_columns([v for _, v in listings])
+    lines = [table_header(columns)]
+    lines.extend(table_row(i, v, columns) for i, v in listings)
+    return "\n".join(lines)
@@ -0,0 +1,279 @@
+# metrics.py
+# 목적: 요청 단위 계측 → 히스토그램/카운터 집계 → Prometheus 텍스트 형식으로 노출
+# - 생성 단계: prompt 토큰 수, 생성 토큰 수, prefill ms, decode ms (GenerationTimer 로 generate 안에서 측정)
+# - assisted decoding (MIDM_DRAFT_MODEL): draft 제안 토큰 / 수락 토큰 / 검증 step, 요청별 수락 비율
+# - 파싱 단계: parse ms, raw_text fallback 여부, 결과 캐시 hit/miss
+# - 과부하로 LLM 대신 규칙 기반 결과를 돌려준 요청 수 (degraded.py)
+# - 입장 제어 (admission.py): lane 별 입장 / 거절 / 시간 초과 수, 자리를 받기까지 기다린 시간
+# - RAW LLM 출력 덤프 / 요청별 디버그 줄은 MIDM_RAW_LOG_SAMPLE 비율로만 (기본 0 = 끔, 수치는 위 카운터로 본다)
+# - MIDM_METRICS_PORT 또는 serve_http(port) 로 /metrics HTTP 엔드포인트
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+from transformers import LogitsProcessor
+
+
+RAW_LOG_SAMPLE = float(os.getenv("MIDM_RAW_LOG_SAMPLE", "0"))
+
+MS_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+PARSE_MS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100)
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0)
+
+
+# ==============================
+# 1. 집계 타입
+# ==============================
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Optional[Dict[str, str]]) -> LabelKey:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _fmt_labels(key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Histogram:
+    """누적 bucket 히스토그램 (Prometheus histogram 과 같은 의미)."""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, List[float]] = {}   # [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: Optional[Dict[str, str]] = None):
+        key = _label_key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0.0] * (len(self.buckets) + 2)
+                self._series[key] = series
+            series[idx] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {k: list(v) for k, v in self._series.items()}
+        for key, series in sorted(snapshot.items()):
+            cumulative = 0.0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_fmt_labels(key, [('le', f'{bound:g}')])} {cumulative:g}")
+            cumulative += series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_fmt_labels(key, [('le', '+Inf')])} {cumulative:g}")
+            lines.append(f"{self.name}_sum{_fmt_labels(key)} {series[-1]:g}")
+            lines.append(f"{self.name}_count{_fmt_labels(key)} {cumulative:g}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._series: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Optional[Dict[str, str]] = None, value: float = 1.0):
+        key = _label_key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + value
+
+    def value(self, labels: Optional[Dict[str, str]] = None) -> float:
+        with self._lock:
+            return self._series.get(_label_key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._series)
+        for key, v in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_fmt_labels(key)} {v:g}")
+        return lines
+
+
+# ==============================
+# 2. 지표 정의
+# ==============================
+
+PROMPT_TOKENS = Histogram("midm_prompt_tokens", "Prompt length in tokens (chat template 포함)", TOKEN_BUCKETS)
+GENERATED_TOKENS = Histogram("midm_generated_tokens", "Generated tokens per request", TOKEN_BUCKETS)
+PREFILL_MS = Histogram("midm_prefill_ms", "generate() 시작 ~ 첫 logits 까지 (ms)", MS_BUCKETS)
+DECODE_MS = Histogram("midm_decode_ms", "첫 logits ~ 생성 종료까지 (ms)", MS_BUCKETS)
+PARSE_MS = Histogram("midm_parse_ms", "LLM 출력 JSON 파싱 시간 (ms)", PARSE_MS_BUCKETS)
+REQUESTS = Counter("midm_requests_total", "결과를 만든 요청 수 (kind, cache=hit|miss)")
+PARSE_FALLBACK = Counter("midm_parse_fallback_total", "JSON 파싱 실패로 raw_text fallback 된 요청 수")
+GENERATIONS = Counter("midm_generations_total", "LLM generate 호출 수 (path=single|stream|batch)")
+ASSIST_DRAFTED = Counter("midm_assist_draft_tokens_total", "assisted decoding: draft 모델이 제안한 토큰 수")
+ASSIST_ACCEPTED = Counter("midm_assist_accepted_tokens_total", "assisted decoding: 본 모델이 받아들인 draft 토큰 수")
+ASSIST_STEPS = Counter("midm_assist_verify_steps_total", "assisted decoding: 본 모델 forward (검증) 횟수")
+ASSIST_ACCEPT_RATIO = Histogram("midm_assist_acceptance_ratio", "요청별 draft 토큰 수락 비율", RATIO_BUCKETS)
+CANONICAL_LISTINGS = Counter(
+    "midm_canonical_listings_total", "프롬프트에 들어간 매물 (outcome=new|repeat|collapsed, collapsed = 정규화로 합쳐진 변형)"
+)
+DEGRADED = Counter("midm_degraded_total", "과부하로 규칙 기반 결과를 바로 돌려준 요청 수 (kind=single|multi)")
+ADMISSION = Counter(
+    "midm_admission_total", "입장 제어 결과 (lane=interactive|bulk, outcome=admitted|rejected|timeout|session_busy)"
+)
+ADMISSION_WAIT_MS = Histogram("midm_admission_wait_ms", "generate 자리를 받기까지 기다린 시간 (ms)", MS_BUCKETS)
+
+ALL_METRICS = [
+    REQUESTS, PARSE_FALLBACK, GENERATIONS, DEGRADED, ADMISSION, ADMISSION_WAIT_MS,
+    PROMPT_TOKENS, GENERATED_TOKENS, PREFILL_MS, DECODE_MS, PARSE_MS,
+    ASSIST_DRAFTED, ASSIST_ACCEPTED, ASSIST_STEPS, ASSIST_ACCEPT_RATIO, CANONICAL_LISTINGS,
+]
+
+
+# ==============================
+# 3. 계측 도우미
+# ==============================
+
+class GenerationTimer(LogitsProcessor):
+    """
+    generate() 의 logits_processor 에 끼워 두는 타이머 (logits 는 건드리지 않는다).
+    - 첫 호출 시각 = prefill 종료 (첫 토큰 logits 가 나온 시점)
+    - finish() 시각 = decode 종료
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.first_logits_at: Optional[float] = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self.first_logits_at is None:
+            self.first_logits_at = time.perf_counter()
+        return scores
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.first_logits_at = None
+
+    def finish(self) -> Tuple[float, float]:
+        """(prefill_ms, decode_ms)"""
+        end = time.perf_counter()
+        first = self.first_logits_at or end
+        return (first - self.started_at) * 1000.0, (end - first) * 1000.0
+
+
+def observe_generation(
+    path: str,
+    timer: GenerationTimer,
+    prompt_tokens: Sequence[int],
+    generated_tokens: Sequence[int],
+):
+    """
+    generate 1회 (배치면 행 여러 개) 결과 반영.
+    - 배치는 prefill/decode 시간을 행들이 공유하므로 행마다 같은 값으로 기록
+    """
+    prefill_ms, decode_ms = timer.finish()
+    GENERATIONS.inc({"path": path})
+    for p, g in zip(prompt_tokens, generated_tokens):
+        PROMPT_TOKENS.observe(p)
+        GENERATED_TOKENS.observe(g)
+        PREFILL_MS.observe(prefill_ms)
+        DECODE_MS.observe(decode_ms)
+
+
+def observe_assist(path: str, drafted: int, accepted: int, steps: int):
+    """assisted decoding 1회: draft 제안 토큰 / 수락 토큰 / 본 모델 검증 forward 수."""
+    labels = {"path": path}
+    ASSIST_DRAFTED.inc(labels, drafted)
+    ASSIST_ACCEPTED.inc(labels, accepted)
+    ASSIST_STEPS.inc(labels, steps)
+    if drafted:
+        ASSIST_ACCEPT_RATIO.observe(accepted / drafted, labels)
+
+
+def observe_canonical(outcome: str):
+    CANONICAL_LISTINGS.inc({"outcome": outcome})
+
+
+def observe_degraded(kind: str):
+    DEGRADED.inc({"kind": kind})
+
+
+def observe_admission(lane: str, outcome: str, wait_ms: Optional[float] = None):
+    ADMISSION.inc({"lane": lane, "outcome": outcome})
+    if wait_ms is not None:
+        ADMISSION_WAIT_MS.observe(wait_ms, {"lane": lane})
+
+
+def observe_parse(kind: str, parse_ms: float, fallback: bool):
+    PARSE_MS.observe(parse_ms, {"kind": kind})
+    if fallback:
+        PARSE_FALLBACK.inc({"kind": kind})
+
+
+def observe_request(kind: str, cache_hit: bool):
+    REQUESTS.inc({"kind": kind, "cache": "hit" if cache_hit else "miss"})
+
+
+def _sampled() -> bool:
+    return RAW_LOG_SAMPLE > 0 and random.random() < RAW_LOG_SAMPLE
+
+
+def log_raw(tag: str, raw: str):
+    """RAW LLM 출력 덤프 (MIDM_RAW_LOG_SAMPLE 비율로 샘플링, 0 이면 끔)."""
+    if not _sampled():
+        return
+    print(f"[{tag}] RAW LLM OUTPUT:")
+    print(raw)
+
+
+def log_debug(line: str):
+    """요청마다 찍던 디버그 한 줄 (log_raw 와 같은 MIDM_RAW_LOG_SAMPLE 비율, 0 이면 끔)."""
+    if _sampled():
+        print(line)
+
+
+# ==============================
+# 4. 노출
+# ==============================
+
+def render_prometheus() -> str:
+    """Prometheus text exposition format (0.0.4)."""
+    lines: List[str] = []
+    for m in ALL_METRICS:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+def serve_http(port: int, host: str = "127.0.0.1"):
+    """GET /metrics 를 응답하는 HTTP 서버를 데몬 스레드로 띄운다."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("/metrics", ""):
+                self.send_error(404)
+                return
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="midm-metrics", daemon=True).start()
+    print(f"[metrics] serving http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,177 @@
+# model_client.py
+# 목적: model_server 에 붙는 얇은 클라이언트 (torch / transformers import 없음)
+# - inference / scheduler 와 같은 이름·인자의 함수를 제공 → 앱에서는 import 만 바꾸면 된다
+# - 호출마다 연결을 새로 연다 (로컬 소켓이라 비용이 작고, 스레드 간 연결 공유 문제가 없다)
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import socket
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict
+from typing import Any, Dict, Iterator, List, Optional
+
+from model_server import DEFAULT_ADDR, parse_addr
+from vehicle import Vehicle, VehicleLike
+
+SERVER_ADDR = os.getenv("MIDM_SERVER") or DEFAULT_ADDR
+TIMEOUT_S = float(os.getenv("MIDM_SERVER_TIMEOUT_S", "600"))
+
+
+class ModelServerError(RuntimeError):
+    """서버 쪽에서 난 예외 (error_type 에 원래 예외 이름)."""
+
+    def __init__(self, message: str, error_type: str = ""):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+_ids = itertools.count(1)
+
+
+def _connect(addr: str) -> socket.socket:
+    family, target = parse_addr(addr)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(TIMEOUT_S)
+    sock.connect(target)
+    return sock
+
+
+def _call(method: str, params: Dict[str, Any], addr: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """요청 1개를 보내고 응답 메시지를 순서대로 yield."""
+    req_id = next(_ids)
+    with _connect(addr or SERVER_ADDR) as sock:
+        sock.sendall((json.dumps({"id": req_id, "method": method, "params": params}, ensure_ascii=False) + "\n").encode("utf-8"))
+        with sock.makefile("r", encoding="utf-8") as rfile:
+            for line in rfile:
+                msg = json.loads(line)
+                if msg.get("error") is not None:
+                    raise ModelServerError(msg["error"], msg.get("error_type", ""))
+                yield msg
+                if "result" in msg or msg.get("done"):
+                    return
+    raise ModelServerError("서버 연결이 응답 도중 끊겼습니다.")
+
+
+def _unary(method: str, params: Dict[str, Any]) -> Any:
+    for msg in _call(method, params):
+        return msg["result"]
+
+
+def _stream(method: str, params: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    for msg in _call(method, params):
+        if msg.get("done"):
+            return
+        yield msg["event"]
+
+
+def _params(persona_id, mode, model, persona_obj, user_note, allow_degraded, session_id) -> Dict[str, Any]:
+    return {
+        "persona_id": persona_id,
+        "mode": mode,
+        "model": model,
+        "persona_obj": asdict(persona_obj) if persona_obj is not None else None,
+        "user_note": user_note,
+        "allow_degraded": allow_degraded,
+        "session_id": session_id,
+    }
+
+
+def _wire(v: VehicleLike) -> Dict[str, Any]:
+    """Vehicle 은 JSON 으로 보낼 수 있게 dict 로 (서버 쪽에서 다시 Vehicle 로 변환)."""
+    return v.to_dict() if isinstance(v, Vehicle) else v
+
+
+# ==============================
+# inference / scheduler 와 같은 인터페이스
+# ==============================
+
+def generate_view(
+    vehicle_data: VehicleLike,
+    persona_id: str,
+    mode: str = "buy",
+    model: Optional[str] = None,
+    persona_obj=None,
+    user_note: Optional[str] = None,
+    allow_degraded: bool = True,
+    session_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    params = _params(persona_id, mode, model, persona_obj, user_note, allow_degraded, session_id)
+    params["vehicle_data"] = _wire(vehicle_data)
+    return _unary("generate_view", params)
+
+
+def generate_multi_view(
+    vehicle_list: List[VehicleLike],
+    persona_id: str,
+    mode: str = "buy",
+    model: Optional[str] = None,
+    persona_obj=None,
+    user_note: Optional[str] = None,
+    allow_degraded: bool = True,
+    session_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    params = _params(persona_id, mode, model, persona_obj, user_note, allow_degraded, session_id)
+    params["vehicle_list"] = [_wire(v) for v in vehicle_list]
+    return _unary("generate_multi_view", params)
+
+
+def stream_view(
+    vehicle_data: VehicleLike,
+    persona_id: str,
+    mode: str = "buy",
+    model: Optional[str] = None,
+    persona_obj=None,
+    user_note: Optional[str] = None,
+    allow_degraded: bool = True,
+    session_id: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    params = _params(persona_id, mode, model, persona_obj, user_note, allow_degraded, session_id)
+    params["vehicle_data"] = _wire(vehicle_data)
+    return _stream("stream_view", params)
+
+
+def stream_multi_view(
+    vehicle_list: List[VehicleLike],
+    persona_id: str,
+    mode: str = "buy",
+    model: Optional[str] = None,
+    persona_obj=None,
+    user_note: Optional[str] = None,
+    allow_degraded: bool = True,
+    session_id: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    params = _params(persona_id, mode, model, persona_obj, user_note, allow_degraded, session_id)
+    params["vehicle_list"] = [_wire(v) for v in vehicle_list]
+    return _stream("stream_multi_view", params)
+
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("MIDM_CLIENT_WORKERS", "8")), thread_name_prefix="midm-client")
+
+
+def submit_view(vehicle_data: VehicleLike, persona_id: str, **kwargs) -> Future:
+    """scheduler.submit_view 와 같은 모양 (Future). 실제 micro-batching 은 서버 쪽 스케줄러가 한다."""
+    return _executor.submit(generate_view, vehicle_data, persona_id, **kwargs)
+
+
+def submit_multi_view(vehicle_list: List[VehicleLike], persona_id: str, **kwargs) -> Future:
+    return _executor.submit(generate_multi_view, vehicle_list, persona_id, **kwargs)
+
+
+def queue_status(session_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """scheduler.queue_status 와 같음 (서버 쪽 대기열 기준)."""
+    return _unary("queue_status", {"session_id": session_id})
+
+
+def ping() -> Dict[str, Any]:
+    return _unary("ping", {})
+
+
+def stats() -> Dict[str, Any]:
+    return _unary("stats", {})
+
+
+def metrics() -> str:
+    """서버의 Prometheus 텍스트 형식 지표."""
+    return _unary("metrics", {})
@@ -0,0 +1,265 @@
+# model_server.py
+# 목적: 모델을 들고 있는 상주 프로세스 (호스트당 1개)
+# - Streamlit 은 상호작용마다 스크립트를 재실행하고, 워커 프로세스마다 inference 를 import 하면 가중치가 프로세스 수만큼 올라간다
+# - 이 서버가 모델을 한 번만 올리고, 앱은 model_client 로 RPC 호출만 한다 (앱 재시작/코드 리로드와 무관하게 유지)
+# - 여러 앱 프로세스의 요청이 같은 MicroBatchScheduler 로 모이므로 프로세스 간에도 배치가 묶인다
+#
+# 프로토콜: 한 줄에 JSON 하나 (UTF-8, '\n' 구분)
+#   요청  {"id": 1, "method": "generate_view", "params": {...}}
+#   응답  {"id": 1, "result": {...}}                       (generate_* / queue_status / ping / stats / metrics)
+#         {"id": 1, "event": {...}} ... {"id": 1, "done": true}   (stream_*)
+#         {"id": 1, "error": "메시지", "error_type": "ValueError"}
+#
+# 실행:
+#   python model_server.py                         # unix:/tmp/encar_llm.sock
+#   python model_server.py --addr 127.0.0.1:8765   # TCP (localhost)
+#   python model_server.py --preload               # 시작하자마자 모델 로드
+#   python model_server.py --metrics-port 9108     # GET http://127.0.0.1:9108/metrics (Prometheus)
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+DEFAULT_ADDR = os.getenv("MIDM_SERVER_ADDR", "unix:/tmp/encar_llm.sock")
+METRICS_PORT = int(os.getenv("MIDM_METRICS_PORT", "0"))   # 0 이면 HTTP /metrics 를 띄우지 않음
+
+
+def parse_addr(addr: str) -> Tuple[int, Any]:
+    """
+    주소 문자열 → (socket family, bind/connect 주소).
+    - "unix:/path/to.sock" 또는 "/path/to.sock" → Unix 소켓
+    - "tcp:127.0.0.1:8765" 또는 "127.0.0.1:8765" → TCP
+    """
+    if addr.startswith("unix:"):
+        return socket.AF_UNIX, addr[len("unix:"):]
+    if addr.startswith("/"):
+        return socket.AF_UNIX, addr
+    if addr.startswith("tcp:"):
+        addr = addr[len("tcp:"):]
+    host, _, port = addr.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+# ==============================
+# 1. RPC 메서드
+# ==============================
+
+def _persona_from_params(params: Dict[str, Any]):
+    from personas import Persona
+
+    obj = params.pop("persona_obj", None)
+    params["persona_obj"] = Persona(**obj) if obj else None
+    return params
+
+
+def _rpc_generate_view(params: Dict[str, Any]) -> Dict[str, Any]:
+    import scheduler
+
+    params = _persona_from_params(params)
+    vehicle_data = params.pop("vehicle_data")
+    return scheduler.submit_view(vehicle_data, **params).result()
+
+
+def _rpc_generate_multi_view(params: Dict[str, Any]) -> Dict[str, Any]:
+    import scheduler
+
+    params = _persona_from_params(params)
+    vehicle_list = params.pop("vehicle_list")
+    return scheduler.submit_multi_view(vehicle_list, **params).result()
+
+
+def _rpc_stream_view(params: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    import inference
+
+    params = _persona_from_params(params)
+    vehicle_data = params.pop("vehicle_data")
+    return inference.stream_view(vehicle_data, **params)
+
+
+def _rpc_stream_multi_view(params: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    import inference
+
+    params = _persona_from_params(params)
+    vehicle_list = params.pop("vehicle_list")
+    return inference.stream_multi_view(vehicle_list, **params)
+
+
+_started_at = time.time()
+
+
+def _rpc_ping(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {"pid": os.getpid(), "uptime_s": round(time.time() - _started_at, 1)}
+
+
+def _rpc_queue_status(params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    import scheduler
+
+    return scheduler.queue_status(params.get("session_id"))
+
+
+def _rpc_stats(params: Dict[str, Any]) -> Dict[str, Any]:
+    import admission
+    import canonical
+    import degraded
+    import inference
+    import result_cache
+
+    cache = result_cache.get_result_cache()
+    return {
+        "canonical": canonical.stats(),
+        "load": degraded.stats(),
+        "admission": admission.stats(),
+        "constraint_filter": inference.CONSTRAINT_FILTER,   # 앱은 자기 env 가 아니라 서버 설정을 따른다
+        "early_stop": inference.early_stop_stats(),
+        "assist": inference.assist_stats(),
+        "result_cache": cache.stats() if cache is not None else None,
+    }
+
+
+def _rpc_metrics(params: Dict[str, Any]) -> str:
+    """Prometheus 텍스트 형식 그대로 (HTTP 포트를 열지 않은 경우 RPC 로 수집)."""
+    import metrics
+
+    return metrics.render_prometheus()
+
+
+UNARY_METHODS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "generate_view": _rpc_generate_view,
+    "generate_multi_view": _rpc_generate_multi_view,
+    "queue_status": _rpc_queue_status,
+    "ping": _rpc_ping,
+    "stats": _rpc_stats,
+    "metrics": _rpc_metrics,
+}
+STREAM_METHODS: Dict[str, Callable[[Dict[str, Any]], Iterator[Dict[str, Any]]]] = {
+    "stream_view": _rpc_stream_view,
+    "stream_multi_view": _rpc_stream_multi_view,
+}
+
+
+# ==============================
+# 2. 서버
+# ==============================
+
+class _Handler(socketserver.StreamRequestHandler):
+    """연결 하나에서 요청 줄을 순서대로 처리 (동시 요청은 연결을 여러 개 열면 된다)."""
+
+    def _send(self, msg: Dict[str, Any]):
+        self.wfile.write((json.dumps(msg, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            req_id = None
+            try:
+                req = json.loads(line)
+                req_id = req.get("id")
+                method = req.get("method")
+                params = dict(req.get("params") or {})
+
+                if method in UNARY_METHODS:
+                    self._send({"id": req_id, "result": UNARY_METHODS[method](params)})
+                elif method in STREAM_METHODS:
+                    for ev in STREAM_METHODS[method](params):
+                        self._send({"id": req_id, "event": ev})
+                    self._send({"id": req_id, "done": True})
+                else:
+                    raise ValueError(f"unknown method: {method}")
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                print(f"[model_server] {type(e).__name__}: {e}")
+                try:
+                    self._send({"id": req_id, "error": str(e), "error_type": type(e).__name__})
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ServerAlreadyRunning(RuntimeError):
+    """같은 주소에서 이미 살아 있는 서버가 응답함 (가중치를 두 번 올리지 않도록 시작하지 않는다)."""
+
+
+def _answers(family: int, target: Any) -> bool:
+    """그 주소에 연결이 되면 True (살아 있는 서버)."""
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(1.0)
+        try:
+            sock.connect(target)
+        except OSError:
+            return False
+    return True
+
+
+def make_server(addr: str = DEFAULT_ADDR) -> socketserver.BaseServer:
+    family, target = parse_addr(addr)
+    if family == socket.AF_UNIX:
+        if os.path.exists(target):
+            if _answers(family, target):
+                raise ServerAlreadyRunning(f"{addr} 에서 이미 서버가 실행 중입니다.")
+            os.unlink(target)   # 이전 프로세스가 남긴 소켓 파일
+        return _ThreadingUnixServer(target, _Handler)
+    # TCP 는 살아 있는 서버가 있으면 bind 가 EADDRINUSE 로 실패한다
+    return _ThreadingTCPServer(target, _Handler)
+
+
+def serve(addr: str = DEFAULT_ADDR, preload: bool = False, metrics_port: int = METRICS_PORT):
+    # 주소부터 잡는다: 이미 서버가 떠 있으면 모델을 올리기 전에 끝낸다
+    server = make_server(addr)
+    if metrics_port:
+        import metrics
+
+        metrics.serve_http(metrics_port)
+    if preload:
+        import inference
+
+        inference._load_model(inference.MODEL_ID_DEFAULT)
+        inference._draft_for(inference.MODEL_ID_DEFAULT)   # MIDM_DRAFT_MODEL 이 있으면 draft 도
+
+    print(f"[model_server] listening on {addr} (pid={os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        family, target = parse_addr(addr)
+        if family == socket.AF_UNIX and os.path.exists(target):
+            os.unlink(target)
+
+
+def serve_in_thread(addr: str = DEFAULT_ADDR) -> socketserver.BaseServer:
+    """같은 프로세스 안에서 백그라운드로 서버 띄우기 (테스트/벤치용). 종료는 server.shutdown()."""
+    server = make_server(addr)
+    threading.Thread(target=server.serve_forever, name="midm-server", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encar LLM 모델 서버")
+    parser.add_argument("--addr", type=str, default=DEFAULT_ADDR,
+                        help="unix:/path/to.sock 또는 host:port (기본: MIDM_SERVER_ADDR)")
+    parser.add_argument("--preload", action="store_true", help="시작 시 모델을 미리 로드")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="Prometheus /metrics HTTP 포트 (기본: MIDM_METRICS_PORT, 0 이면 끔)")
+    args = parser.parse_args()
+    try:
+        serve(args.addr, preload=args.preload, metrics_port=args.metrics_port)
+    except ServerAlreadyRunning as e:
+        raise SystemExit(f"[model_server] {e}")
@@ -0,0 +1,175 @@
+# prerank.py
+# 목적: 멀티 매물 비교 전에 LLM 없이 규칙 기반 점수로 후보를 먼저 줄이는 사전 랭킹
+# - _shrink_vehicle_for_multi 가 남기는 필드(price_krw, year, mileage_km, 사고/용도 이력, 옵션 수, 시세 힌트)만 사용
+# - 특성 추출만 매물별 파이썬, 정규화/가중합/정렬은 NumPy 로 한 번에 (수천 대도 수 ms)
+# - persona 별 가중치 → 상위 K 대의 '원래 인덱스' 를 돌려준다 (프롬프트의 [매물 N] 번호도 원래 번호 그대로)
+# - 결정적: 같은 입력이면 항상 같은 결과 (동점은 원래 순서가 앞선 매물)
+# - 입력은 vehicle.Vehicle (가격/연식/주행거리가 이미 int 라 여기서 문자열을 다시 해석하지 않는다)
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from vehicle import Vehicle
+
+
+# ==============================
+# 1. 특성 추출
+# ==============================
+
+# 열 순서 = FEATURES 순서. 값이 클수록 '그 성질이 강함' (좋고 나쁨은 가중치 부호로)
+FEATURES = (
+    "price",          # price_krw (원)
+    "year",           # 연식
+    "mileage",        # 주행거리 (km)
+    "accident",       # 사고 심각도 0(무사고) ~ 5(침수/전손)
+    "commercial",     # 렌트/리스/영업/택시 이력 여부 (0/1)
+    "options",        # 옵션 개수
+    "market",         # 시세 힌트: 시세보다 싸면 +1, 비슷 0, 비싸면 -1
+)
+
+_STRUCTURAL = re.compile(r"(프레임|골격|구조|휠하우스|사이드멤버)")
+_DAMAGE = re.compile(r"(손상|교환|수리|용접|절단)")
+_MINOR = re.compile(r"(단순\s*교환|단순\s*판금|판금|도색|교환)")
+_SEVERE = re.compile(r"(침수|전손)")
+_NEGATED = re.compile(r"(없음|없고|없는)")
+_COMMERCIAL = re.compile(r"(렌트|렌터카|리스|영업용|택시|법인)")
+
+
+_NAN = float("nan")
+
+
+def _num(value: Optional[int]) -> float:
+    return _NAN if value is None else float(value)
+
+
+def _accident_severity(text: Optional[str]) -> float:
+    """
+    accident_history 문자열 → 0 ~ 5.
+    - '프레임 손상 없음' 처럼 부정된 구절은 무시 (쉼표 단위로 끊어서 판단)
+    """
+    if not text or not text.strip():
+        return _NAN
+    return _accident_severity_text(text)
+
+
+@lru_cache(maxsize=4096)
+def _accident_severity_text(text: str) -> float:
+    # 딜러 매물은 같은 문구가 반복되는 경우가 많아 문자열 단위로 캐시
+    severity = 0.0
+    for clause in re.split(r"[,/·;]", text):
+        if _NEGATED.search(clause):
+            continue
+        if _SEVERE.search(clause):
+            severity = max(severity, 5.0)
+        elif _STRUCTURAL.search(clause) and _DAMAGE.search(clause):
+            severity = max(severity, 3.0)
+        elif _MINOR.search(clause):
+            severity = max(severity, 1.0)
+    return severity
+
+
+def _market_hint(text: Optional[str]) -> float:
+    if not text or not text.strip():
+        return _NAN
+    if "낮" in text or "저렴" in text or "싸" in text:
+        return 1.0
+    if "높" in text or "비싸" in text:
+        return -1.0
+    return 0.0
+
+
+def extract_features(vehicles: Sequence[Vehicle]) -> np.ndarray:
+    """(N, len(FEATURES)) float 배열. 없는 값은 nan."""
+    X = np.full((len(vehicles), len(FEATURES)), np.nan, dtype=np.float64)
+    for i, v in enumerate(vehicles):
+        usage = v.usage_history
+        X[i] = (
+            _num(v.price_krw),
+            _num(v.year),
+            _num(v.mileage_km),
+            _accident_severity(v.accident_history),
+            float(bool(_COMMERCIAL.search(usage))) if usage is not None else _NAN,
+            float(len(v.options)) if v.options is not None else _NAN,
+            _market_hint(v.market_price_hint),
+        )
+    return X
+
+
+def _normalize(X: np.ndarray) -> np.ndarray:
+    """
+    열별 min-max → [0, 1]. 없는 값(nan) 은 0.5 (중립).
+    - 후보 안에서의 상대 위치만 본다 (모든 매물이 같은 값이면 전부 0.5)
+    """
+    lo = np.min(np.where(np.isnan(X), np.inf, X), axis=0)
+    hi = np.max(np.where(np.isnan(X), -np.inf, X), axis=0)
+    span = hi - lo
+    valid = np.isfinite(span) & (span > 0)
+    Z = np.full_like(X, 0.5)
+    with np.errstate(invalid="ignore"):
+        Z[:, valid] = (X[:, valid] - lo[valid]) / span[valid]
+    return np.where(np.isnan(Z), 0.5, Z)
+
+
+# ==============================
+# 2. persona 별 가중치
+# ==============================
+# 부호: + 는 클수록 좋음, - 는 작을수록 좋음. 값은 상대적인 중요도.
+
+DEFAULT_WEIGHTS: Dict[str, Dict[str, float]] = {
+    "buy": {"price": -1.0, "year": 0.8, "mileage": -0.8, "accident": -1.0, "commercial": -0.4, "options": 0.3, "market": 0.5},
+    # 판매 모드의 멀티 비교는 '팔기 좋은 매물' 관점 (상태 좋고 시세 대비 경쟁력 있는 쪽)
+    "sell": {"price": -0.3, "year": 0.6, "mileage": -0.6, "accident": -1.0, "commercial": -0.3, "options": 0.4, "market": 0.6},
+}
+
+PERSONA_WEIGHTS: Dict[str, Dict[str, float]] = {
+    "first_car_student": {"price": -1.6, "year": 0.4, "mileage": -0.6, "accident": -0.8, "commercial": -0.3, "options": 0.1, "market": 0.8},
+    "beginner_driver": {"price": -0.8, "year": 0.6, "mileage": -0.6, "accident": -1.4, "commercial": -0.4, "options": 0.4, "market": 0.4},
+    "family_second_car": {"price": -0.7, "year": 0.8, "mileage": -0.6, "accident": -1.6, "commercial": -0.6, "options": 0.6, "market": 0.4},
+    "sales_commute": {"price": -0.8, "year": 0.6, "mileage": -1.4, "accident": -0.8, "commercial": -0.6, "options": 0.3, "market": 0.4},
+    "enthusiast": {"price": -0.6, "year": 0.6, "mileage": -0.8, "accident": -1.8, "commercial": -0.8, "options": 0.6, "market": 0.8},
+}
+
+
+def weights_for(persona_id: str, mode: str) -> np.ndarray:
+    """persona_id 의 가중치 벡터 (등록 안 된 persona 는 mode 기본값)."""
+    table = PERSONA_WEIGHTS.get(persona_id) or DEFAULT_WEIGHTS.get(mode) or DEFAULT_WEIGHTS["buy"]
+    return np.array([table.get(f, 0.0) for f in FEATURES], dtype=np.float64)
+
+
+# ==============================
+# 3. 점수 / 상위 K
+# ==============================
+
+def score(vehicles: Sequence[Vehicle], persona_id: str, mode: str = "buy") -> np.ndarray:
+    """매물별 사전 점수 (N,). 후보 집합 안에서의 상대값이라 절대 크기에는 의미 없음."""
+    if not vehicles:
+        return np.zeros(0, dtype=np.float64)
+    return _normalize(extract_features(vehicles)) @ weights_for(persona_id, mode)
+
+
+def top_k(
+    vehicles: Sequence[Vehicle],
+    persona_id: str,
+    mode: str = "buy",
+    k: int = 8,
+    scores: Optional[np.ndarray] = None,
+) -> List[int]:
+    """
+    점수 상위 k 대의 원래 인덱스 (0-based, 점수 내림차순, 동점은 원래 순서).
+    - k <= 0 이거나 매물 수가 k 이하면 전체를 원래 순서대로
+    """
+    n = len(vehicles)
+    if k <= 0 or n <= k:
+        return list(range(n))
+    s = score(vehicles, persona_id, mode) if scores is None else scores
+    # argpartition 으로 후보만 고른 뒤 그 안에서만 정렬 (O(N + k log k))
+    cand = np.argpartition(-s, k - 1)[:k]
+    # 경계 동점이 argpartition 에서 임의로 잘리지 않도록 경계 점수와 같은 매물은 모두 포함 후 재정렬
+    kth = s[cand].min()
+    cand = np.flatnonzero(s >= kth)
+    order = np.lexsort((cand, -s[cand]))
+    return [int(i) for i in cand[order][:k]]
@@ -0,0 +1,180 @@
+# prompt_template.py
+# 목적: 프롬프트의 고정 텍스트(instruction, 블록 구분자, chat 템플릿 머리/꼬리)를
+#       조합별로 한 번만 만들고 토큰 id 까지 캐시해 두는 템플릿 레지스트리
+# - 템플릿 = 고정 텍스트 조각과 slot(persona / 메모 / 매물 등 요청마다 바뀌는 부분) 의 나열
+# - 요청마다 slot 텍스트만 토크나이즈해서 캐시된 고정 조각 id 와 이어 붙인다
+#   (instruction 길이에 비례하던 chat 템플릿 재토크나이즈 비용이 없어진다)
+# - 조각 경계에서 BPE merge 가 달라지면 결과 id 가 전체 토크나이즈와 어긋날 수 있어서,
+#   (모델, 템플릿) 마다 첫 요청은 전체 토크나이즈와 비교하고, 어긋나면 그 조합은 계속 전체 토크나이즈
+# - 어떤 조합이 있는지(키 → 조각 구성)는 호출하는 쪽(inference)의 factory 가 정한다
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+# (slot 여부, 텍스트 또는 slot 이름)
+Part = Tuple[bool, str]
+
+_SENTINEL = "\u0000PROMPT\u0000"
+
+
+def _loose_edge(value: str) -> bool:
+    return not value or value[0].isspace() or value[-1].isspace()
+
+
+def static(text: str) -> Part:
+    return (False, text)
+
+
+def slot(name: str) -> Part:
+    return (True, name)
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    key: Hashable
+    parts: Tuple[Part, ...]
+
+    def fill(self, **values: str) -> "Prompt":
+        text = "".join(values[p] if is_slot else p for is_slot, p in self.parts)
+        return Prompt(self, values, text)
+
+
+@dataclass(frozen=True, eq=False)
+class Prompt:
+    """템플릿 + slot 값 + 완성된 텍스트 (결과 캐시 키 / prefix 캐시 비교에는 text 를 쓴다)."""
+    template: PromptTemplate
+    values: Dict[str, str]
+    text: str
+
+
+@dataclass
+class _Encoded:
+    """(모델, 템플릿) 별 토큰 캐시. static_ids[i] 는 parts[i] 가 고정 조각일 때의 id."""
+    static_ids: List[Optional[List[int]]]
+    tail_ids: List[int]
+    verified: Optional[bool] = None   # None = 아직 비교 전, False = 조각 이어 붙이기 불가
+
+
+class TemplateRegistry:
+    """
+    key → PromptTemplate (factory 로 첫 사용 시 1번 생성) + (model_id, key) → 토큰 캐시.
+    - tokenizer_for(model_id): 토크나이저 (가중치 없이 토크나이저만 있으면 된다)
+    - build_messages(text): chat 메시지 구성 (실제 generate 와 같은 함수)
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[Hashable], Sequence[Part]],
+        tokenizer_for: Callable[[str], Any],
+        build_messages: Callable[[str], List[Dict[str, str]]],
+    ):
+        self._factory = factory
+        self._tokenizer_for = tokenizer_for
+        self._build_messages = build_messages
+        self._templates: Dict[Hashable, PromptTemplate] = {}
+        self._encoded: Dict[Tuple[str, Hashable], _Encoded] = {}
+        self._chat: Dict[str, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> PromptTemplate:
+        tpl = self._templates.get(key)
+        if tpl is None:
+            with self._lock:
+                tpl = self._templates.get(key)
+                if tpl is None:
+                    tpl = PromptTemplate(key, tuple(self._merge(self._factory(key))))
+                    self._templates[key] = tpl
+        return tpl
+
+    @staticmethod
+    def _merge(parts: Sequence[Part]) -> List[Part]:
+        """이웃한 고정 조각은 하나로 (조각 경계가 적을수록 토큰 경계 문제도 적다)."""
+        out: List[Part] = []
+        for is_slot, text in parts:
+            if not is_slot and not text:
+                continue
+            if out and not is_slot and not out[-1][0]:
+                out[-1] = (False, out[-1][1] + text)
+            else:
+                out.append((is_slot, text))
+        return out
+
+    # ---------- 토큰 ----------
+    def _chat_wrap(self, model_id: str, tokenizer) -> Tuple[str, str]:
+        """chat 템플릿에서 user 내용 앞/뒤 텍스트 (system 프롬프트, generation prompt 포함)."""
+        wrap = self._chat.get(model_id)
+        if wrap is None:
+            rendered = tokenizer.apply_chat_template(
+                self._build_messages(_SENTINEL), tokenize=False, add_generation_prompt=True
+            )
+            head, tail = rendered.split(_SENTINEL)
+            wrap = (head, tail)
+            self._chat[model_id] = wrap
+        return wrap
+
+    def _encoded_for(self, model_id: str, tpl: PromptTemplate, tokenizer) -> _Encoded:
+        key = (model_id, tpl.key)
+        enc = self._encoded.get(key)
+        if enc is not None:
+            return enc
+        with self._lock:
+            enc = self._encoded.get(key)
+            if enc is None:
+                head, tail = self._chat_wrap(model_id, tokenizer)
+                static_ids: List[Optional[List[int]]] = []
+                for n, (is_slot, text) in enumerate(tpl.parts):
+                    if is_slot:
+                        static_ids.append(None)
+                    else:
+                        # 첫 고정 조각(instruction)은 chat 머리와 붙여서 한 번에
+                        static_ids.append(self._ids(tokenizer, head + text if n == 0 else text))
+                if tpl.parts[0][0]:
+                    static_ids.insert(0, self._ids(tokenizer, head))
+                enc = _Encoded(static_ids, self._ids(tokenizer, tail))
+                self._encoded[key] = enc
+        return enc
+
+    @staticmethod
+    def _ids(tokenizer, text: str) -> List[int]:
+        return tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    def encode(self, prompt: Prompt, model_id: str) -> List[int]:
+        """chat 템플릿까지 적용한 input_ids (add_generation_prompt=True 와 같은 결과)."""
+        tokenizer = self._tokenizer_for(model_id)
+        tpl = prompt.template
+        enc = self._encoded_for(model_id, tpl, tokenizer)
+        if enc.verified is False or any(_loose_edge(v) for v in prompt.values.values()):
+            # 빈 slot / 공백으로 시작·끝나는 slot 은 이웃 조각의 줄바꿈과 한 토큰으로 합쳐질 수 있다
+            return self._full(tokenizer, prompt.text)
+
+        ids: List[int] = []
+        cached = iter(enc.static_ids)
+        if tpl.parts[0][0]:
+            ids.extend(next(cached))
+        for (is_slot, text), static_ids in zip(tpl.parts, cached):
+            ids.extend(self._ids(tokenizer, prompt.values[text]) if is_slot else static_ids)
+        ids.extend(enc.tail_ids)
+
+        if enc.verified is None:
+            full = self._full(tokenizer, prompt.text)
+            enc.verified = full == ids
+            if not enc.verified:
+                print(f"[prompt] token boundary mismatch for template {tpl.key} ({model_id}) → full tokenization")
+                return full
+        return ids
+
+    def _full(self, tokenizer, text: str) -> List[int]:
+        return list(tokenizer.apply_chat_template(
+            self._build_messages(text), tokenize=True, add_generation_prompt=True
+        ))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "templates": len(self._templates),
+                "encoded": len(self._encoded),
+                "segmented": sum(1 for e in self._encoded.values() if e.verified),
+                "fallback": sum(1 for e in self._encoded.values() if e.verified is False),
+            }
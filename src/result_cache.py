@@ -0,0 +1,148 @@
+# result_cache.py
+# 목적: generate_view / generate_multi_view 결과 캐시 (2단계)
+# - call_llm 은 greedy(do_sample=False) → 같은 (model_id, prompt, 생성 파라미터) 면 결과도 같다
+# - 1단계: 메모리 LRU (개수 상한 + TTL)
+# - 2단계: SQLite 파일 (프로세스 재시작 후에도 유지)
+# - hit/miss 카운터 제공
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+RESULT_CACHE_ENABLED = os.getenv("MIDM_RESULT_CACHE", "1") not in ("0", "false", "False")
+RESULT_CACHE_PATH = os.getenv(
+    "MIDM_RESULT_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "encar_llm", "results.sqlite3"),
+)
+RESULT_CACHE_SIZE = int(os.getenv("MIDM_RESULT_CACHE_SIZE", "512"))
+RESULT_CACHE_TTL_S = float(os.getenv("MIDM_RESULT_CACHE_TTL_S", str(7 * 24 * 3600)))
+
+
+def make_key(model_id: str, prompt: str, params: Dict[str, Any]) -> str:
+    """model_id + prompt 해시 + 생성 파라미터로 캐시 키 생성."""
+    h = hashlib.sha256()
+    h.update(model_id.encode("utf-8"))
+    h.update(b"\x00")
+    h.update(hashlib.sha256(prompt.encode("utf-8")).digest())
+    h.update(b"\x00")
+    h.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    메모리 LRU + SQLite 2단계 결과 캐시.
+    - 값은 JSON 문자열로 보관 → get 할 때마다 새 dict 를 돌려주므로 호출자가 수정해도 캐시는 안전
+    - path=None 이면 메모리 캐시만 사용
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = RESULT_CACHE_PATH,
+        max_entries: int = RESULT_CACHE_SIZE,
+        ttl_s: float = RESULT_CACHE_TTL_S,
+    ):
+        self.max_entries = max(1, max_entries)
+        self.ttl_s = ttl_s
+        self._mem: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"mem_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl_s > 0 and (time.time() - created_at) > self.ttl_s
+
+    def _mem_put(self, key: str, created_at: float, value: str):
+        self._mem[key] = (created_at, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                created_at, value = hit
+                if not self._expired(created_at):
+                    self._mem.move_to_end(key)
+                    self._stats["mem_hits"] += 1
+                    return json.loads(value)
+                del self._mem[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, created_at = row
+                    if not self._expired(created_at):
+                        self._mem_put(key, created_at, value)
+                        self._stats["disk_hits"] += 1
+                        return json.loads(value)
+                    self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, value: Dict[str, Any]):
+        text = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._mem_put(key, now, text)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, text, now),
+                )
+                self._db.commit()
+            self._stats["stores"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+            out["mem_entries"] = len(self._mem)
+        lookups = out["mem_hits"] + out["disk_hits"] + out["misses"]
+        out["hit_rate"] = round((out["mem_hits"] + out["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return out
+
+
+_default_cache: Optional[ResultCache] = None
+_default_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """프로세스 전역 결과 캐시 (MIDM_RESULT_CACHE=0 이면 None)."""
+    global _default_cache
+    if not RESULT_CACHE_ENABLED:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache()
+        return _default_cache
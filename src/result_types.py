@@ -0,0 +1,254 @@
+# result_types.py
+# 목적: generate_view / generate_multi_view 결과 dict 를 화면 쪽에서 한 번만 읽어 두는 타입
+# - inference / scheduler / RPC / 결과 캐시는 지금처럼 dict (JSON) 로 주고받고,
+#   받는 쪽(streamlit_app 등)이 from_dict 로 한 번 변환한 뒤 속성만 읽는다
+# - 모르는 키는 extra 에 보관 → to_dict() 에서도 빠지지 않는다 (빠진 필드는 기본값으로 채워서 나간다)
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional
+
+
+def _str(value: Any) -> str:
+    return value if isinstance(value, str) else ("" if value is None else str(value))
+
+
+def _str_list(value: Any) -> List[str]:
+    if isinstance(value, list):
+        return [_str(x) for x in value]
+    if isinstance(value, str) and value.strip():
+        return [value]
+    return []
+
+
+def _float(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _int(value: Any, default: Optional[int] = None) -> Optional[int]:
+    if isinstance(value, bool):
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _split(data: Dict[str, Any], known) -> Dict[str, Any]:
+    """타입에 없는 키 → extra."""
+    return {k: v for k, v in data.items() if k not in known}
+
+
+def _dump(obj, list_keys=()) -> Dict[str, Any]:
+    """slots 결과 타입 → dict (extra 포함, 원래 입력에 없던 Optional 필드는 뺀다)."""
+    out: Dict[str, Any] = {}
+    for f in fields(obj):
+        if f.name == "extra":
+            continue
+        val = getattr(obj, f.name)
+        if val is None:
+            continue
+        if f.name in list_keys:
+            val = [c.to_dict() for c in val]
+        elif isinstance(val, Candidate):
+            val = val.to_dict()
+        out[f.name] = val
+    out.update(obj.extra)
+    return out
+
+
+# ==============================
+# 1. 멀티 비교 후보 1건
+# ==============================
+
+@dataclass(slots=True)
+class Candidate:
+    index: int = 1                       # 원래 매물 목록 번호 (1-based)
+    title: str = ""
+    fit_score: Optional[float] = None
+    risk_level: str = ""
+    summary: str = ""
+    why_suitable: str = ""
+    highlights: List[str] = field(default_factory=list)
+    pros: List[str] = field(default_factory=list)
+    cons: List[str] = field(default_factory=list)
+    checklist: List[str] = field(default_factory=list)
+    questions_for_seller: List[str] = field(default_factory=list)
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: Any, default_index: int = 1) -> "Candidate":
+        if not isinstance(data, dict):
+            return cls(index=default_index)
+        return cls(
+            index=_int(data.get("index"), default_index),
+            title=_str(data.get("title")),
+            fit_score=_float(data.get("fit_score")),
+            risk_level=_str(data.get("risk_level")),
+            summary=_str(data.get("summary")),
+            why_suitable=_str(data.get("why_suitable")),
+            highlights=_str_list(data.get("highlights")),
+            pros=_str_list(data.get("pros")),
+            cons=_str_list(data.get("cons")),
+            checklist=_str_list(data.get("checklist")),
+            questions_for_seller=_str_list(data.get("questions_for_seller")),
+            extra=_split(data, _CANDIDATE_KEYS),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return _dump(self)
+
+
+_CANDIDATE_KEYS = frozenset(f.name for f in fields(Candidate))
+
+
+# ==============================
+# 2. 단일 매물 결과
+# ==============================
+
+@dataclass(slots=True)
+class SingleResult:
+    mode: str = "buy"
+    persona_id: str = ""
+    persona_label: str = ""
+    summary: str = ""
+    fit_score: Optional[float] = None
+    risk_level: str = ""
+    highlights: List[str] = field(default_factory=list)
+    pros: List[str] = field(default_factory=list)
+    cons: List[str] = field(default_factory=list)
+    checklist: List[str] = field(default_factory=list)
+    questions_for_seller: List[str] = field(default_factory=list)
+    recommendation: str = ""
+    listing_title: str = ""              # 판매 모드
+    listing_body: str = ""               # 판매 모드
+    raw_text: Optional[str] = None       # JSON 파싱 실패 시 원문
+    degraded: bool = False               # 과부하로 LLM 없이 만든 규칙 기반 결과 (degraded.py)
+    degraded_reason: str = ""
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SingleResult":
+        return cls(
+            mode=_str(data.get("mode")) or "buy",
+            persona_id=_str(data.get("persona_id")),
+            persona_label=_str(data.get("persona_label")),
+            summary=_str(data.get("summary")),
+            fit_score=_float(data.get("fit_score")),
+            risk_level=_str(data.get("risk_level")),
+            # 판매 모드에서 모델이 highlights 대신 selling_points 를 줄 때가 있다
+            highlights=_str_list(data.get("highlights") or data.get("selling_points")),
+            pros=_str_list(data.get("pros")),
+            cons=_str_list(data.get("cons")),
+            checklist=_str_list(data.get("checklist")),
+            questions_for_seller=_str_list(data.get("questions_for_seller")),
+            recommendation=_str(data.get("recommendation")),
+            listing_title=_str(data.get("listing_title")),
+            listing_body=_str(data.get("listing_body")),
+            raw_text=data.get("raw_text") or None,
+            degraded=bool(data.get("degraded")),
+            degraded_reason=_str(data.get("degraded_reason")),
+            extra=_split(data, _SINGLE_KEYS),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return _dump(self)
+
+    @classmethod
+    def from_json(cls, text: str) -> "SingleResult":
+        return cls.from_dict(json.loads(text))
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
+
+_SINGLE_KEYS = frozenset(f.name for f in fields(SingleResult))
+
+
+# ==============================
+# 3. 멀티 비교 결과
+# ==============================
+
+@dataclass(slots=True)
+class MultiResult:
+    mode: str = "buy"
+    persona_id: str = ""
+    persona_label: str = ""
+    summary: str = ""                    # 모델이 summary / summary_overall 중 하나만 줄 때가 있다
+    summary_overall: str = ""
+    risk_level: str = ""
+    highlights: List[str] = field(default_factory=list)
+    tradeoffs: List[str] = field(default_factory=list)
+    recommendation: str = ""
+    best_index: int = 1
+    best: Optional[Candidate] = None
+    ranking: List[Candidate] = field(default_factory=list)
+    ranked_candidates: List[Candidate] = field(default_factory=list)
+    evaluations: Optional[List[Dict[str, Any]]] = None   # map-reduce 일 때 매물별 map 평가
+    raw_text: Optional[str] = None
+    degraded: bool = False
+    degraded_reason: str = ""
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MultiResult":
+        def _cands(value: Any) -> List[Candidate]:
+            if not isinstance(value, list):
+                return []
+            return [Candidate.from_dict(c, n) for n, c in enumerate(value, start=1) if isinstance(c, dict)]
+
+        best = data.get("best")
+        evaluations = data.get("evaluations")
+        return cls(
+            mode=_str(data.get("mode")) or "buy",
+            persona_id=_str(data.get("persona_id")),
+            persona_label=_str(data.get("persona_label")),
+            summary=_str(data.get("summary")),
+            summary_overall=_str(data.get("summary_overall")),
+            risk_level=_str(data.get("risk_level")),
+            highlights=_str_list(data.get("highlights")),
+            tradeoffs=_str_list(data.get("tradeoffs")),
+            recommendation=_str(data.get("recommendation")),
+            best_index=_int(data.get("best_index"), None) or (
+                _int(best.get("index"), 1) if isinstance(best, dict) else 1
+            ),
+            best=Candidate.from_dict(best) if isinstance(best, dict) else None,
+            ranking=_cands(data.get("ranking")),
+            ranked_candidates=_cands(data.get("ranked_candidates")),
+            evaluations=evaluations if isinstance(evaluations, list) else None,
+            raw_text=data.get("raw_text") or None,
+            degraded=bool(data.get("degraded")),
+            degraded_reason=_str(data.get("degraded_reason")),
+            extra=_split(data, _MULTI_KEYS),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return _dump(self, list_keys=("ranking", "ranked_candidates"))
+
+    @classmethod
+    def from_json(cls, text: str) -> "MultiResult":
+        return cls.from_dict(json.loads(text))
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
+    def best_candidate(self) -> Candidate:
+        """최종 추천 후보: best → ranked_candidates 중 best_index → ranking 중 best_index → 빈 후보."""
+        if self.best is not None:
+            return self.best
+        for c in self.ranked_candidates or self.ranking:
+            if c.index == self.best_index:
+                return c
+        return Candidate(index=self.best_index)
+
+    def overall_summary(self) -> str:
+        return self.summary or self.summary_overall or (self.best.summary if self.best else "")
+
+
+_MULTI_KEYS = frozenset(f.name for f in fields(MultiResult))
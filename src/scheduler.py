@@ -0,0 +1,423 @@
+# scheduler.py
+# 목적: generate_view / generate_multi_view 앞단 온라인 micro-batching
+# - 짧은 윈도우(기본 20ms) 동안 들어온 요청을 모아 call_llm_batch 한 번으로 디코딩
+# - 호출자는 각자 Future 를 받아서 .result() 로 기다림
+# - 첫 요청이 들어온 시점부터 window_ms 가 지나면 무조건 출발 → 추가 지연 상한 = window_ms
+# - 모인 job 이 max_batch 보다 많으면 admission.fair_order 순으로 고른다 (단일 매물 먼저, 세션 round-robin)
+#   남은 job 은 다음 배치로. 배치 generate 는 입장 제어에서 SESSION 한 세션으로 자리를 받는다
+# - 대기 job 수 / 대기 시간에도 입장 제어와 같은 상한 (MIDM_ADMISSION_QUEUE_MAX → QueueFull, MIDM_ADMISSION_TIMEOUT_S → AdmissionTimeout)
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import admission
+import degraded
+import inference
+import metrics
+from inference import Mode, Persona
+from vehicle import VehicleLike
+
+
+BATCH_WINDOW_MS = float(os.getenv("MIDM_BATCH_WINDOW_MS", "20"))
+MAX_BATCH = int(os.getenv("MIDM_MAX_BATCH", str(inference.BATCH_SIZE_DEFAULT)))
+SESSION = "scheduler"   # 입장 제어에서 micro-batch generate 가 쓰는 세션 (스트리밍 세션들과 round-robin)
+
+
+@dataclass
+class _Job:
+    prompt: str
+    model_id: str
+    max_new_tokens: int
+    schema: Optional[str] = None
+    input_ids: Optional[List[int]] = None   # 제출하는 쪽에서 미리 토크나이즈 (워커 스레드는 generate 만)
+    session_id: Optional[str] = None
+    lane: admission.Lane = "interactive"
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    waiting: bool = True                    # 대기 job 수 / degraded 대기 깊이에 세어져 있는 동안 True
+
+
+class MicroBatchScheduler:
+    """
+    프롬프트 단위 micro-batching 스케줄러.
+    - submit(prompt) → Future[str] (LLM 원문 출력)
+    - 워커 스레드 1개가 큐에서 요청을 모아 (model, max_new_tokens, schema) 별로 묶어서 배치 디코딩
+    """
+
+    def __init__(
+        self,
+        window_ms: float = BATCH_WINDOW_MS,
+        max_batch: int = MAX_BATCH,
+        queue_max: int = admission.QUEUE_MAX,
+        timeout_s: float = admission.QUEUE_TIMEOUT_S,
+    ):
+        self.window_s = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.queue_max = queue_max
+        self.timeout_s = timeout_s
+        self._pending = 0                       # 큐 + backlog 에서 배치를 기다리는 job 수
+        self._queue: "queue.Queue[_Job]" = queue.Queue()
+        self._backlog: List[_Job] = []          # max_batch 를 넘어서 다음 배치로 미룬 job (공정 순서)
+        self._last_served: Dict[str, int] = {}  # 세션 → 마지막으로 배치에 들어간 순번
+        self._tick = 0
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    # ---------- 외부 API ----------
+    def submit(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        max_new_tokens: int = 512,
+        schema: Optional[str] = None,
+        input_ids: Optional[List[int]] = None,
+        session_id: Optional[str] = None,
+        lane: admission.Lane = "interactive",
+    ) -> Future:
+        if self._stopped:
+            raise RuntimeError("scheduler 가 이미 종료되었습니다.")
+        with self._lock:
+            if self.queue_max > 0 and self._pending >= self.queue_max:
+                metrics.observe_admission(lane, "rejected")
+                raise admission.QueueFull(f"대기 중인 요청이 너무 많습니다({self._pending}건). 잠시 후 다시 시도해 주세요.")
+            self._pending += 1
+        self._ensure_started()
+        job = _Job(
+            prompt=prompt,
+            model_id=model or inference.MODEL_ID_DEFAULT,
+            max_new_tokens=max_new_tokens,
+            schema=schema,
+            input_ids=input_ids,
+            session_id=session_id,
+            lane=lane,
+        )
+        self._queue.put(job)
+        degraded.load.enqueue()   # 워커가 꺼내 갈 때까지 대기 깊이에 센다
+        return job.future
+
+    def position(self, session_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """세션의 가장 앞선 대기 job 의 순번 (1 = 다음 배치 맨 앞). 대기 중인 job 이 없으면 None."""
+        with self._queue.mutex:
+            pending = [j for j in self._queue.queue if j is not None]
+        order = self._fair(list(self._backlog) + pending)
+        for n, job in enumerate(order):
+            if job.session_id == session_id:
+                return {"position": n + 1, "lane": job.lane}
+        return None
+
+    def stop(self):
+        self._stopped = True
+        if self._thread is not None:
+            self._queue.put(None)  # type: ignore[arg-type]  # 워커 깨우기용 sentinel
+            self._thread.join(timeout=5)
+
+    # ---------- 내부 ----------
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="midm-microbatch", daemon=True
+                )
+                self._thread.start()
+
+    def _fair(self, jobs: List[_Job]) -> List[_Job]:
+        return admission.fair_order(
+            jobs,
+            lane_of=lambda j: j.lane,
+            session_of=lambda j: j.session_id or admission.ANONYMOUS,
+            last_served=self._last_served,
+        )
+
+    def _collect(self) -> List[_Job]:
+        """
+        첫 job 을 블로킹으로 받고 (미뤄 둔 job 이 있으면 바로), window 안에 도착한 job 을 max_batch 까지 추가로 모은다.
+        창이 닫힐 때 이미 큐에 있는 job 까지 합쳐서 공정 순서로 max_batch 개를 고르고, 나머지는 다음 배치로 미룬다.
+        """
+        jobs = self._backlog   # 모으는 동안에도 backlog 에 둔다 (도중에 예외가 나도 _run 이 찾아서 끝낼 수 있게)
+        if not jobs:
+            first = self._queue.get()
+            if first is None:
+                return []
+            jobs.append(first)
+        deadline = jobs[0].enqueued_at + self.window_s
+        while len(jobs) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                self._stopped = True
+                break
+            jobs.append(job)
+        while not self._stopped:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                self._stopped = True
+                break
+            jobs.append(job)
+
+        jobs = [job for job in jobs if not self._expired(job)]
+        order = self._fair(jobs)
+        batch, self._backlog = order[:self.max_batch], order[self.max_batch:]
+        self._leave(batch)
+        if len(self._last_served) > admission.SERVED_TRACK:
+            self._last_served.clear()
+        for job in batch:
+            self._tick += 1
+            self._last_served[job.session_id or admission.ANONYMOUS] = self._tick
+        return batch
+
+    def _expired(self, job: _Job) -> bool:
+        """MIDM_ADMISSION_TIMEOUT_S 넘게 배치를 못 탄 job 은 AdmissionTimeout 으로 끝낸다."""
+        if self.timeout_s <= 0 or time.perf_counter() - job.enqueued_at < self.timeout_s:
+            return False
+        self._leave([job])
+        metrics.observe_admission(job.lane, "timeout")
+        job.future.set_exception(
+            admission.AdmissionTimeout(f"{self.timeout_s:.0f}초 동안 차례가 오지 않았습니다. 잠시 후 다시 시도해 주세요.")
+        )
+        return True
+
+    def _leave(self, jobs: List[_Job]):
+        """대기에서 빠지는 job (배치에 들어감 / 시간 초과 / 실패) 을 대기 job 수와 degraded 대기 깊이에서 뺀다 (한 번만)."""
+        jobs = [j for j in jobs if j.waiting]
+        for j in jobs:
+            j.waiting = False
+        with self._lock:
+            self._pending -= len(jobs)
+        degraded.load.dequeue(len(jobs))
+
+    def _drain(self) -> List[_Job]:
+        """backlog 와 큐에 남은 job 을 모두 꺼낸다."""
+        jobs, self._backlog = self._backlog, []
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                return jobs
+            if job is None:
+                self._stopped = True
+                continue
+            jobs.append(job)
+
+    def _run(self):
+        while not self._stopped:
+            jobs: List[_Job] = []
+            try:
+                jobs = self._collect()
+                if jobs:
+                    self._dispatch(jobs)
+            except Exception as e:
+                # 워커가 여기서 죽으면 기다리는 Future 가 영영 안 끝난다 (wait_with_queue_status 가 계속 poll)
+                # → 모으던 job / 대기 중인 job 을 모두 이 예외로 끝내고 다음 요청을 계속 받는다
+                failed = jobs + self._drain()
+                self._leave(failed)
+                for j in failed:
+                    if not j.future.done():
+                        j.future.set_exception(e)
+
+    def _dispatch(self, jobs: List[_Job]):
+        # 같은 모델/같은 max_new_tokens/같은 스키마끼리만 한 배치로 묶을 수 있다
+        groups: Dict[tuple, List[_Job]] = {}
+        for job in jobs:
+            groups.setdefault((job.model_id, job.max_new_tokens, job.schema), []).append(job)
+
+        for (model_id, max_new_tokens, schema), group in groups.items():
+            lane = "interactive" if any(j.lane == "interactive" for j in group) else "bulk"
+            try:
+                outputs = inference.call_llm_batch(
+                    [j.prompt for j in group],
+                    model=model_id,
+                    max_new_tokens=max_new_tokens,
+                    batch_size=self.max_batch,
+                    schema=schema,
+                    input_ids=[j.input_ids for j in group],
+                    session_id=SESSION,
+                    lane=lane,
+                )
+            except Exception as e:
+                for j in group:
+                    j.future.set_exception(e)
+                continue
+            for j, out in zip(group, outputs):
+                j.future.set_result(out)
+
+
+_default_scheduler: Optional[MicroBatchScheduler] = None
+_default_lock = threading.Lock()
+
+
+def get_scheduler() -> MicroBatchScheduler:
+    """프로세스 전역 기본 스케줄러 (lazy 생성)."""
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = MicroBatchScheduler()
+        return _default_scheduler
+
+
+def _done_future(value: Any) -> Future:
+    """이미 결과가 있는 경우(결과 캐시 hit) 바로 완료된 Future."""
+    f: Future = Future()
+    f.set_result(value)
+    return f
+
+
+def _chain(raw_future: Future, fn) -> Future:
+    """raw 출력 Future → 후처리(fn) 결과 Future."""
+    out: Future = Future()
+
+    def _done(f: Future):
+        try:
+            out.set_result(fn(f.result()))
+        except Exception as e:
+            out.set_exception(e)
+
+    raw_future.add_done_callback(_done)
+    return out
+
+
+def _gather(futures: List[Future]) -> Future:
+    """Future 목록 → 결과 리스트 Future (입력 순서 유지, 하나라도 실패하면 그 예외)."""
+    out: Future = Future()
+    if not futures:
+        out.set_result([])
+        return out
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def _done(_f: Future):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            out.set_result([f.result() for f in futures])
+        except Exception as e:
+            out.set_exception(e)
+
+    for f in futures:
+        f.add_done_callback(_done)
+    return out
+
+
+def _session_request(session_id: Optional[str], start: Callable[[], Future]) -> Future:
+    """세션의 동시 요청 수를 start() 가 돌려준 Future 가 끝날 때까지 센다 (admission.SESSION_MAX_ACTIVE)."""
+    admission.controller.begin_request(session_id)
+    try:
+        future = start()
+    except BaseException:
+        admission.controller.end_request(session_id)
+        raise
+    future.add_done_callback(lambda _f: admission.controller.end_request(session_id))
+    return future
+
+
+def _then(future: Future, fn) -> Future:
+    """future 결과로 다음 Future 를 만드는 fn 을 이어 붙인다 (map → reduce)."""
+    out: Future = Future()
+
+    def _relay(f: Future):
+        try:
+            out.set_result(f.result())
+        except Exception as e:
+            out.set_exception(e)
+
+    def _done(f: Future):
+        try:
+            fn(f.result()).add_done_callback(_relay)
+        except Exception as e:
+            out.set_exception(e)
+
+    future.add_done_callback(_done)
+    return out
+
+
+def _submit(req: Any, session_id: Optional[str]) -> Future:
+    """prepare_* 결과 → Future[정규화된 결과 dict] (ViewRequest 면 큐에 넣고 finish 를 이어 붙인다)."""
+    if not isinstance(req, inference.ViewRequest):
+        return _done_future(req)
+    raw_future = get_scheduler().submit(
+        req.prompt.text,
+        model=req.model,
+        max_new_tokens=req.max_new_tokens,
+        schema=req.schema,
+        input_ids=req.input_ids(),
+        session_id=session_id,
+        lane=req.lane,
+    )
+    return _chain(raw_future, req.finish)
+
+
+def submit_view(
+    vehicle_data: VehicleLike,
+    persona_id: str,
+    mode: Mode = "buy",
+    model: Optional[str] = None,
+    persona_obj: Optional[Persona] = None,
+    user_note: Optional[str] = None,
+    allow_degraded: bool = True,
+    session_id: Optional[str] = None,
+) -> Future:
+    """generate_view 와 같은 인자 → Future[정규화된 결과 dict]."""
+    req = inference.prepare_view(vehicle_data, persona_id, mode, model, persona_obj, user_note, allow_degraded)
+    if not isinstance(req, inference.ViewRequest):
+        return _done_future(req)
+    return _session_request(session_id, lambda: _submit(req, session_id))
+
+
+def submit_multi_view(
+    vehicle_list: List[VehicleLike],
+    persona_id: str,
+    mode: Mode = "buy",
+    model: Optional[str] = None,
+    persona_obj: Optional[Persona] = None,
+    user_note: Optional[str] = None,
+    allow_degraded: bool = True,
+    session_id: Optional[str] = None,
+) -> Future:
+    """generate_multi_view 와 같은 인자 → Future[정규화된 결과 dict]."""
+    req = inference.prepare_multi_view(vehicle_list, persona_id, mode, model, persona_obj, user_note, allow_degraded)
+    if isinstance(req, inference.MapReduceRequest):
+        return _session_request(session_id, lambda: _submit_map_reduce(req, session_id))
+    if not isinstance(req, inference.ViewRequest):
+        return _done_future(req)
+    return _session_request(session_id, lambda: _submit(req, session_id))
+
+
+def _submit_map_reduce(mr: inference.MapReduceRequest, session_id: Optional[str] = None) -> Future:
+    """
+    map 요청을 매물마다 따로 큐에 넣는다 (다른 요청의 job 과도 같은 배치로 묶인다).
+    map 이 모두 끝나면 reduce 요청을 다시 큐에 넣는다.
+    """
+    map_futures = [_submit(m, session_id) for m in mr.maps]
+    return _then(_gather(map_futures), lambda evaluations: _submit(mr.reduce(evaluations), session_id))
+
+
+def queue_status(session_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    세션의 대기 상태 {"position", "eta_s", "lane"} (화면 표시용, 기다리는 요청이 없으면 None).
+    - 스트리밍 요청: 입장 제어 대기열의 순번
+    - 스케줄러 요청: micro-batch 대기 job 중 순번 (eta = 앞선 job 수 × 요청 1건당 generate 시간)
+    """
+    status = admission.controller.status(session_id)
+    if status is not None or _default_scheduler is None:
+        return status
+    status = _default_scheduler.position(session_id)
+    if status is not None:
+        per_request = degraded.load.per_request_s()
+        status["eta_s"] = round(status["position"] * per_request, 1) if per_request is not None else None
+    return status
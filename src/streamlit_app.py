@@ -1,16 +1,32 @@
 # streamlit_app.py
 import json
+import os
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from typing import Dict, Any, Optional, List
 
 import streamlit as st
-import re
 
-from inference import (generate_view,
-    generate_multi_view,
-    BUY_PERSONAS,
-    SELL_PERSONAS,
-    Persona,
-    )
+import constraints
+from personas import BUY_PERSONAS, SELL_PERSONAS, Persona
+from result_types import MultiResult, SingleResult
+from vehicle import Vehicle, as_vehicle, parse_listings
+
+if os.getenv("MIDM_SERVER"):
+    # 모델은 별도 상주 프로세스(model_server.py)에 있고, 앱은 RPC 만 호출 → 앱 프로세스에는 가중치가 안 올라간다
+    from model_client import queue_status, stats, stream_view, stream_multi_view, submit_view, submit_multi_view
+
+    @st.cache_data(ttl=60, show_spinner=False)
+    def constraint_filter_enabled() -> bool:
+        # 사전 필터 여부는 실제로 필터링하는 서버 프로세스의 MIDM_CONSTRAINT_FILTER 를 따른다
+        return bool(stats().get("constraint_filter", True))
+else:
+    from inference import CONSTRAINT_FILTER, stream_view, stream_multi_view
+
+    def constraint_filter_enabled() -> bool:
+        return CONSTRAINT_FILTER
+    # 여러 세션이 동시에 실행해도 같은 모델에 한 배치로 묶여서 들어가도록 스케줄러 경유
+    from scheduler import queue_status, submit_view, submit_multi_view
 
 
 # =========================
@@ -54,6 +70,10 @@ DEFAULT_VEHICLE: Dict[str, Any] = {
 
 
 # 세션 상태 초기화
+# 입장 제어(admission.py) 용 세션 id: 같은 브라우저 세션의 동시 분석 수 제한 + 세션 간 공정 대기
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+
 if "vehicle_data" not in st.session_state:
     st.session_state["vehicle_data"] = DEFAULT_VEHICLE
     st.session_state["vehicle_confirmed"] = False
@@ -66,7 +86,8 @@ if "vehicle_json_text" not in st.session_state:
     )
 
 if "vehicle_list" not in st.session_state:
-    st.session_state["vehicle_list"] = [DEFAULT_VEHICLE]
+    # 매물은 입력 시점에 한 번만 Vehicle 로 변환해서 보관 (이후 단계는 속성만 읽는다)
+    st.session_state["vehicle_list"] = parse_listings(DEFAULT_VEHICLE)
 
 
 if "context_confirmed" not in st.session_state:
@@ -136,21 +157,16 @@ def _color_name_to_hex(color_name: str) -> str:
 # =========================
 # 차량 카드 UI
 # =========================
-def render_vehicle_card(data: Dict[str, Any]):
+def render_vehicle_card(v: Vehicle):
     """엔카 스타일 가벼운 카드 UI (색상 뱃지 포함)"""
-    title = data.get("title", "차량 제목 미입력")
-    year = data.get("year", "-")
-    mileage = data.get("mileage_km", "-")
-    color = data.get("color", "-")
-    price = data.get("price_krw")
-    accident = data.get("accident_history", "-")
-    usage = data.get("usage_history", "-")
-    market_hint = data.get("market_price_hint", "-")
-
-    try:
-        price_str = f"{int(price):,}원" if price is not None else "-"
-    except Exception:
-        price_str = str(price) if price is not None else "-"
+    title = v.title or "차량 제목 미입력"
+    year = v.year if v.year is not None else "-"
+    mileage = f"{v.mileage_km:,}" if v.mileage_km is not None else "-"
+    color = v.color or "-"
+    accident = v.accident_history or "-"
+    usage = v.usage_history or "-"
+    market_hint = v.market_price_hint or "-"
+    price_str = f"{v.price_krw:,}원" if v.price_krw is not None else "-"
 
     color_hex = _color_name_to_hex(color)
     color_dot = ""
@@ -262,6 +278,83 @@ background-color: #fefce8; margin-bottom: 10px;">
 
 
 
+# =========================
+# 스트리밍 미리보기
+# =========================
+def _bullets(items) -> str:
+    return "\n".join(f"- {x}" for x in items)
+
+
+def _queue_text(status: Optional[Dict[str, Any]]) -> str:
+    """대기 순번 / 예상 대기 → 한 줄 (대기 중이 아니면 생성 중 문구)."""
+    if not status:
+        return "⏳ LLM 생성 중..."
+    text = f"⏳ 다른 요청을 기다리는 중... (대기 순번 {status['position']}번"
+    if status.get("eta_s") is not None:
+        text += f", 예상 대기 약 {status['eta_s']:.0f}초"
+    return text + ")"
+
+
+def wait_with_queue_status(future: Future) -> Dict[str, Any]:
+    """submit_* Future 를 기다리는 동안 이 세션의 대기 순번 / 예상 대기를 표시."""
+    status_ph = st.empty()
+    try:
+        while True:
+            try:
+                return future.result(timeout=1.0)
+            except FutureTimeout:
+                status_ph.caption(_queue_text(queue_status(st.session_state["session_id"])))
+    finally:
+        status_ph.empty()
+
+
+def run_streaming(events) -> Optional[Dict[str, Any]]:
+    """
+    stream_view / stream_multi_view 이벤트를 받아서
+    summary / pros / cons 가 완성되는 대로 먼저 보여주고, 최종 결과 dict 를 반환.
+    (최종 결과가 나오면 미리보기는 지우고 아래 결과 화면으로 대체)
+    """
+    preview = st.empty()
+    fields: Dict[str, Any] = {}
+    n_chars = 0
+    result = None
+
+    with preview.container():
+        status_ph = st.empty()
+        summary_ph = st.empty()
+        col_p, col_c = st.columns(2)
+        with col_p:
+            pros_ph = st.empty()
+        with col_c:
+            cons_ph = st.empty()
+
+    for ev in events:
+        if ev["type"] == "queued":
+            status_ph.caption(_queue_text(ev))
+        elif ev["type"] == "token":
+            n_chars += len(ev["text"])
+            status_ph.caption(f"⏳ LLM 생성 중... ({n_chars}자)")
+        elif ev["type"] == "field":
+            fields[ev["key"]] = ev["value"]
+            # 멀티 비교는 best 객체 안에 summary/pros/cons 가 들어 있다
+            best = fields.get("best") if isinstance(fields.get("best"), dict) else {}
+
+            summary = fields.get("summary") or fields.get("summary_overall") or best.get("summary")
+            if summary:
+                summary_ph.markdown("#### 요약 (Summary)\n" + str(summary))
+            pros = fields.get("pros") or best.get("pros")
+            if isinstance(pros, list) and pros:
+                pros_ph.markdown("#### 장점\n" + _bullets(pros))
+            cons = fields.get("cons") or best.get("cons")
+            if isinstance(cons, list) and cons:
+                cons_ph.markdown("#### 단점 / 주의사항\n" + _bullets(cons))
+        elif ev["type"] == "result":
+            result = ev["result"]
+
+    preview.empty()
+    return result
+
+
 # =========================
 # 1. 차량 정보 입력 + 차량 카드
 # =========================
@@ -281,18 +374,13 @@ with col_left:
         try:
             parsed = json.loads(vehicle_json_text)
 
-            # ✅ dict 한 개든, list 여러 개든 다 지원
-            if isinstance(parsed, dict):
-                vehicle_list = [parsed]
-            elif isinstance(parsed, list):
-                if not all(isinstance(v, dict) for v in parsed):
-                    raise ValueError("리스트 안에는 차량 dict만 들어가야 합니다.")
-                vehicle_list = parsed
-            else:
-                raise ValueError("vehicle_data는 dict 또는 dict 리스트여야 합니다.")
+            # ✅ dict 한 개든, list 여러 개든 다 지원 (여기서 한 번만 검증/변환 → Vehicle 리스트)
+            vehicle_list = parse_listings(parsed)
+            if not vehicle_list:
+                raise ValueError("차량 정보가 비어 있습니다.")
 
             st.session_state["vehicle_list"] = vehicle_list
-            st.session_state["vehicle_data"] = vehicle_list[0]  # 대표(첫 번째) 매물
+            st.session_state["vehicle_data"] = vehicle_list[0].to_dict()  # 대표(첫 번째) 매물
             st.session_state["vehicle_confirmed"] = True
 
             st.success(f"차량 정보 {len(vehicle_list)}개가 확인되었습니다.")
@@ -312,7 +400,7 @@ with col_right:
 
         # 혹시 vehicle_list가 없다면 예전 방식 fallback
         if not vehicle_list:
-            render_vehicle_card(st.session_state["vehicle_data"])
+            render_vehicle_card(as_vehicle(st.session_state["vehicle_data"]))
         else:
             if len(vehicle_list) == 1:
                 # 매물 1대면 그냥 한 개만
@@ -320,7 +408,7 @@ with col_right:
             else:
                 st.caption(f"총 {len(vehicle_list)}대 매물")
                 for idx, v in enumerate(vehicle_list, start=1):
-                    title = v.get("title", f"매물 {idx}")
+                    title = v.title or f"매물 {idx}"
                     st.markdown(f"##### 매물 {idx}: {title}")
                     render_vehicle_card(v)
     else:
@@ -441,7 +529,16 @@ run_disabled = (
     or not st.session_state["context_confirmed"]
 )
 
-if st.button("LLM 분석 실행", type="primary", disabled=run_disabled):
+stream_output = st.checkbox(
+    "실시간 스트리밍 출력 (요약/장단점이 완성되는 대로 먼저 표시)",
+    value=True,
+)
+
+run_clicked = st.button("LLM 분석 실행", type="primary", disabled=run_disabled)
+# 규칙 기반(간단) 결과 화면의 'LLM 분석으로 다시 받기' → 이번 실행은 과부하여도 LLM 결과를 기다린다
+upgrade_requested = st.session_state.pop("upgrade_requested", False)
+
+if run_clicked or upgrade_requested:
     if not st.session_state["vehicle_confirmed"]:
         st.error("먼저 1단계에서 차량 정보를 확인해 주세요.")
         st.stop()
@@ -450,7 +547,7 @@ if st.button("LLM 분석 실행", type="primary", disabled=run_disabled):
         st.stop()
 
     # ✅ vehicle_list 기준으로 단일 vs 멀티 판단
-    vehicle_list: List[Dict[str, Any]] = st.session_state.get("vehicle_list", [])
+    vehicle_list: List[Vehicle] = st.session_state.get("vehicle_list", [])
     if not vehicle_list:
         st.error("vehicle_list 가 비어 있습니다. 1단계에서 차량 정보를 다시 확인해 주세요.")
         st.stop()
@@ -464,89 +561,98 @@ if st.button("LLM 분석 실행", type="primary", disabled=run_disabled):
     is_multi = (len(vehicle_list) > 1) and (saved_mode == "buy")
 
 
-    with st.spinner("LLM 호출 중..."):
+    call_kwargs = dict(
+        persona_id=saved_persona_id,
+        mode=saved_mode,
+        model=None,
+        persona_obj=saved_custom,
+        user_note=saved_user_note,
+        allow_degraded=not upgrade_requested,
+        session_id=st.session_state["session_id"],
+    )
+
+    if stream_output:
         try:
             if is_multi:
-                # 여러 매물 비교
-                result = generate_multi_view(
-                    vehicle_list,
-                    persona_id=saved_persona_id,
-                    mode=saved_mode,
-                    model=None,
-                    persona_obj=saved_custom,
-                    user_note=saved_user_note,
-                )
+                result = run_streaming(stream_multi_view(vehicle_list, **call_kwargs))
             else:
-                # 단일 매물
-                result = generate_view(
-                    vehicle_list[0],
-                    persona_id=saved_persona_id,
-                    mode=saved_mode,
-                    model=None,
-                    persona_obj=saved_custom,
-                    user_note=saved_user_note,
-                )
+                result = run_streaming(stream_view(vehicle_list[0], **call_kwargs))
         except Exception as e:
             st.error(f"LLM 호출 또는 JSON 파싱 중 오류 발생: {e}")
             st.stop()
+        if result is None:
+            st.error("LLM 결과를 받지 못했습니다.")
+            st.stop()
+    else:
+        with st.spinner("LLM 호출 중..."):
+            try:
+                if is_multi:
+                    # 여러 매물 비교
+                    result = wait_with_queue_status(submit_multi_view(vehicle_list, **call_kwargs))
+                else:
+                    # 단일 매물
+                    result = wait_with_queue_status(submit_view(vehicle_list[0], **call_kwargs))
+            except Exception as e:
+                st.error(f"LLM 호출 또는 JSON 파싱 중 오류 발생: {e}")
+                st.stop()
 
     st.markdown("### 3. LLM 결과")
 
+    # 결과 dict 는 여기서 한 번만 타입으로 변환 (이후로는 속성만 읽는다)
+    typed = MultiResult.from_dict(result) if is_multi else SingleResult.from_dict(result)
+
     # 모델이 JSON을 안 지키고 raw_text만 넘어온 경우 대비
-    raw_text = result.get("raw_text")
+    raw_text = typed.raw_text
     if raw_text:
         with st.expander("⚠ 모델이 JSON 형식을 완전히 지키지 않았습니다. 원문 보기"):
             st.write(raw_text)
 
+    # 과부하로 LLM 대신 매물 정보 규칙으로 만든 간단 결과인 경우
+    if typed.degraded:
+        st.warning(
+            f"⏳ 지금은 요청이 많아({typed.degraded_reason}) 매물 정보만으로 만든 간단 분석을 먼저 보여드립니다."
+        )
+        st.button(
+            "LLM 분석으로 다시 받기 (대기 후 상세 분석)",
+            key="upgrade_llm",
+            on_click=lambda: st.session_state.update(upgrade_requested=True),
+        )
+
     # =========================
     # 💸 예산 파싱 & 체크 (buy 모드 전용)
+    # - 메모 해석은 LLM 앞단의 사전 필터와 같은 constraints.extract 를 쓴다
+    # - 경고는 메모의 가장 작은 상한 기준 (필터는 가장 큰 상한으로 거르므로 그 사이 매물은 경고만)
     # =========================
-    budget_max = None
     budget_warning_text = None
+    excluded_text = None
 
-    if saved_mode == "buy":
-        note = (saved_user_note or "").replace(",", "")
-        matches = re.findall(r"(\d+)\s*(?:만|만원)\s*원?", note)
-        if matches:
-            try:
-                # 여러 숫자 있으면 가장 작은 값을 '예산 상한'으로 봄
-                max_unit = min(int(x) for x in matches)
-                budget_max = max_unit * 10_000
-            except Exception:
-                budget_max = None
-
-    if saved_mode == "buy" and budget_max is not None:
-        # 추천 매물 가격 가져오기
-        price_int = None
-        try:
-            if is_multi:
-                best = result.get("best") or {}
-                idx = best.get("index", result.get("best_index", 1))
-                try:
-                    idx_int = int(idx)
-                except Exception:
-                    idx_int = 1
-                if not (1 <= idx_int <= len(vehicle_list)):
-                    idx_int = 1
-                best_vehicle = vehicle_list[idx_int - 1]
-                price_int = int(best_vehicle.get("price_krw"))  # 실패하면 except 쪽으로
-            else:
-                price_int = int(vehicle_list[0].get("price_krw"))
-        except Exception:
-            price_int = None
-
-        if price_int is not None and price_int > budget_max:
-            def _fmt_manwon(val: int) -> str:
-                man = val // 10_000
-                return f"{man:,}만원"
-            budget_str = _fmt_manwon(budget_max)
-            price_str = _fmt_manwon(price_int)
+    limits = constraints.extract(saved_user_note) if saved_mode == "buy" else constraints.NONE
+
+    if limits.preferred_price_krw is not None:
+        # 추천 매물 가격 가져오기 (price_krw 는 입력 시 이미 int, 없으면 None)
+        if is_multi:
+            idx_int = typed.best_candidate().index
+            if not (1 <= idx_int <= len(vehicle_list)):
+                idx_int = 1
+            price_int = vehicle_list[idx_int - 1].price_krw
+        else:
+            price_int = vehicle_list[0].price_krw
+
+        if price_int is not None and price_int > limits.preferred_price_krw:
             budget_warning_text = (
-                f"사용자 메모 기준 예산 상한 {budget_str}보다 "
-                f"추천 매물의 가격 {price_str}이 높습니다. "
+                f"사용자 메모 기준 예산 상한 {constraints.format_krw(limits.preferred_price_krw)}보다 "
+                f"추천 매물의 가격 {constraints.format_krw(price_int)}이 높습니다. "
                 f"예산을 최우선으로 본다면 다른 매물을 보거나 가격을 재조정하는 것이 좋습니다."
             )
 
+    if is_multi and limits and constraint_filter_enabled():
+        within, violated = constraints.partition(vehicle_list, limits)
+        if violated and within:
+            excluded_text = (
+                f"메모의 조건({limits.describe()})에 맞지 않아 비교에서 뺀 매물: "
+                + ", ".join(f"매물 {i + 1}({', '.join(r)})" for i, r in sorted(violated.items()))
+            )
+
 
     # =========================
     # 3-A. 상단 공통 섹션 (단일/멀티 공통)
@@ -554,31 +660,26 @@ if st.button("LLM 분석 실행", type="primary", disabled=run_disabled):
     # =========================
     if is_multi:
         # 멀티일 때: best + ranking 구조 사용
-        best = result.get("best") or {}
+        best = typed.best_candidate()
 
-        summary = (
-            result.get("summary")
-            or result.get("summary_overall")
-            or best.get("summary")
-            or "요약 없음"
-        )
-        persona_label = result.get("persona_label", "")
-        risk_level = best.get("risk_level") or result.get("risk_level", "")
+        summary = typed.overall_summary() or "요약 없음"
+        persona_label = typed.persona_label
+        risk_level = best.risk_level or typed.risk_level
 
         # --- 핵심 포인트 ---
-        if isinstance(result.get("highlights"), list) and result["highlights"]:
-            highlights = result["highlights"]
-        elif isinstance(best.get("highlights"), list) and best["highlights"]:
-            highlights = best["highlights"]
-        elif best.get("summary"):
-            highlights = [best["summary"]]
+        if typed.highlights:
+            highlights = typed.highlights
+        elif best.highlights:
+            highlights = best.highlights
+        elif best.summary:
+            highlights = [best.summary]
         else:
             highlights = []
 
-        pros = best.get("pros", []) or []
-        cons = best.get("cons", []) or []
+        pros = best.pros
+        cons = best.cons
 
-        checklist = best.get("checklist")
+        checklist = best.checklist
         if not checklist:
             checklist = [
                 "시동 후 공회전/주행 시 이상 소음·진동이 있는지 확인",
@@ -586,21 +687,20 @@ if st.button("LLM 분석 실행", type="primary", disabled=run_disabled):
                 "사고·수리·정비 이력을 서류로 확인",
             ]
 
-        questions = best.get("questions_for_seller", []) or []
-        recommendation = result.get("recommendation", "")
+        questions = best.questions_for_seller
+        recommendation = typed.recommendation
 
     else:
         # 단일 매물: 그대로 result에서 직접 사용
-        summary = result.get("summary", "요약 없음")
-        persona_label = result.get("persona_label", "")
-        risk_level = result.get("risk_level", "")
-        highlights = result.get("highlights") or result.get("selling_points") or []
-        pros = result.get("pros", [])
-        cons = result.get("cons", [])
-        checklist = result.get("checklist", [])
-        questions = result.get("questions_for_seller", [])
-        recommendation = result.get("recommendation", "")
-        listing_text = result.get("listing_text", "")
+        summary = typed.summary
+        persona_label = typed.persona_label
+        risk_level = typed.risk_level
+        highlights = typed.highlights   # selling_points 로 온 경우도 여기에
+        pros = typed.pros
+        cons = typed.cons
+        checklist = typed.checklist
+        questions = typed.questions_for_seller
+        recommendation = typed.recommendation
 
 
 
@@ -620,6 +720,8 @@ if st.button("LLM 분석 실행", type="primary", disabled=run_disabled):
     # 💸 예산 경고 (buy 모드에서만)
     if saved_mode == "buy" and budget_warning_text:
         st.warning("💸 예산 체크: " + budget_warning_text)
+    if excluded_text:
+        st.info("🔎 " + excluded_text)
 
 
     # =========================
@@ -666,8 +768,8 @@ if st.button("LLM 분석 실행", type="primary", disabled=run_disabled):
     # =========================
     else:
         # 사이트에 올릴 문구 먼저 보여주기
-        listing_title = result.get("listing_title", "")
-        listing_body = result.get("listing_body", "")
+        listing_title = typed.listing_title
+        listing_body = typed.listing_body
 
         st.markdown("#### 사이트에 올릴 제목 (초안)")
         st.write(listing_title if listing_title else "-")
@@ -704,34 +806,22 @@ if st.button("LLM 분석 실행", type="primary", disabled=run_disabled):
     # 3-B. 여러 매물일 때만 비교/랭킹 추가 표시
     # =========================
     if is_multi:
-        ranking = result.get("ranking") or []
+        ranking = typed.ranking
 
         if ranking:
             st.markdown("#### 여러 매물 우선순위")
             for rank_idx, item in enumerate(ranking, start=1):
-                index = item.get("index", rank_idx)
-                title = item.get("title") or f"{index}번 매물"
-                fit_score = item.get("fit_score")
-                score_txt = (
-                    f"{float(fit_score):.1f}"
-                    if isinstance(fit_score, (int, float))
-                    else "-"
-                )
+                index = item.index
+                title = item.title or f"{index}번 매물"
+                score_txt = f"{item.fit_score:.1f}" if item.fit_score is not None else "-"
                 st.markdown(
                     f"- **#{rank_idx} 추천 매물** (원본 index: {index}, {title}) — "
                     f"적합도: {score_txt}/10.0"
                 )
 
-            # best_index 기준으로 최종 추천 강조 (가능하면 best 사용)
-            best = result.get("best") or {}
-            best_index = result.get("best_index", best.get("index", 1))
-            try:
-                best_index = int(best_index)
-            except Exception:
-                best_index = 1
-
-            if not (1 <= best_index <= len(ranking)):
-                best_index = 1
-
-            best_title = best.get("title") or ranking[best_index - 1].get("title") or "제목 없음"
-            st.success(f"✅ 최종 추천: #{best_index}번 매물 - {best_title}")
+            # 최종 추천 강조: best_index 는 순위가 아니라 원본 매물 번호 (prerank 로 줄인 경우 50대 중 37번 등)
+            best = typed.best_candidate()
+            best_title = best.title or next(
+                (item.title for item in ranking if item.index == best.index and item.title), "제목 없음"
+            )
+            st.success(f"✅ 최종 추천: {best.index}번 매물 - {best_title}")
@@ -0,0 +1,52 @@
+# test_admission.py
+# admission.fair_order 확인: lane 우선순위 / bulk 양보 streak / 세션 round-robin (python -m pytest -q src)
+from admission import fair_order
+
+
+def order(items, **kwargs):
+    """items: (이름, lane, session) → 자리를 받는 이름 순서."""
+    picked = fair_order(items, lane_of=lambda it: it[1], session_of=lambda it: it[2], **kwargs)
+    return [it[0] for it in picked]
+
+
+def test_interactive_before_bulk():
+    items = [("b1", "bulk", "x"), ("i1", "interactive", "y"), ("i2", "interactive", "z")]
+    assert order(items) == ["i1", "i2", "b1"]
+
+
+def test_bulk_gets_a_turn_after_streak():
+    items = [("b1", "bulk", "x"), ("b2", "bulk", "x")] + [(f"i{n}", "interactive", f"s{n}") for n in range(5)]
+    assert order(items, bulk_every=2) == ["i0", "i1", "b1", "i2", "i3", "b2", "i4"]
+
+
+def test_streak_carries_over_from_previous_grants():
+    items = [("b1", "bulk", "x"), ("i1", "interactive", "y")]
+    assert order(items, streak=3, bulk_every=4) == ["i1", "b1"]
+    assert order(items, streak=4, bulk_every=4) == ["b1", "i1"]
+
+
+def test_bulk_every_zero_means_bulk_only_when_idle():
+    items = [("b1", "bulk", "x")] + [(f"i{n}", "interactive", "y") for n in range(6)]
+    assert order(items, streak=100, bulk_every=0)[-1] == "b1"
+
+
+def test_sessions_take_turns_within_a_lane():
+    items = [("a1", "interactive", "A"), ("a2", "interactive", "A"), ("a3", "interactive", "A"),
+             ("b1", "interactive", "B"), ("c1", "interactive", "C"), ("b2", "interactive", "B")]
+    assert order(items) == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+
+def test_least_recently_served_session_goes_first():
+    items = [("a1", "interactive", "A"), ("b1", "interactive", "B"), ("c1", "interactive", "C")]
+    # A 는 방금, B 는 예전에 자리를 받았고 C 는 처음 → C, B, A
+    assert order(items, last_served={"A": 10, "B": 3}) == ["c1", "b1", "a1"]
+
+
+def test_round_robin_is_per_lane():
+    items = [("ba1", "bulk", "A"), ("ba2", "bulk", "A"), ("bb1", "bulk", "B"),
+             ("ia1", "interactive", "A"), ("ia2", "interactive", "A")]
+    assert order(items, bulk_every=0) == ["ia1", "ia2", "ba1", "bb1", "ba2"]
+
+
+def test_empty():
+    assert order([]) == []
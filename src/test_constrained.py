@@ -0,0 +1,105 @@
+# test_constrained.py
+# constrained._Grammar 의 문자 단위 전이 확인 (숫자 / enum / 공백 상한) (python -m pytest -q src)
+import json
+
+import pytest
+
+from constrained import DONE, INT, NUM, RISK, SCHEMAS, STR_LIST, _MAX_WS, _Grammar
+
+GRAMMAR = _Grammar(("obj", (
+    ("score", NUM, ""),
+    ("idx", INT, ""),
+    ("risk", RISK, ""),
+    ("tags", STR_LIST, ""),
+)))
+
+
+def run(text, grammar=GRAMMAR):
+    """text 를 다 소비한 상태 (중간에 막히면 None)."""
+    state = grammar.initial()
+    for ch in text:
+        state = grammar.step(state, ch)
+        if state is None:
+            return None
+    return state
+
+
+def doc(score="7.5", idx="2", risk='"low"', tags='["a", "b"]'):
+    return f'{{"score": {score}, "idx": {idx}, "risk": {risk}, "tags": {tags}}}'
+
+
+def test_valid_document_reaches_done():
+    assert run(doc()) == DONE
+    assert run(doc(tags="[]")) == DONE
+    assert run(doc() + " ") is None   # 닫힌 뒤에는 아무것도 못 온다
+
+
+def test_full_schema_accepts_json_dumps():
+    value = {
+        "summary": "요약 \"따옴표\" \\ \n줄바꿈 é",
+        "fit_score": 8.25,
+        "risk_level": "medium",
+        "highlights": ["x"],
+        "pros": [],
+        "cons": ["y", "z"],
+        "checklist": ["c"],
+        "questions_for_seller": ["q"],
+        "recommendation": "r",
+    }
+    assert run(json.dumps(value, ensure_ascii=False), _Grammar(SCHEMAS["single_buy"])) == DONE
+    assert run(json.dumps(value), _Grammar(SCHEMAS["single_buy"])) == DONE   # \uXXXX 이스케이프
+
+
+@pytest.mark.parametrize("score", ["0", "-0", "10", "-3.25", "0.5", "7.0"])
+def test_number_accepts(score):
+    assert run(doc(score=score)) == DONE
+
+
+@pytest.mark.parametrize("score", ["01", "-", "1.", ".5", "+1", "--1", "1e3", "NaN"])
+def test_number_rejects(score):
+    assert run(doc(score=score)) is None
+
+
+def test_int_field_rejects_fraction():
+    assert run(doc(idx="3")) == DONE
+    assert run(doc(idx="3.0")) is None
+
+
+def test_number_ends_on_separator():
+    # 숫자는 구분자를 보고서야 끝난다 (pop_retry → 부모가 같은 문자를 처리)
+    state = run('{"score": 7')
+    assert state is not None and state[-1][0] == "num"
+    assert run('{"score": 7,')[-1][0] == "prog"
+    assert run('{"score": 7 ,') is not None
+
+
+@pytest.mark.parametrize("risk", ['"low"', '"medium"', '"high"'])
+def test_enum_accepts(risk):
+    assert run(doc(risk=risk)) == DONE
+
+
+@pytest.mark.parametrize("risk", ['"lo"', '"lowx"', '"Low"', '"none"', '""', "low"])
+def test_enum_rejects(risk):
+    assert run(doc(risk=risk)) is None
+
+
+def test_whitespace_cap_between_tokens():
+    pad = " " * _MAX_WS
+    assert run("{" + pad + '"score"') is not None
+    assert run("{" + pad + ' "score"') is None
+    assert run('{"score":' + "\n" * _MAX_WS + "1") is not None
+    assert run('{"score":' + "\n" * (_MAX_WS + 1) + "1") is None
+
+
+def test_whitespace_cap_in_list():
+    head = '{"score": 1, "idx": 1, "risk": "low", "tags": ['
+    assert run(head + " " * _MAX_WS + '"a"') is not None
+    assert run(head + " " * (_MAX_WS + 1)) is None
+    # 원소마다 공백 수는 새로 센다
+    assert run(head + '"a"' + " " * _MAX_WS + "," + " " * _MAX_WS + '"b"]}') == DONE
+
+
+def test_in_free_string():
+    assert GRAMMAR.in_free_string(run('{"score": 1, "idx": 1, "risk": "low", "tags": ["ab'))
+    assert not GRAMMAR.in_free_string(run('{"score": 1, "idx": 1, "risk": "l'))
+    assert not GRAMMAR.in_free_string(DONE)
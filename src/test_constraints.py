@@ -0,0 +1,82 @@
+# test_constraints.py
+# constraints.extract 의 메모 → 조건 해석 확인 (python -m pytest -q src)
+import pytest
+
+import constraints
+from vehicle import Vehicle
+
+
+@pytest.mark.parametrize("note, krw", [
+    ("1500만원 이하", 15_000_000),
+    ("2천까지", 20_000_000),
+    ("1억 2천만 안쪽", 120_000_000),
+    ("예산 1500", 15_000_000),
+    ("예산은 2천", 20_000_000),
+    # 앞에 오는 상한
+    ("최대 1500만원", 15_000_000),
+    ("상한은 2천", 20_000_000),
+    # 범위는 윗값 (단위가 뒤에만 있어도)
+    ("1500~2000만원", 20_000_000),
+    ("예산 1500~2000만원", 20_000_000),
+    ("1천-2천만원 사이", 20_000_000),
+    ("1억에서 1억 5천", 150_000_000),
+    # N만원대
+    ("2000만원대", 20_000_000),
+    ("2천만원대 SUV", 20_000_000),
+    # 안에서 / 으로
+    ("1500만원 안에서 찾아요", 15_000_000),
+    ("2천으로 알아보는 중", 20_000_000),
+    # 여러 금액이면 필터는 가장 큰 상한
+    ("2천까지 보는데 1500만원 이하면 더 좋음", 20_000_000),
+    ("2000만원 대출 받아서 살 예정, 2500만원 이하", 25_000_000),
+])
+def test_price_upper(note, krw):
+    assert constraints.extract(note).max_price_krw == krw
+
+
+@pytest.mark.parametrize("note", [
+    "1500만원 대비 싸게",
+    "1500만원대비 싸게",
+    "2000만원 대출 예정",
+    "2000만원대출",
+    "최대 5만km",
+    "월 최대 30만원",
+    "월 50~60만원",
+    "보험료는 100만원 이하",
+    "20대 후반 직장인",
+])
+def test_not_price(note):
+    assert constraints.extract(note).max_price_krw is None
+
+
+def test_preferred_price_is_smallest_upper():
+    c = constraints.extract("2천까지 보는데 1500만원 이하면 더 좋음")
+    assert (c.max_price_krw, c.preferred_price_krw) == (20_000_000, 15_000_000)
+    assert constraints.extract("2000만원 이하").preferred_price_krw == 20_000_000
+    assert constraints.extract("무사고").preferred_price_krw is None
+
+
+def test_range_skips_monthly_but_keeps_total():
+    assert constraints.extract("월 50~60만원, 총 1억 이하").max_price_krw == 100_000_000
+
+
+def test_other_fields():
+    c = constraints.extract("2019년식 이후, 주행 5만km 이하, 무사고, 1500만원 이하")
+    assert c == constraints.Constraints(
+        max_price_krw=15_000_000, min_year=2019, max_mileage_km=50_000, no_accident=True,
+        preferred_price_krw=15_000_000,
+    )
+    assert constraints.extract("사고 이력은 상관없음").no_accident is False
+    assert constraints.extract("") is constraints.NONE
+
+
+def test_partition():
+    c = constraints.extract("1500만원 이하, 2019년식 이후")
+    cars = [
+        Vehicle(title="A", year=2020, price_krw=14_000_000),
+        Vehicle(title="B", year=2018, price_krw=12_000_000),
+        Vehicle(title="C", year=2021, price_krw=None),
+    ]
+    within, violated = constraints.partition(cars, c)
+    assert within == [0, 2]
+    assert violated == {1: ["연식 2018년"]}
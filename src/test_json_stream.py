@@ -0,0 +1,90 @@
+# test_json_stream.py
+# json_stream.StreamingJSONParser 확인: 복구 / <think> / 느슨한 문법 / 조각 단위 feed (python -m pytest -q src)
+import pytest
+
+from json_stream import StreamingJSONParser, extract_result, looks_like_result
+
+RESULT = '{"summary": "좋음", "pros": ["연비", "공간"], "fit_score": 8.5}'
+EXPECTED = {"summary": "좋음", "pros": ["연비", "공간"], "fit_score": 8.5}
+
+
+def feed_chunks(text, size):
+    parser = StreamingJSONParser()
+    events = []
+    for i in range(0, len(text), size):
+        events += parser.feed(text[i:i + size])
+    return parser, events
+
+
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_events_do_not_depend_on_chunking(size):
+    parser, events = feed_chunks("앞 잡담 " + RESULT + " 뒤 잡담", size)
+    assert parser.result() == EXPECTED
+    assert [(e.kind, e.key) for e in events] == [
+        ("field", "summary"),
+        ("item", "pros"), ("item", "pros"), ("field", "pros"),
+        ("field", "fit_score"),
+        ("object", ""),
+    ]
+    assert [e.index for e in events if e.kind == "item"] == [0, 1]
+
+
+def test_abort_then_recover_at_next_object():
+    # 깨진 객체는 버리고 다음 '{' 부터 다시
+    parser = StreamingJSONParser()
+    parser.feed('{"summary": oops} 설명 {bad json ')
+    assert parser.objects == [] and parser.depth == 0
+    parser.feed(RESULT)
+    assert parser.objects == [EXPECTED]
+
+
+def test_abort_mid_string_resets_state():
+    parser = StreamingJSONParser()
+    parser.feed('{"a" x "b"} ')
+    assert not parser.in_string and parser.depth == 0
+    parser.feed('{"summary": "ok"}')
+    assert parser.result() == {"summary": "ok"}
+
+
+def test_bad_literal_aborts():
+    parser = StreamingJSONParser()
+    parser.feed('{"fit_score": 8.5.1, "summary": "x"}')
+    assert parser.objects == []
+
+
+def test_think_block_is_ignored():
+    text = '<think>{"summary": "초안"} 고민 중 {</think>\n' + RESULT
+    for size in (1, 4, len(text)):
+        parser, _ = feed_chunks(text, size)
+        assert parser.objects == [EXPECTED]
+
+
+def test_unclosed_think_hides_everything():
+    parser = StreamingJSONParser()
+    parser.feed("<think>" + RESULT)
+    assert parser.objects == []
+
+
+def test_single_quotes_and_python_literals():
+    parser = StreamingJSONParser()
+    parser.feed("{'summary': 'it\\'s \"ok\"', 'pros': ['a',], 'risk': None, 'ok': True,}")
+    assert parser.result() == {"summary": "it's \"ok\"", "pros": ["a"], "risk": None, "ok": True}
+
+
+def test_quote_kinds_do_not_close_each_other():
+    parser = StreamingJSONParser()
+    parser.feed("{\"summary\": \"it's\", 'cons': 'say \"hi\"'}")
+    assert parser.result() == {"summary": "it's", "cons": 'say "hi"'}
+
+
+def test_escapes_and_unicode():
+    parser = StreamingJSONParser()
+    parser.feed('{"summary": "a\\nb\\t\\u00e9\\uac00"}')
+    assert parser.result() == {"summary": "a\nb\té가"}
+
+
+def test_code_fence_and_last_result_wins():
+    text = '```json\n{"note": 1}\n```\n' + RESULT + '\n{"summary": "마지막"}'
+    assert extract_result(text) == {"summary": "마지막"}
+    assert not looks_like_result({"note": 1})
+    assert extract_result("") is None
@@ -0,0 +1,222 @@
+# vehicle.py
+# 목적: 매물 1대를 입력 시점에 한 번만 검증/변환해 두는 타입 (Vehicle)
+# - price_krw / year / mileage_km 는 int 로 ('1,850만원', '48,000km', '2021년' 같은 문자열도 여기서 한 번만 변환)
+# - 모르는 키는 extra 에 그대로 보관 → to_dict() 로 원래 정보가 빠짐없이 돌아온다
+# - __slots__ (dataclass(slots=True)) 라 매물 수천 대를 들고 있어도 dict 보다 가볍다
+# - 이후 단계(카드 UI, 사전 랭킹, 멀티 압축, 예산 체크)는 .get / int(...) 재시도 없이 속성만 읽는다
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+VehicleLike = Union["Vehicle", Dict[str, Any]]
+
+
+# ==============================
+# 1. 값 변환 (입력 시 1회)
+# ==============================
+
+_KRW = re.compile(r"(?:(\d+(?:\.\d+)?)억)?(?:(\d+(?:\.\d+)?)만)?(\d+)?원?")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_YEAR = re.compile(r"(19|20)\d{2}")
+
+
+def _bad(key: str, value: Any) -> ValueError:
+    return ValueError(f"{key} 값을 읽을 수 없습니다: {value!r}")
+
+
+def _to_krw(key: str, value: Any) -> Optional[int]:
+    """18500000 / '18,500,000원' / '1850만원' / '1억 2000만' → 원 단위 int."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise _bad(key, value)
+    if isinstance(value, (int, float)):
+        return int(round(value))
+    if isinstance(value, str):
+        m = _KRW.fullmatch(value.replace(",", "").replace(" ", ""))
+        if m and any(m.groups()):
+            eok, man, won = m.groups()
+            return int(round(float(eok or 0) * 100_000_000 + float(man or 0) * 10_000 + int(won or 0)))
+    raise _bad(key, value)
+
+
+def _to_int(key: str, value: Any) -> Optional[int]:
+    """48000 / '48,000km' / '4.8만km' → int."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise _bad(key, value)
+    if isinstance(value, (int, float)):
+        return int(round(value))
+    if isinstance(value, str):
+        text = value.replace(",", "")
+        m = _NUMBER.search(text)
+        if m:
+            num = float(m.group())
+            return int(round(num * 10_000 if "만" in text[m.end():m.end() + 2] else num))
+    raise _bad(key, value)
+
+
+def _to_year(key: str, value: Any) -> Optional[int]:
+    """2021 / '2021년' / '2021.03' → 2021."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        m = _YEAR.search(value)
+        if m:
+            return int(m.group())
+        raise _bad(key, value)
+    return _to_int(key, value)
+
+
+def _to_text(key: str, value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise _bad(key, value)
+
+
+def _to_options(key: str, value: Any) -> Optional[List[str]]:
+    """리스트 그대로 (원소는 str), 쉼표로 이은 문자열이면 나눠서."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return [s.strip() for s in value.split(",") if s.strip()]
+    if isinstance(value, (list, tuple)):
+        return [str(x) for x in value]
+    raise _bad(key, value)
+
+
+def _to_inspection(key: str, value: Any) -> Any:
+    if value is None or isinstance(value, (dict, str)):
+        return value
+    raise _bad(key, value)
+
+
+# 필드 이름 → 변환 함수 (순서 = to_dict() 키 순서)
+_CONVERTERS = {
+    "title": _to_text,
+    "year": _to_year,
+    "mileage_km": _to_int,
+    "price_krw": _to_krw,
+    "color": _to_text,
+    "accident_history": _to_text,
+    "usage_history": _to_text,
+    "options": _to_options,
+    "inspection": _to_inspection,
+    "market_price_hint": _to_text,
+}
+FIELDS = tuple(_CONVERTERS)
+
+
+# ==============================
+# 2. Vehicle
+# ==============================
+
+@dataclass(slots=True)
+class Vehicle:
+    """매물 1대. None = 입력에 없던 필드 (to_dict 에서도 빠진다)."""
+    title: Optional[str] = None
+    year: Optional[int] = None
+    mileage_km: Optional[int] = None
+    price_krw: Optional[int] = None
+    color: Optional[str] = None
+    accident_history: Optional[str] = None
+    usage_history: Optional[str] = None
+    options: Optional[List[str]] = None
+    inspection: Optional[Union[Dict[str, Any], str]] = None   # 보통 {"encar_inspection": ..., "comments": ...}
+    market_price_hint: Optional[str] = None
+    extra: Optional[Dict[str, Any]] = None   # 위에 없는 키 (없으면 None, 빈 dict 를 매물마다 만들지 않는다)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Vehicle":
+        """dict → Vehicle (검증 + 타입 변환). 읽을 수 없는 값이면 ValueError."""
+        if not isinstance(data, dict):
+            raise ValueError(f"매물은 dict 여야 합니다: {type(data).__name__}")
+        values: Dict[str, Any] = {}
+        extra: Optional[Dict[str, Any]] = None
+        for k, v in data.items():
+            conv = _CONVERTERS.get(k)
+            if conv is not None:
+                values[k] = conv(k, v)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[k] = v
+        return cls(extra=extra, **values)
+
+    def to_dict(self, keys: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Vehicle → dict (없는 필드는 빼고, extra 는 뒤에).
+        - keys: 이 키들만 (그 순서대로). 멀티 압축처럼 일부 필드만 필요할 때 전체를 만들지 않는다
+        """
+        if keys is None:
+            out = {k: getattr(self, k) for k in FIELDS if getattr(self, k) is not None}
+            if self.extra:
+                out.update(self.extra)
+            return out
+        out = {}
+        for k in keys:
+            val = self.get(k)
+            if val is not None:
+                out[k] = val
+        return out
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """dict 처럼 키로 읽기 (예전 dict 기반 코드 호환용)."""
+        if key in _CONVERTERS:
+            val = getattr(self, key)
+        else:
+            val = self.extra.get(key) if self.extra else None
+        return default if val is None else val
+
+    @classmethod
+    def from_json(cls, text: str) -> "Vehicle":
+        return cls.from_dict(json.loads(text))
+
+    def to_json(self, indent: Optional[int] = None) -> str:
+        separators = None if indent is not None else (",", ":")
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=indent, separators=separators)
+
+
+# ==============================
+# 3. 입력 도우미
+# ==============================
+
+def as_vehicle(v: VehicleLike) -> Vehicle:
+    """Vehicle 은 그대로, dict 는 변환 (이미 변환된 매물은 다시 검사하지 않는다)."""
+    return v if isinstance(v, Vehicle) else Vehicle.from_dict(v)
+
+
+def parse_listings(obj: Any) -> List[Vehicle]:
+    """
+    매물 1대(dict/Vehicle) 또는 여러 대(list) → List[Vehicle].
+    - 앱 입력 / RPC 로 받은 JSON 을 여기서 한 번만 변환한다
+    - 몇 번째 매물이 잘못됐는지 ValueError 메시지에 넣는다
+    """
+    if isinstance(obj, (dict, Vehicle)):
+        return [as_vehicle(obj)]
+    if not isinstance(obj, (list, tuple)):
+        raise ValueError("vehicle_data는 dict 또는 dict 리스트여야 합니다.")
+    out: List[Vehicle] = []
+    for n, v in enumerate(obj, start=1):
+        if not isinstance(v, (dict, Vehicle)):
+            raise ValueError("리스트 안에는 차량 dict만 들어가야 합니다.")
+        try:
+            out.append(as_vehicle(v))
+        except ValueError as e:
+            raise ValueError(f"매물 {n}: {e}") from None
+    return out
+
+
+def listings_from_json(text: str) -> List[Vehicle]:
+    return parse_listings(json.loads(text))
+
+
+def listings_to_json(vehicles: Sequence[Vehicle], indent: Optional[int] = None) -> str:
+    separators = None if indent is not None else (",", ":")
+    return json.dumps([v.to_dict() for v in vehicles], ensure_ascii=False, indent=indent, separators=separators)